@@ -0,0 +1,187 @@
+"""
+Depth to groundwater statistics and trends, computed for many hydrographs at once. Input is the daily level of the
+aggregate pyramid of each hydrograph, concatenated and sorted by hydrograph and time, so no hydrograph points are
+read. Statistics are computed over all groups with reduceat/bincount; only Sen's slope, a median of pairwise slopes,
+is computed group by group, on 30-day means.
+
+Count, minimum, maximum and mean are exact statistics of the readings, and seasonal means weight each day by its
+readings. Percentiles and trends are statistics of the daily means instead, named or described as such in
+DESCRIPTIONS: a single day of readings 1, 2, 3 and 9 has a daily median of 3.75.
+
+Times are hours counted from January 1st, which places the seasons: winter is December to February.
+Trends are in feet per year, positive when the depth to groundwater increases.
+"""
+import numpy as np
+
+HOURS_PER_YEAR = 8766.0
+HOURS_PER_MONTH = 720  #: 30-day buckets used for Sen's slope
+SEASONS = ('winter', 'spring', 'summer', 'autumn')
+PERCENTILES = (10, 50, 90)
+SEN_MAX_POINTS = 240  #: 30-day means per record used for Sen's slope, evenly spaced beyond that
+DRAWDOWN_WINDOW = HOURS_PER_YEAR  #: hours at the end of each record used for the drawdown rate
+
+METRICS = (
+    'count', 'minimum', 'maximum', 'mean', 'daily_p10', 'daily_median', 'daily_p90',
+    'winter_mean', 'spring_mean', 'summer_mean', 'autumn_mean',
+    'linear_trend', 'sens_slope', 'drawdown_rate',
+)
+UNITS = {
+    'count': 'points',
+    'linear_trend': 'ft/yr',
+    'sens_slope': 'ft/yr',
+    'drawdown_rate': 'ft/yr',
+}
+DESCRIPTIONS = {
+    'count': 'Number of readings.',
+    'minimum': 'Lowest reading.',
+    'maximum': 'Highest reading.',
+    'mean': 'Mean of the readings.',
+    'daily_p10': '10th percentile of the daily means.',
+    'daily_median': 'Median of the daily means.',
+    'daily_p90': '90th percentile of the daily means.',
+    'winter_mean': 'Mean of the readings of the days from December to February.',
+    'spring_mean': 'Mean of the readings of the days from March to May.',
+    'summer_mean': 'Mean of the readings of the days from June to August.',
+    'autumn_mean': 'Mean of the readings of the days from September to November.',
+    'linear_trend': 'Least squares slope of the daily means.',
+    'sens_slope': 'Median slope between pairs of 30-day means, at most {0} of them evenly spaced over the '
+                  'record.'.format(SEN_MAX_POINTS),
+    'drawdown_rate': 'Least squares slope of the daily means over the last year of the record.',
+}
+
+
+def group_starts(ids):
+    """
+    Indices where each run of equal ids starts in a sorted array of ids.
+    """
+    return np.flatnonzero(np.r_[True, ids[1:] != ids[:-1]])
+
+
+def season_index(times):
+    """
+    Season of each time: 0 winter (Dec-Feb), 1 spring, 2 summer, 3 autumn.
+    """
+    month = ((times % HOURS_PER_YEAR) * (12.0 / HOURS_PER_YEAR)).astype(int)
+    return (month + 1) // 3 % 4
+
+
+def linear_trends(groups, num_groups, times, values):
+    """
+    Least squares slope of values over times for each group, per hour. NaN for groups with fewer than two times.
+    """
+    k = np.bincount(groups, minlength=num_groups).astype(float)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        t_mean = np.bincount(groups, weights=times, minlength=num_groups) / k
+        y_mean = np.bincount(groups, weights=values, minlength=num_groups) / k
+
+        # Center per group before multiplying, large hour counts would otherwise lose precision
+        dt = times - t_mean[groups]
+        dy = values - y_mean[groups]
+        sxx = np.bincount(groups, weights=dt * dt, minlength=num_groups)
+        sxy = np.bincount(groups, weights=dt * dy, minlength=num_groups)
+
+        return np.where(sxx > 0, sxy / sxx, np.nan)
+
+
+def sens_slope(times, values, max_points=SEN_MAX_POINTS):
+    """
+    Median of the slopes between all pairs of points, per hour. NaN with fewer than two points.
+    """
+    if len(times) > max_points:
+        keep = np.linspace(0, len(times) - 1, max_points).astype(int)
+        times, values = times[keep], values[keep]
+
+    first, second = np.triu_indices(len(times), k=1)
+    dt = times[second] - times[first]
+    valid = dt != 0
+
+    if not valid.any():
+        return np.nan
+
+    return float(np.median((values[second] - values[first])[valid] / dt[valid]))
+
+
+def group_percentiles(groups, starts, sizes, values, percentiles=PERCENTILES):
+    """
+    Linearly interpolated percentiles of values for each group, as {percentile: array}.
+    """
+    ordered = values[np.lexsort((values, groups))]
+    result = {}
+
+    for percentile in percentiles:
+        position = (sizes - 1) * (percentile / 100.0)
+        low = np.floor(position).astype(int)
+        high = np.ceil(position).astype(int)
+        result[percentile] = ordered[starts + low] + (ordered[starts + high] - ordered[starts + low]) * (position - low)
+
+    return result
+
+
+def compute_statistics(ids, times, counts, mins, means, maxs):
+    """
+    Compute METRICS for each hydrograph from its daily aggregates, given as parallel arrays sorted by id and time.
+    Returns {id: {metric: value}}, values None where undefined. Percentiles are those of the daily means.
+    """
+    if len(ids) == 0:
+        return {}
+
+    ids = np.asarray(ids)
+    times = np.asarray(times, dtype=float)
+    counts = np.asarray(counts, dtype=float)
+    means = np.asarray(means, dtype=float)
+
+    starts = group_starts(ids)
+    num_groups = len(starts)
+    sizes = np.diff(np.r_[starts, len(ids)])
+    groups = np.repeat(np.arange(num_groups), sizes)
+
+    total = np.add.reduceat(counts, starts)
+    columns = {
+        'count': total,
+        'minimum': np.minimum.reduceat(np.asarray(mins, dtype=float), starts),
+        'maximum': np.maximum.reduceat(np.asarray(maxs, dtype=float), starts),
+        'mean': np.add.reduceat(means * counts, starts) / total,
+    }
+
+    for percentile, values in group_percentiles(groups, starts, sizes, means).items():
+        columns['daily_median' if percentile == 50 else 'daily_p{0}'.format(percentile)] = values
+
+    # Seasonal means, weighted by the points behind each daily mean
+    keys = groups * len(SEASONS) + season_index(times)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        seasonal = np.bincount(keys, weights=means * counts, minlength=num_groups * len(SEASONS)) / \
+            np.bincount(keys, weights=counts, minlength=num_groups * len(SEASONS))
+    seasonal = seasonal.reshape(num_groups, len(SEASONS))
+    for season, name in enumerate(SEASONS):
+        columns['{0}_mean'.format(name)] = seasonal[:, season]
+
+    columns['linear_trend'] = linear_trends(groups, num_groups, times, means) * HOURS_PER_YEAR
+
+    # Drawdown rate: the trend over the last DRAWDOWN_WINDOW hours of each record
+    end_times = np.maximum.reduceat(times, starts)
+    recent = times >= end_times[groups] - DRAWDOWN_WINDOW
+    columns['drawdown_rate'] = linear_trends(groups[recent], num_groups, times[recent], means[recent]) * \
+        HOURS_PER_YEAR
+
+    # Sen's slope on 30-day means
+    months = np.floor(times / HOURS_PER_MONTH)
+    month_starts = np.flatnonzero(np.r_[True, (groups[1:] != groups[:-1]) | (months[1:] != months[:-1])])
+    month_groups = groups[month_starts]
+    month_times = months[month_starts] * HOURS_PER_MONTH
+    month_means = np.add.reduceat(means * counts, month_starts) / np.add.reduceat(counts, month_starts)
+    group_month_starts = np.r_[group_starts(month_groups), len(month_groups)]
+
+    columns['sens_slope'] = np.array([
+        sens_slope(month_times[first:last], month_means[first:last])
+        for first, last in zip(group_month_starts[:-1], group_month_starts[1:])
+    ]) * HOURS_PER_YEAR
+
+    statistics = {}
+    for group, hydrograph_id in enumerate(ids[starts].tolist()):
+        statistics[hydrograph_id] = {
+            metric: None if not np.isfinite(columns[metric][group]) else float(columns[metric][group])
+            for metric in METRICS
+        }
+        statistics[hydrograph_id]['count'] = int(total[group])
+
+    return statistics
@@ -1,5 +1,5 @@
 from tethys_sdk.base import TethysAppBase, url_map_maker
-from tethys_sdk.app_settings import PersistentStoreDatabaseSetting
+from tethys_sdk.app_settings import PersistentStoreDatabaseSetting, CustomSetting
 from tethys_sdk.permissions import Permission, PermissionGroup
 
 class WellInventory(TethysAppBase):
@@ -35,16 +35,66 @@ class WellInventory(TethysAppBase):
                 url='well-inventory/wells/add',
                 controller='well_inventory.controllers.add_well'
             ),
+            UrlMap(
+                name='import_wells',
+                url='well-inventory/wells/import',
+                controller='well_inventory.controllers.import_wells'
+            ),
             UrlMap(
                 name='wells',
                 url='well-inventory/wells',
                 controller='well_inventory.controllers.list_wells'
             ),
+            UrlMap(
+                name='wells_table_data',
+                url='well-inventory/wells/table',
+                controller='well_inventory.controllers.wells_table_data'
+            ),
+            UrlMap(
+                name='wells_geojson',
+                url='well-inventory/wells/geojson',
+                controller='well_inventory.controllers.wells_geojson'
+            ),
+            UrlMap(
+                name='well_tiles',
+                url='well-inventory/wells/tiles/{z}/{x}/{y}',
+                controller='well_inventory.controllers.well_tiles'
+            ),
+            UrlMap(
+                name='wells_bbox',
+                url='well-inventory/wells/bbox',
+                controller='well_inventory.controllers.wells_in_bbox'
+            ),
             UrlMap(
                 name='assign_hydrograph',
                 url='well-inventory/hydrographs/assign',
                 controller='well_inventory.controllers.assign_hydrograph'
             ),
+            UrlMap(
+                name='ingest_job',
+                url='well-inventory/hydrographs/jobs/{job_id}',
+                controller='well_inventory.controllers.ingest_job'
+            ),
+            UrlMap(
+                name='ingest_job_status',
+                url='well-inventory/hydrographs/jobs/{job_id}/status',
+                controller='well_inventory.controllers.ingest_job_status'
+            ),
+            UrlMap(
+                name='compare_hydrographs',
+                url='well-inventory/hydrographs/compare',
+                controller='well_inventory.controllers.compare_hydrographs'
+            ),
+            UrlMap(
+                name='export_hydrographs',
+                url='well-inventory/hydrographs/export',
+                controller='well_inventory.controllers.export_hydrographs'
+            ),
+            UrlMap(
+                name='hydrograph_statistics',
+                url='well-inventory/hydrographs/statistics',
+                controller='well_inventory.controllers.hydrograph_statistics'
+            ),
             UrlMap(
                 name='hydrograph',
                 url='well-inventory/hydrographs/{hydrograph_id}',
@@ -55,6 +105,26 @@ class WellInventory(TethysAppBase):
                 url='well-inventory/hydrographs/{well_id}/ajax',
                 controller='well_inventory.controllers.hydrograph_ajax'
             ),
+            UrlMap(
+                name='hydrograph_popup',
+                url='well-inventory/hydrographs/{well_id}/popup',
+                controller='well_inventory.controllers.hydrograph_popup'
+            ),
+            UrlMap(
+                name='hydrograph_data',
+                url='well-inventory/hydrographs/{well_id}/data',
+                controller='well_inventory.controllers.hydrograph_data'
+            ),
+            UrlMap(
+                name='telemetry',
+                url='well-inventory/api/telemetry',
+                controller='well_inventory.controllers.telemetry'
+            ),
+            UrlMap(
+                name='metrics',
+                url='well-inventory/metrics',
+                controller='well_inventory.controllers.metrics'
+            ),
             UrlMap(
                 name='delete_well',
                 url='well-inventory/delete_well/{well_id}',
@@ -79,6 +149,101 @@ class WellInventory(TethysAppBase):
 
         return ps_settings
 
+    def custom_settings(self):
+        """
+        Define Custom Settings.
+        """
+        custom_settings = (
+            CustomSetting(
+                name='hydrograph_storage',
+                type=CustomSetting.TYPE_STRING,
+                description='Storage backend for new hydrographs: "points" (one row per sample) or '
+                            '"columnar" (one compressed array per hydrograph).',
+                required=False,
+                default='points'
+            ),
+            CustomSetting(
+                name='max_concurrent_ingests',
+                type=CustomSetting.TYPE_INTEGER,
+                description='Number of hydrograph uploads processed at the same time by background workers.',
+                required=False,
+                default=2
+            ),
+            CustomSetting(
+                name='figure_cache_backend',
+                type=CustomSetting.TYPE_STRING,
+                description='Where rendered hydrograph plots are cached: "memory" (per process), "django" '
+                            '(the site cache) or "file" (app workspace, shared by processes on one host).',
+                required=False,
+                default='memory'
+            ),
+            CustomSetting(
+                name='figure_cache_size',
+                type=CustomSetting.TYPE_INTEGER,
+                description='Maximum number of rendered hydrograph plots kept in the figure cache.',
+                required=False,
+                default=256
+            ),
+            CustomSetting(
+                name='db_pool_size',
+                type=CustomSetting.TYPE_INTEGER,
+                description='Database connections kept open by each web server process.',
+                required=False,
+                default=10
+            ),
+            CustomSetting(
+                name='db_max_overflow',
+                type=CustomSetting.TYPE_INTEGER,
+                description='Extra database connections a process may open under load beyond the pool size.',
+                required=False,
+                default=10
+            ),
+            CustomSetting(
+                name='db_pool_recycle',
+                type=CustomSetting.TYPE_INTEGER,
+                description='Seconds after which a pooled database connection is replaced.',
+                required=False,
+                default=1800
+            ),
+            CustomSetting(
+                name='db_pool_pre_ping',
+                type=CustomSetting.TYPE_BOOLEAN,
+                description='Test pooled database connections before use, replacing ones the server has dropped.',
+                required=False,
+                default=True
+            ),
+            CustomSetting(
+                name='telemetry_buffer_size',
+                type=CustomSetting.TYPE_INTEGER,
+                description='Logger readings a process holds before the telemetry API asks clients to retry later.',
+                required=False,
+                default=200000
+            ),
+            CustomSetting(
+                name='telemetry_flush_size',
+                type=CustomSetting.TYPE_INTEGER,
+                description='Buffered logger readings that trigger a write to the database.',
+                required=False,
+                default=10000
+            ),
+            CustomSetting(
+                name='telemetry_flush_seconds',
+                type=CustomSetting.TYPE_FLOAT,
+                description='Longest time logger readings wait in the buffer before they are written.',
+                required=False,
+                default=2.0
+            ),
+            CustomSetting(
+                name='enable_metrics',
+                type=CustomSetting.TYPE_BOOLEAN,
+                description='Serve request latency percentiles in the Prometheus text format at /metrics/.',
+                required=False,
+                default=False
+            ),
+        )
+
+        return custom_settings
+
     def permissions(self):
         """
         Define permissions for the app.
@@ -88,11 +253,21 @@ class WellInventory(TethysAppBase):
             description='Add wells to inventory'
         )
 
+        ingest_telemetry = Permission(
+            name='ingest_telemetry',
+            description='Push logger readings through the telemetry API'
+        )
+
         admin = PermissionGroup(
             name='admin',
-            permissions=(add_wells,)
+            permissions=(add_wells, ingest_telemetry)
+        )
+
+        loggers = PermissionGroup(
+            name='loggers',
+            permissions=(ingest_telemetry,)
         )
 
-        permissions = (admin,)
+        permissions = (admin, loggers)
 
         return permissions
\ No newline at end of file
@@ -0,0 +1,516 @@
+"""
+Benchmarks of the app's hot paths. Run them through the command line tools:
+    python -m tethysapp.well_inventory.cli benchmark --baseline baseline.json
+    python -m tethysapp.well_inventory.cli benchmark-sessions --threads 8 --seconds 10
+    python -m tethysapp.well_inventory.cli benchmark-points --points 100000000 --database-url postgresql://...
+    python -m tethysapp.well_inventory.cli benchmark-telemetry --wells 1000 --batch-size 1000 --seconds 30
+
+The benchmark suite seeds synthetic inventories into a scratch database (never primary_db), measures latency,
+peak memory and query counts of the controllers and of hydrograph ingest, and compares the results against a
+stored baseline. benchmark-points does the same for point lookups and replaces on a large hydrograph_points table.
+benchmark-telemetry measures sustained logger readings per second through one telemetry buffer.
+benchmark-sessions runs against the configured primary_db.
+"""
+import os
+import json
+import time
+import datetime
+import platform
+import tempfile
+import threading
+import tracemalloc
+from contextlib import contextmanager
+
+import numpy as np
+from sqlalchemy import create_engine, select
+
+from .app import WellInventory as app
+from . import db, helpers, model, storage, telemetry
+from .figures import get_figure_cache
+from .instrumentation import recording
+from .ingest import CHUNK_SIZE
+
+SESSION_MODES = ('per-call', 'pooled')
+
+WELL_COUNTS = (1000, 10000, 100000)
+POINT_COUNTS = (1000, 100000, 1000000, 10000000)
+HYDROGRAPH_WELLS = 100  #: wells of each inventory given a short hydrograph, so the wells table joins real rows
+HYDROGRAPH_WELL_POINTS = 1000
+POINTS_TABLE_SIZE = 100000000  #: hydrograph_points rows seeded by the points table benchmark
+POINTS_TABLE_HYDROGRAPHS = 1000
+LOOKUP_WINDOW = 720  #: hours read by a point lookup, one month
+TELEMETRY_WELLS = 1000
+TELEMETRY_BATCH_SIZE = 1000  #: readings per simulated logger request
+REPEAT = 5  #: timed calls per measurement
+TOLERANCE = 0.25  #: allowed slowdown or memory growth over the baseline, as a fraction
+SEED = 42
+
+
+def request_mix(well_ids):
+    """
+    The database work of one map page visit, one wells table page and one hydrograph popup.
+    """
+    model.get_wells_center()
+    model.get_wells_page(limit=10)
+
+    for well_id in well_ids:
+        helpers.get_hydrograph_data(well_id, plot_width=helpers.POPUP_PLOT_WIDTH)
+
+
+@contextmanager
+def per_call_sessions():
+    """
+    Give every function a new engine and session, as before sessions were shared, closing them at request end.
+    """
+    opened = threading.local()
+
+    def get_session():
+        Session = app.get_persistent_store_database('primary_db', as_sessionmaker=True)
+        session = Session()
+        opened.sessions = getattr(opened, 'sessions', []) + [session]
+        return session
+
+    def remove_session(**kwargs):
+        for session in getattr(opened, 'sessions', []):
+            session.close()
+        opened.sessions = []
+
+    saved = model.get_session, helpers.get_session, db.remove_session
+    model.get_session = helpers.get_session = get_session
+    db.remove_session = remove_session
+
+    try:
+        yield
+    finally:
+        model.get_session, helpers.get_session, db.remove_session = saved
+
+
+def run_concurrently(work, threads, seconds):
+    """
+    Call work() from a number of threads for a number of seconds. Returns the latencies of all calls, in seconds.
+    """
+    deadline = time.time() + seconds
+    latencies = []
+    lock = threading.Lock()
+
+    def worker():
+        local = []
+        while time.time() < deadline:
+            start = time.time()
+            work()
+            db.remove_session()
+            local.append(time.time() - start)
+
+        with lock:
+            latencies.extend(local)
+
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+
+    return latencies
+
+
+def benchmark_sessions(threads=8, seconds=10.0, modes=SESSION_MODES):
+    """
+    Measure requests per second of request_mix under concurrent load with per-call and pooled sessions.
+    Returns {mode: {'requests', 'requests_per_second', 'mean_ms'}}.
+    """
+    well_ids = [well.well_id for well in model.get_wells_page(limit=5)[2] if well.hydrograph_id]
+    db.remove_session()
+    results = {}
+
+    for mode in modes:
+        if mode == 'per-call':
+            with per_call_sessions():
+                latencies = run_concurrently(lambda: request_mix(well_ids), threads, seconds)
+        else:
+            latencies = run_concurrently(lambda: request_mix(well_ids), threads, seconds)
+
+        results[mode] = {
+            'requests': len(latencies),
+            'requests_per_second': len(latencies) / seconds,
+            'mean_ms': 1000.0 * sum(latencies) / len(latencies) if latencies else 0.0,
+        }
+
+    return results
+
+
+def synthetic_wells(num_wells, seed=SEED):
+    """
+    Generate import rows for num_wells wells scattered over the contiguous United States.
+    """
+    random = np.random.RandomState(seed)
+    longitudes = random.uniform(-124.0, -67.0, num_wells)
+    latitudes = random.uniform(25.0, 49.0, num_wells)
+    owners = ('Federal', 'State', 'County', 'City', 'Private', 'Other')
+
+    for i in range(num_wells):
+        yield {
+            'site number': 'BENCH{0:07d}'.format(i),
+            'name': 'Benchmark Well {0}'.format(i),
+            'owner': owners[i % len(owners)],
+            'aquifer': 'Aquifer {0}'.format(i % 20),
+            'date built': '2000-01-01',
+            'latitude': float(latitudes[i]),
+            'longitude': float(longitudes[i]),
+        }
+
+
+def synthetic_series(num_points, seed=SEED):
+    """
+    Generate (times, flows) chunks of an hourly hydrograph: a seasonal cycle with a trend and noise.
+    """
+    random = np.random.RandomState(seed)
+
+    for start in range(0, num_points, CHUNK_SIZE):
+        times = np.arange(start, min(start + CHUNK_SIZE, num_points))
+        seasonal = 10.0 * np.sin(2 * np.pi * times / 8766.0)
+        flows = 50.0 + seasonal + 1e-4 * times + random.normal(0.0, 0.5, len(times))
+        yield times, flows
+
+
+def synthetic_hydrograph_file(num_points, seed=SEED):
+    """
+    Lines of a hydrograph csv upload with num_points points.
+    """
+    for times, flows in synthetic_series(num_points, seed):
+        for time_value, flow in zip(times.tolist(), flows.tolist()):
+            yield '{0},{1:.3f}\n'.format(time_value, flow).encode('utf-8')
+
+
+def reset_database(engine):
+    """
+    Empty the scratch database and point the app at it.
+    """
+    model.Base.metadata.drop_all(engine)
+    model.upgrade_schema(engine)
+    db.set_engine(engine)
+    get_figure_cache().clear()
+
+
+def seed_inventory(num_wells):
+    """
+    Import num_wells synthetic wells and give the first HYDROGRAPH_WELLS of them a short hydrograph.
+    """
+    model.import_wells(synthetic_wells(num_wells), batch_size=5000)
+
+    session = db.get_session()
+    wells = session.query(model.Well).order_by(model.Well.id).limit(HYDROGRAPH_WELLS).all()
+
+    for well in wells:
+        well.hydrograph = model.Hydrograph()
+        well.hydrograph.load_series(synthetic_series(HYDROGRAPH_WELL_POINTS, seed=well.id))
+
+    session.commit()
+    db.remove_session()
+
+
+def measure(work, repeat=REPEAT):
+    """
+    Call work() repeat times, returning latency percentiles and the query count of one call, then once more under
+    tracemalloc for its peak Python memory.
+    """
+    latencies = []
+    queries = 0
+
+    for _ in range(repeat):
+        start = time.time()
+        with recording() as record:
+            work()
+        latencies.append(time.time() - start)
+        queries = record['sql_count']
+        db.remove_session()
+
+    tracemalloc.start()
+    try:
+        work()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+        db.remove_session()
+
+    latencies.sort()
+    return {
+        'median_ms': 1000.0 * latencies[len(latencies) // 2],
+        'p95_ms': 1000.0 * latencies[min(int(0.95 * len(latencies)), len(latencies) - 1)],
+        'queries': queries,
+        'peak_kb': peak / 1024.0,
+    }
+
+
+def make_request(path='/apps/well-inventory/', params=None):
+    """
+    Build a GET request from a signed in superuser, for calling controllers directly.
+    """
+    from django.contrib.auth.models import User
+    from django.test import RequestFactory
+
+    request = RequestFactory().get(path, params or {})
+    request.user = User(username='benchmark', is_active=True, is_staff=True, is_superuser=True)
+    request.session = {}
+    return request
+
+
+def benchmark_suite(well_counts=WELL_COUNTS, point_counts=POINT_COUNTS, database_url=None, repeat=REPEAT):
+    """
+    Seed each inventory size, then measure the home, list_wells (with its wells_table_data page), hydrograph,
+    hydrograph_ajax and hydrograph_popup controllers and assign_hydrograph_to_well for each hydrograph size.
+    Returns {'meta': ..., 'results': {name: measurement}}. The scratch database defaults to a SQLite file in the
+    temporary directory.
+    """
+    from . import controllers
+
+    if not database_url:
+        database_url = 'sqlite:///' + os.path.join(tempfile.gettempdir(), 'well_inventory_benchmark.sqlite')
+
+    engine = create_engine(database_url)
+    results = {}
+
+    try:
+        for num_wells in well_counts:
+            reset_database(engine)
+            seed_inventory(num_wells)
+
+            suffix = '[wells={0}]'.format(num_wells)
+            results['home' + suffix] = measure(lambda: controllers.home(make_request()), repeat)
+            results['list_wells' + suffix] = measure(lambda: controllers.list_wells(make_request()), repeat)
+            results['wells_table_data' + suffix] = measure(
+                lambda: controllers.wells_table_data(make_request(params={'draw': 1, 'start': 0, 'length': 25})),
+                repeat)
+
+            well_id = db.get_session().query(model.Well.id).order_by(model.Well.id.desc()).limit(1).scalar()
+            db.remove_session()
+
+            for num_points in point_counts:
+                suffix = '[wells={0},points={1}]'.format(num_wells, num_points)
+
+                results['assign_hydrograph_to_well' + suffix] = measure(
+                    lambda: model.assign_hydrograph_to_well(well_id, synthetic_hydrograph_file(num_points)), 1)
+
+                hydrograph_id = model.get_hydrograph(well_id)
+                db.remove_session()
+
+                def plot_page():
+                    get_figure_cache().clear()
+                    controllers.hydrograph(make_request(), hydrograph_id)
+
+                def plot_popup():
+                    get_figure_cache().clear()
+                    controllers.hydrograph_ajax(make_request(), well_id)
+
+                def json_popup():
+                    get_figure_cache().clear()
+                    controllers.hydrograph_popup(make_request(), well_id)
+
+                results['hydrograph' + suffix] = measure(plot_page, repeat)
+                results['hydrograph_ajax' + suffix] = measure(plot_popup, repeat)
+                results['hydrograph_popup' + suffix] = measure(json_popup, repeat)
+    finally:
+        db.remove_session()
+        engine.dispose()
+
+    return {
+        'meta': {
+            'created': datetime.datetime.utcnow().isoformat(),
+            'database': engine.dialect.name,
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+            'repeat': repeat,
+        },
+        'results': results,
+    }
+
+
+def seed_points_table(num_points, num_hydrographs):
+    """
+    Give num_hydrographs wells a hydrograph stored as points, num_points points in total, committing one
+    hydrograph at a time.
+    """
+    model.import_wells(synthetic_wells(num_hydrographs), batch_size=5000)
+    points_per_hydrograph = max(num_points // num_hydrographs, 1)
+
+    session = db.get_session()
+    well_ids = [well_id for well_id, in session.query(model.Well.id).order_by(model.Well.id)]
+
+    for well_id in well_ids:
+        well = session.query(model.Well).get(well_id)
+        well.hydrograph = model.Hydrograph()
+        well.hydrograph.load_series(synthetic_series(points_per_hydrograph, seed=well_id), backend=storage.POINTS)
+        session.commit()
+        session.expunge_all()
+
+    db.remove_session()
+    return points_per_hydrograph
+
+
+def benchmark_points_table(num_points=POINTS_TABLE_SIZE, num_hydrographs=POINTS_TABLE_HYDROGRAPHS,
+                           database_url=None, repeat=REPEAT, partitions=0):
+    """
+    Seed a points table of num_points rows on a scratch database, optionally hash partitioned (PostgreSQL only),
+    then measure a one-month point lookup, a full series read and a series replace on random hydrographs.
+    Returns results in the format of benchmark_suite.
+    """
+    if not database_url:
+        database_url = 'sqlite:///' + os.path.join(tempfile.gettempdir(), 'well_inventory_benchmark.sqlite')
+
+    engine = create_engine(database_url)
+    random = np.random.RandomState(SEED)
+    results = {}
+
+    try:
+        reset_database(engine)
+        if partitions:
+            model.rebuild_hydrograph_points(engine, partitions)
+
+        points_per_hydrograph = seed_points_table(num_points, num_hydrographs)
+        hydrograph_ids = [row[0] for row in engine.execute(select([model.Hydrograph.id]))]
+
+        def get_hydrograph():
+            return db.get_session().query(model.Hydrograph).get(int(random.choice(hydrograph_ids)))
+
+        def lookup():
+            t0 = int(random.randint(0, max(points_per_hydrograph - LOOKUP_WINDOW, 1)))
+            get_hydrograph().get_series(t0, t0 + LOOKUP_WINDOW)
+
+        def read():
+            get_hydrograph().get_series()
+
+        def replace():
+            hydrograph = get_hydrograph()
+            hydrograph.load_series(synthetic_series(points_per_hydrograph, seed=hydrograph.id), backend=storage.POINTS)
+            db.get_session().commit()
+
+        suffix = '[points={0},hydrographs={1},partitions={2}]'.format(num_points, num_hydrographs, partitions)
+        results['point_lookup' + suffix] = measure(lookup, repeat)
+        results['point_read' + suffix] = measure(read, repeat)
+        results['point_replace' + suffix] = measure(replace, repeat)
+    finally:
+        db.remove_session()
+        engine.dispose()
+
+    return {
+        'meta': {
+            'created': datetime.datetime.utcnow().isoformat(),
+            'database': engine.dialect.name,
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+            'repeat': repeat,
+        },
+        'results': results,
+    }
+
+
+def telemetry_bodies(num_wells, batch_size, seed=SEED):
+    """
+    Endless JSON lines request bodies of batch_size readings each, one reading per well and hour across the wells,
+    so that every flush appends to many hydrographs.
+    """
+    random = np.random.RandomState(seed)
+    site_numbers = ['BENCH{0:07d}'.format(i) for i in range(num_wells)]
+    hour = 0
+    well = 0
+
+    while True:
+        lines = []
+        for _ in range(batch_size):
+            depth = round(random.normal(50.0, 5.0), 3)
+            lines.append(json.dumps({'site': site_numbers[well], 'time': hour, 'depth': depth}))
+            well += 1
+            if well == num_wells:
+                well = 0
+                hour += 1
+
+        yield '\n'.join(lines).encode('utf-8')
+
+
+def benchmark_telemetry(num_wells=TELEMETRY_WELLS, batch_size=TELEMETRY_BATCH_SIZE, seconds=10.0, database_url=None,
+                        capacity=telemetry.DEFAULT_BUFFER_SIZE, flush_size=telemetry.DEFAULT_FLUSH_SIZE,
+                        flush_seconds=telemetry.DEFAULT_FLUSH_SECONDS):
+    """
+    Post requests of batch_size readings to one telemetry buffer as fast as it takes them for seconds, the way the
+    telemetry controller does (parse, resolve wells, add), backing off when it is full, then wait for the buffer to
+    drain. Returns request and write throughput in readings per second, on a scratch database.
+    """
+    if not database_url:
+        database_url = 'sqlite:///' + os.path.join(tempfile.gettempdir(), 'well_inventory_benchmark.sqlite')
+
+    engine = create_engine(database_url)
+    bodies = telemetry_bodies(num_wells, batch_size)
+
+    try:
+        reset_database(engine)
+        model.import_wells(synthetic_wells(num_wells), batch_size=5000)
+        db.remove_session()
+
+        buffer = telemetry.TelemetryBuffer(capacity, flush_size, flush_seconds)
+        requests = rejected = 0
+        start = time.time()
+
+        while time.time() - start < seconds:
+            well_ids, times, depths = telemetry.parse_readings(next(bodies), telemetry.JSON_LINES)
+            try:
+                buffer.add(well_ids, times, depths)
+                requests += 1
+            except telemetry.BufferFull:
+                rejected += 1
+                time.sleep(0.01)
+
+        elapsed = time.time() - start
+
+        while buffer.pending:
+            if not buffer.flush():
+                break
+            time.sleep(0.01)
+
+        drained = time.time() - start
+        stats = buffer.stats()
+    finally:
+        db.remove_session()
+        engine.dispose()
+
+    return {
+        'requests': requests,
+        'rejected_requests': rejected,
+        'accepted': stats['accepted'],
+        'flushed': stats['flushed'],
+        'failed_flushes': stats['failed'],
+        'accepted_per_second': stats['accepted'] / elapsed,
+        'flushed_per_second': stats['flushed'] / drained,
+    }
+
+
+def compare_results(results, baseline, tolerance=TOLERANCE):
+    """
+    Compare benchmark results against a baseline. Returns a list of regression messages: a median latency or peak
+    memory more than tolerance above the baseline, or more queries than the baseline. Benchmarks missing from
+    either side are skipped.
+    """
+    regressions = []
+
+    for name, base in sorted(baseline.get('results', {}).items()):
+        current = results.get('results', {}).get(name)
+        if current is None:
+            continue
+
+        for metric in ('median_ms', 'peak_kb'):
+            if current[metric] > base[metric] * (1.0 + tolerance):
+                regressions.append('{0}: {1} {2:.1f} exceeds baseline {3:.1f} by more than {4:.0%}'.format(
+                    name, metric, current[metric], base[metric], tolerance))
+
+        if current['queries'] > base['queries']:
+            regressions.append('{0}: {1} queries, baseline {2}'.format(name, current['queries'], base['queries']))
+
+    return regressions
+
+
+def save_results(results, path):
+    with open(path, 'w') as results_file:
+        json.dump(results, results_file, indent=2, sort_keys=True)
+
+
+def load_results(path):
+    with open(path) as results_file:
+        return json.load(results_file)
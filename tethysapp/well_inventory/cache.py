@@ -0,0 +1,104 @@
+"""
+Caching of serialized responses. Entries are keyed by the version of the data they were built from
+(see model.CacheVersion), so a version bump invalidates them in every process without explicit deletes.
+"""
+import gzip
+import hashlib
+import json
+
+from django.core.cache import cache
+from django.http import HttpResponse, HttpResponseNotModified
+
+from .model import CacheVersion, get_cache_version, get_well_features, get_wells_center, count_wells
+from .tiles import feature_collection
+
+CACHE_PREFIX = 'well_inventory'
+CACHE_TIMEOUT = 24 * 60 * 60  #: seconds, old versions simply age out
+
+
+def get_wells_version():
+    """
+    Get the current version of the wells data.
+    """
+    return get_cache_version(CacheVersion.WELLS)
+
+
+def get_wells_geojson(version):
+    """
+    Get the gzipped GeoJSON FeatureCollection of all wells at a version, serialized at most once per version.
+    """
+    key = '{0}:wells_geojson:{1}'.format(CACHE_PREFIX, version)
+    body = cache.get(key)
+
+    if body is None:
+        content = json.dumps(feature_collection(get_well_features()), separators=(',', ':'))
+        body = gzip.compress(content.encode('utf-8'))
+        cache.set(key, body, CACHE_TIMEOUT)
+
+    return body
+
+
+def get_map_center(version):
+    """
+    Get the [longitude, latitude] average of the wells at a version, or None if there are none, averaged at most once
+    per version.
+    """
+    key = '{0}:wells_center:{1}'.format(CACHE_PREFIX, version)
+    center = cache.get(key)
+
+    if center is None:
+        # Cache the absence of wells too, so an empty inventory is not averaged on every visit
+        center = get_wells_center() or []
+        cache.set(key, center, CACHE_TIMEOUT)
+
+    return center or None
+
+
+def get_wells_counts(version, search=''):
+    """
+    Get the (total, filtered) counts of the wells table for a search at a version, counted at most once per version.
+    """
+    # Searches are hashed to keep keys short and free of characters some cache backends reject
+    digest = hashlib.sha1(search.encode('utf-8')).hexdigest()
+    key = '{0}:wells_counts:{1}:{2}'.format(CACHE_PREFIX, version, digest)
+    counts = cache.get(key)
+
+    if counts is None:
+        counts = count_wells(search)
+        cache.set(key, counts, CACHE_TIMEOUT)
+
+    return tuple(counts)
+
+
+def etag_matches(request, etag):
+    """
+    Whether the If-None-Match header of a request already holds etag.
+    """
+    return etag in [tag.strip() for tag in request.META.get('HTTP_IF_NONE_MATCH', '').split(',')]
+
+
+def gzip_json_response(request, body, etag):
+    """
+    Respond with a gzipped JSON body, decompressing it for the rare client that does not accept gzip.
+    """
+    if 'gzip' in request.META.get('HTTP_ACCEPT_ENCODING', ''):
+        response = HttpResponse(body, content_type='application/json')
+        response['Content-Encoding'] = 'gzip'
+    else:
+        response = HttpResponse(gzip.decompress(body), content_type='application/json')
+
+    response['ETag'] = etag
+    response['Vary'] = 'Accept-Encoding'
+
+    # Browsers keep the body but check back each time, which costs a 304 until the wells change
+    response['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+def not_modified(etag):
+    """
+    Empty 304 response confirming the client copy for etag is current.
+    """
+    response = HttpResponseNotModified()
+    response['ETag'] = etag
+    return response
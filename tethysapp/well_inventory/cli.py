@@ -0,0 +1,312 @@
+"""
+Command line tools for the Well Inventory app.
+
+Run from an activated Tethys environment, for example:
+    python -m tethysapp.well_inventory.cli migrate-storage --backend columnar
+"""
+import os
+import argparse
+
+
+def setup_tethys():
+    """
+    Configure Django so the app's persistent stores can be reached outside of a request.
+    """
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'tethys_portal.settings')
+    import django
+    django.setup()
+
+
+def migrate_storage(args):
+    """
+    Convert existing hydrographs to another storage backend.
+    """
+    from .app import WellInventory as app
+    from .model import migrate_hydrograph_storage
+
+    engine = app.get_persistent_store_database('primary_db')
+    converted = migrate_hydrograph_storage(engine, backend=args.backend)
+    print('Converted {0} hydrograph(s) to the "{1}" backend.'.format(converted, args.backend))
+
+
+def build_pyramids(args):
+    """
+    Recompute the aggregate pyramid of every hydrograph.
+    """
+    from .app import WellInventory as app
+    from .model import rebuild_hydrograph_pyramids
+
+    engine = app.get_persistent_store_database('primary_db')
+    rebuilt = rebuild_hydrograph_pyramids(engine)
+    print('Rebuilt aggregate pyramids for {0} hydrograph(s).'.format(rebuilt))
+
+
+def import_wells(args):
+    """
+    Import or update wells from an XLSX, CSV or GeoJSON file.
+    """
+    from .importers import get_format, iter_well_rows
+    from .model import import_wells as import_well_rows
+
+    file_format = get_format(args.path)
+
+    with open(args.path, 'rb') as well_file:
+        report = import_well_rows(iter_well_rows(well_file, file_format), west_longitudes=args.west_longitudes,
+                                  batch_size=args.batch_size)
+
+    for row_number, reason in report['rejected']:
+        print('Rejected row {0}: {1}'.format(row_number, reason))
+
+    print('Inserted {0}, updated {1} and rejected {2} well(s) in {3:.2f} s ({4:.0f} rows/s).'.format(
+        report['inserted'], report['updated'], len(report['rejected']), report['seconds'], report['rows_per_second']))
+
+
+def ingest_hydrographs(args):
+    """
+    Assign a directory or zip archive of per-site hydrograph csv files to their wells.
+    """
+    from .model import ingest_hydrograph_folder
+
+    report = ingest_hydrograph_folder(args.path, workers=args.workers, batch_size=args.batch_size, mode=args.mode)
+
+    for entry in report['files']:
+        status = entry['error'] or '{0} points'.format(entry['points'])
+        print('{0}: parse {1:.3f} s, write {2:.3f} s, {3}'.format(
+            entry['site'], entry['parse_seconds'], entry['write_seconds'], status))
+
+    failed = len([entry for entry in report['files'] if entry['error']])
+    print('Ingested {0} of {1} file(s), {2} points in {3:.2f} s ({4:.0f} points/s).'.format(
+        len(report['files']) - failed, len(report['files']), report['points'], report['seconds'],
+        report['points_per_second']))
+
+
+def export_hydrographs(args):
+    """
+    Write the hydrographs of all wells, or of a selection, to a gzip CSV or Parquet file.
+    """
+    from .export import export_hydrographs as export_stream
+    from .model import get_comparison_wells
+    from .db import remove_session
+
+    wells = get_comparison_wells(args.well_id or None, args.bbox, args.aquifer, limit=None)
+    remove_session()
+    size = 0
+
+    with open(args.output, 'wb') as export_file:
+        for data in export_stream(wells, args.format, chunk_size=args.chunk_size):
+            export_file.write(data)
+            size += len(data)
+
+    print('Exported the hydrographs of {0} well(s) to {1} ({2:.1f} MiB).'.format(
+        len(wells), args.output, size / 1048576.0))
+
+
+def partition_points(args):
+    """
+    Rebuild the hydrograph_points table, hash partitioned by hydrograph on PostgreSQL, or unpartitioned with 0.
+    """
+    from .app import WellInventory as app
+    from .model import rebuild_hydrograph_points
+
+    engine = app.get_persistent_store_database('primary_db')
+    count = rebuild_hydrograph_points(engine, partitions=args.partitions)
+    print('Rebuilt hydrograph_points with {0} partition(s), {1} point(s).'.format(args.partitions, count))
+
+
+def benchmark_sessions(args):
+    """
+    Compare requests per second with per-call and pooled database sessions under concurrent load.
+    """
+    from .benchmarks import benchmark_sessions as run_benchmark
+
+    results = run_benchmark(threads=args.threads, seconds=args.seconds)
+
+    for mode, result in results.items():
+        print('{0}: {1} requests, {2:.1f} requests/s, {3:.1f} ms mean'.format(
+            mode, result['requests'], result['requests_per_second'], result['mean_ms']))
+
+
+def benchmark(args):
+    """
+    Run the benchmark suite on a scratch database, save its results and compare them against a baseline.
+    """
+    from .benchmarks import benchmark_suite
+
+    results = benchmark_suite(well_counts=args.wells, point_counts=args.points, database_url=args.database_url,
+                              repeat=args.repeat)
+    report_results(results, args)
+
+
+def benchmark_points(args):
+    """
+    Benchmark point lookups and replaces on a large hydrograph_points table in a scratch database.
+    """
+    from .benchmarks import benchmark_points_table
+
+    results = benchmark_points_table(num_points=args.points, num_hydrographs=args.hydrographs,
+                                     database_url=args.database_url, repeat=args.repeat, partitions=args.partitions)
+    report_results(results, args)
+
+
+def benchmark_telemetry(args):
+    """
+    Measure sustained logger readings per second through one telemetry buffer on a scratch database.
+    """
+    from .benchmarks import benchmark_telemetry as run_benchmark
+
+    result = run_benchmark(num_wells=args.wells, batch_size=args.batch_size, seconds=args.seconds,
+                           database_url=args.database_url, capacity=args.buffer_size, flush_size=args.flush_size,
+                           flush_seconds=args.flush_seconds)
+
+    print('{0} requests, {1} rejected, {2} readings accepted ({3:.0f}/s), {4} written ({5:.0f}/s), '
+          '{6} failed flush(es)'.format(result['requests'], result['rejected_requests'], result['accepted'],
+                                        result['accepted_per_second'], result['flushed'],
+                                        result['flushed_per_second'], result['failed_flushes']))
+
+
+def report_results(results, args):
+    """
+    Print benchmark results, save them and compare them against a baseline as the benchmark options ask.
+    """
+    from .benchmarks import compare_results, save_results, load_results
+
+    for name, result in sorted(results['results'].items()):
+        print('{0}: median {1:.1f} ms, p95 {2:.1f} ms, {3} queries, peak {4:.0f} KiB'.format(
+            name, result['median_ms'], result['p95_ms'], result['queries'], result['peak_kb']))
+
+    if args.output:
+        save_results(results, args.output)
+        print('Saved results to {0}.'.format(args.output))
+
+    if args.baseline and args.update_baseline:
+        save_results(results, args.baseline)
+        print('Updated baseline {0}.'.format(args.baseline))
+    elif args.baseline:
+        regressions = compare_results(results, load_results(args.baseline), tolerance=args.tolerance)
+
+        for regression in regressions:
+            print('Regression: {0}'.format(regression))
+
+        if regressions:
+            raise SystemExit(1)
+
+        print('No regressions against {0}.'.format(args.baseline))
+
+
+def main(argv=None):
+    from .storage import BACKENDS, COLUMNAR
+
+    parser = argparse.ArgumentParser(prog='well_inventory', description='Well Inventory maintenance commands.')
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+
+    migrate_parser = subparsers.add_parser('migrate-storage', help='Convert stored hydrographs to another backend.')
+    migrate_parser.add_argument('--backend', choices=BACKENDS, default=COLUMNAR)
+    migrate_parser.set_defaults(func=migrate_storage)
+
+    pyramid_parser = subparsers.add_parser('build-pyramids', help='Recompute hydrograph aggregate pyramids.')
+    pyramid_parser.set_defaults(func=build_pyramids)
+
+    import_parser = subparsers.add_parser('import-wells', help='Import or update wells from an XLSX, CSV or GeoJSON file.')
+    import_parser.add_argument('path')
+    import_parser.add_argument('--west-longitudes', action='store_true',
+                               help='Treat positive longitudes as west, as in USGS site lists.')
+    import_parser.add_argument('--batch-size', type=int, default=1000)
+    import_parser.set_defaults(func=import_wells)
+
+    ingest_parser = subparsers.add_parser('ingest-hydrographs',
+                                          help='Assign a directory or zip of per-site hydrograph csv files to wells.')
+    ingest_parser.add_argument('path')
+    ingest_parser.add_argument('--workers', type=int, default=None, help='Parser processes (default: CPU count).')
+    ingest_parser.add_argument('--batch-size', type=int, default=50, help='Files written per transaction.')
+    ingest_parser.add_argument('--mode', choices=('replace', 'append', 'merge'), default='replace',
+                               help='Replace existing hydrographs, append newer points or merge all points.')
+    ingest_parser.set_defaults(func=ingest_hydrographs)
+
+    from .export import FORMATS, CSV_GZIP, CHUNK_SIZE
+
+    export_parser = subparsers.add_parser('export-hydrographs',
+                                          help='Export hydrographs to a gzip CSV or Parquet file.')
+    export_parser.add_argument('output')
+    export_parser.add_argument('--format', choices=FORMATS, default=CSV_GZIP)
+    export_parser.add_argument('--well-id', type=int, nargs='+', default=None, help='Wells to export (default: all).')
+    export_parser.add_argument('--bbox', type=float, nargs=4, default=None, metavar=('MINX', 'MINY', 'MAXX', 'MAXY'),
+                               help='Only wells inside this bounding box (degrees).')
+    export_parser.add_argument('--aquifer', default=None, help='Only wells of this aquifer.')
+    export_parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE, help='Points read and written at a time.')
+    export_parser.set_defaults(func=export_hydrographs)
+
+    partition_parser = subparsers.add_parser('partition-points',
+                                             help='Rebuild hydrograph_points, hash partitioned on PostgreSQL.')
+    partition_parser.add_argument('--partitions', type=int, default=16, help='Number of partitions, 0 for none.')
+    partition_parser.set_defaults(func=partition_points)
+
+    sessions_parser = subparsers.add_parser('benchmark-sessions',
+                                            help='Compare per-call and pooled database sessions under load.')
+    sessions_parser.add_argument('--threads', type=int, default=8, help='Concurrent simulated requests.')
+    sessions_parser.add_argument('--seconds', type=float, default=10.0, help='Duration of each run.')
+    sessions_parser.set_defaults(func=benchmark_sessions)
+
+    from .benchmarks import WELL_COUNTS, POINT_COUNTS, REPEAT, TOLERANCE
+
+    benchmark_parser = subparsers.add_parser('benchmark', help='Benchmark hot paths on a scratch database.')
+    benchmark_parser.add_argument('--wells', type=int, nargs='+', default=list(WELL_COUNTS),
+                                  help='Inventory sizes to seed.')
+    benchmark_parser.add_argument('--points', type=int, nargs='+', default=list(POINT_COUNTS),
+                                  help='Hydrograph sizes to ingest and plot.')
+    benchmark_parser.add_argument('--database-url', default=None,
+                                  help='Scratch database, emptied by the run (default: a temporary SQLite file).')
+    benchmark_parser.add_argument('--repeat', type=int, default=REPEAT, help='Timed calls per measurement.')
+    benchmark_parser.add_argument('--output', default=None, help='Write the results to this JSON file.')
+    benchmark_parser.add_argument('--baseline', default=None, help='Compare against this JSON file of results.')
+    benchmark_parser.add_argument('--update-baseline', action='store_true',
+                                  help='Store the results as the baseline instead of comparing.')
+    benchmark_parser.add_argument('--tolerance', type=float, default=TOLERANCE,
+                                  help='Allowed slowdown or memory growth over the baseline (fraction).')
+    benchmark_parser.set_defaults(func=benchmark)
+
+    from .benchmarks import POINTS_TABLE_SIZE, POINTS_TABLE_HYDROGRAPHS
+
+    points_parser = subparsers.add_parser('benchmark-points',
+                                          help='Benchmark point lookups and replaces on a large points table.')
+    points_parser.add_argument('--points', type=int, default=POINTS_TABLE_SIZE, help='Rows to seed.')
+    points_parser.add_argument('--hydrographs', type=int, default=POINTS_TABLE_HYDROGRAPHS,
+                               help='Hydrographs the rows are spread over.')
+    points_parser.add_argument('--partitions', type=int, default=0, help='Hash partitions (PostgreSQL only).')
+    points_parser.add_argument('--database-url', default=None,
+                               help='Scratch database, emptied by the run (default: a temporary SQLite file).')
+    points_parser.add_argument('--repeat', type=int, default=REPEAT, help='Timed calls per measurement.')
+    points_parser.add_argument('--output', default=None, help='Write the results to this JSON file.')
+    points_parser.add_argument('--baseline', default=None, help='Compare against this JSON file of results.')
+    points_parser.add_argument('--update-baseline', action='store_true',
+                               help='Store the results as the baseline instead of comparing.')
+    points_parser.add_argument('--tolerance', type=float, default=TOLERANCE,
+                               help='Allowed slowdown or memory growth over the baseline (fraction).')
+    points_parser.set_defaults(func=benchmark_points)
+
+    from .benchmarks import TELEMETRY_WELLS, TELEMETRY_BATCH_SIZE
+    from .telemetry import DEFAULT_BUFFER_SIZE, DEFAULT_FLUSH_SIZE, DEFAULT_FLUSH_SECONDS
+
+    telemetry_parser = subparsers.add_parser('benchmark-telemetry',
+                                             help='Measure logger readings per second through the telemetry buffer.')
+    telemetry_parser.add_argument('--wells', type=int, default=TELEMETRY_WELLS, help='Wells reporting readings.')
+    telemetry_parser.add_argument('--batch-size', type=int, default=TELEMETRY_BATCH_SIZE,
+                                  help='Readings per request.')
+    telemetry_parser.add_argument('--seconds', type=float, default=10.0, help='Duration of the run.')
+    telemetry_parser.add_argument('--buffer-size', type=int, default=DEFAULT_BUFFER_SIZE,
+                                  help='Readings the buffer holds before rejecting requests.')
+    telemetry_parser.add_argument('--flush-size', type=int, default=DEFAULT_FLUSH_SIZE,
+                                  help='Buffered readings that trigger a write.')
+    telemetry_parser.add_argument('--flush-seconds', type=float, default=DEFAULT_FLUSH_SECONDS,
+                                  help='Longest time readings wait before a write.')
+    telemetry_parser.add_argument('--database-url', default=None,
+                                  help='Scratch database, emptied by the run (default: a temporary SQLite file).')
+    telemetry_parser.set_defaults(func=benchmark_telemetry)
+
+    args = parser.parse_args(argv)
+    setup_tethys()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+"""
+Alignment of many hydrographs on one time axis for the comparison plot. Each series is averaged into the same
+equal-width time bins, all series at once with bincount, so every well contributes the same number of points and
+the total sent to the browser stays under a fixed budget however long or dense the records are.
+"""
+import numpy as np
+
+from . import pyramid
+
+TOTAL_POINTS = 20000  #: points of all series together on one comparison plot
+MIN_BINS = 50  #: bins per series, whatever the number of wells
+
+
+def bins_per_series(num_series, total_points=TOTAL_POINTS):
+    """
+    Number of time bins each series gets so that all of them fit in total_points.
+    """
+    return max(int(total_points) // max(int(num_series), 1), MIN_BINS)
+
+
+def time_range(summaries, t0=None, t1=None):
+    """
+    Get the (t0, t1) hours covered by some well summaries, narrowed to the requested range. None when they have no
+    points in it.
+    """
+    starts = [s.start_time for s in summaries if s.start_time is not None]
+    ends = [s.end_time for s in summaries if s.end_time is not None]
+
+    if not starts or not ends:
+        return None
+
+    t0 = min(starts) if t0 is None else max(t0, min(starts))
+    t1 = max(ends) if t1 is None else min(t1, max(ends))
+
+    if t1 < t0:
+        return None
+
+    return t0, t1
+
+
+def select_level(summaries, bins, t0, t1):
+    """
+    Pick the one pyramid level read for all series: the coarsest that still fills the bins of the densest series
+    over the range, or None to read raw points.
+    """
+    span = max(t1 - t0, 0)
+    densest = 0.0
+
+    # Assume points are spread evenly over each record to estimate how many fall in range
+    for summary in summaries:
+        if not summary.num_points or summary.start_time is None or summary.end_time is None:
+            continue
+
+        overlap = max(min(t1, summary.end_time) - max(t0, summary.start_time), 0)
+        total_span = max(summary.end_time - summary.start_time, 1)
+        densest = max(densest, summary.num_points * overlap / float(total_span))
+
+    return pyramid.select_level(densest, span, bins)
+
+
+def align_series(series, t0, t1, bins):
+    """
+    Average a list of (times, flows) series into bins equal bins between t0 and t1. Returns (times, matrix) where
+    times are the bin centers and matrix has one row per series, NaN in bins without points.
+    """
+    bins = max(int(bins), 1)
+    width = max(float(t1 - t0), 1.0) / bins
+    matrix = np.full((len(series), bins), np.nan)
+
+    if len(series):
+        sizes = [len(times) for times, flows in series]
+        rows = np.repeat(np.arange(len(series)), sizes)
+        times = np.concatenate([np.asarray(times, dtype=float) for times, flows in series] + [np.empty(0)])
+        flows = np.concatenate([np.asarray(flows, dtype=float) for times, flows in series] + [np.empty(0)])
+
+        # Points outside the range (aggregate buckets straddling its ends) fall in the first or last bin
+        columns = np.clip(((times - t0) / width).astype(int), 0, bins - 1)
+        keys = rows * bins + columns
+
+        counts = np.bincount(keys, minlength=matrix.size)
+        sums = np.bincount(keys, weights=flows, minlength=matrix.size)
+        filled = counts > 0
+        matrix.flat[filled] = sums[filled] / counts[filled]
+
+    return t0 + width * (np.arange(bins) + 0.5), matrix
@@ -1,85 +1,51 @@
+import json
 from django.shortcuts import render, reverse, redirect
+from django.http import JsonResponse, HttpResponse, StreamingHttpResponse, Http404
 from django.contrib import messages
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.decorators import api_view, authentication_classes
 from django.utils.html import format_html
 from tethys_sdk.permissions import login_required, permission_required, has_permission
 from tethys_sdk.gizmos import MapView, Button, TextInput, DatePicker, SelectInput, DataTableView, MVDraw, MVView, MVLayer
 
 
-from .model import add_new_well, get_all_wells, assign_hydrograph_to_well, Well, get_hydrograph
+from .model import add_new_well, Well, Hydrograph, get_hydrograph_well_id, get_well_tile, \
+    get_wells_in_bbox, get_wells_page, import_wells as import_well_rows, get_ingest_job, delete_well as remove_well, \
+    get_hydrograph_statistics, get_comparison_wells, get_aquifers, get_well_hydrograph_version, MAX_COMPARE_WELLS
+from .cache import get_wells_version, get_wells_geojson, get_map_center, get_wells_counts, gzip_json_response, \
+    etag_matches, not_modified
+from .jobs import submit_hydrograph_upload, recover_ingest_jobs
+from .importers import get_format, iter_well_rows
+from .tiles import feature_collection
 from .app import WellInventory as app
-from .helpers import create_hydrograph
+from .db import get_session
+from .helpers import create_hydrograph, create_comparison_plot, get_hydrograph_data, get_popup_series, PLOT_WIDTH, \
+    POPUP_PLOT_WIDTH
+from .downsample import METHODS, LTTB
+from .analytics import METRICS, UNITS, DESCRIPTIONS
+from .figures import get_figure_cache
+from .export import export_hydrographs as export_stream, export_filename, CONTENT_TYPES, CSV_GZIP
+from .instrumentation import instrument, timed, prometheus_metrics
+from .telemetry import parse_readings, get_telemetry_buffer, BufferFull
+
+WELLS_BBOX_LIMIT = 5000  #: most wells returned by one bounding box query
 
 @login_required()
+@instrument
 def home(request):
     """
     Controller for the app home page.
     """
-    # Get list of wells and create wells MVLayer:
-    wells = get_all_wells()
-    features = []
-    lat_list = []
-    lng_list = []
-
-    for well in wells:
-        lat_list.append(well.latitude)
-        lng_list.append(well.longitude)
-
-        well_feature = {
-            'type': 'Feature',
-            'geometry': {
-                'type': 'Point',
-                'coordinates': [well.longitude, well.latitude],
-            },
-            'properties': {
-                'id': well.id,
-                'name': well.name,
-                'owner': well.owner,
-                'river': well.river,
-                'date_built': well.date_built
-            }
-        }
-
-        features.append(well_feature)
-
-    # Define GeoJSON FeatureCollection
-    wells_feature_collection = {
-        'type': 'FeatureCollection',
-        'crs': {
-            'type': 'name',
-            'properties': {
-                'name': 'EPSG:4326'
-            }
-        },
-        'features': features
-    }
-
-    style = {'ol.style.Style': {
-        'image': {'ol.style.Circle': {
-            'radius': 10,
-            'fill': {'ol.style.Fill': {
-                'color':  '#d84e1f'
-            }},
-            'stroke': {'ol.style.Stroke': {
-                'color': '#ffffff',
-                'width': 1
-            }}
-        }}
-    }}
-
-    # Create a Map View Layer
+    # Wells are loaded tile by tile from the well_tiles endpoint by map.js, so the layer starts out empty
     wells_layer = MVLayer(
         source='GeoJSON',
-        options=wells_feature_collection,
+        options=feature_collection([]),
         legend_title='Wells',
-        layer_options={'style': style},
         feature_selection=True
     )
 
-    # Define view centered on well locations
-    try:
-        view_center = [sum(lng_list) / float(len(lng_list)), sum(lat_list) / float(len(lat_list))]
-    except ZeroDivisionError:
-        view_center = [-98.6, 39.8]
+    # Define view centered on well locations, averaged once per wells version
+    view_center = get_map_center(get_wells_version()) or [-98.6, 39.8]
 
     view_options = MVView(
         projection='EPSG:4326',
@@ -89,13 +55,14 @@ def home(request):
         minZoom=2
     )
 
-    well_inventory_map = MapView(
-        height='100%',
-        width='100%',
-        layers=[wells_layer],
-        basemap='OpenStreetMap',
-        view=view_options
-    )
+    with timed('gizmos'):
+        well_inventory_map = MapView(
+            height='100%',
+            width='100%',
+            layers=[wells_layer],
+            basemap='OpenStreetMap',
+            view=view_options
+        )
 
     add_well_button = Button(
         display_text='Add Well',
@@ -105,18 +72,83 @@ def home(request):
         href=reverse('well_inventory:add_well')
     )
 
+    # map.js adds the bounding box of the current view to the link
+    compare_button = Button(
+        display_text='Compare Wells in View',
+        name='compare-wells-button',
+        icon='glyphicon glyphicon-stats',
+        href=reverse('well_inventory:compare_hydrographs'),
+        attributes={'id': 'compare-wells-button'}
+    )
+
     context = {
         'well_inventory_map': well_inventory_map,
         'add_well_button': add_well_button,
+        'compare_button': compare_button,
         'can_add_wells': has_permission(request, 'add_wells')
     }
 
-    return render(request, 'well_inventory/home.html', context)
+    with timed('render'):
+        return render(request, 'well_inventory/home.html', context)
+
+
+@login_required()
+@instrument
+def well_tiles(request, z, x, y):
+    """
+    GeoJSON tile of the wells layer, clustered at low zoom levels.
+    """
+    # Tiles only change with the wells, so browsers can revalidate them against the wells version
+    etag = '"wells-{0}-tile-{1}-{2}-{3}"'.format(get_wells_version(), z, x, y)
+    if etag_matches(request, etag):
+        return not_modified(etag)
+
+    try:
+        features = get_well_tile(int(z), int(x), int(y))
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+    response = JsonResponse(feature_collection(features))
+    response['ETag'] = etag
+    response['Cache-Control'] = 'private, no-cache'
+    return response
+
 
+@login_required()
+@instrument
+def wells_geojson(request):
+    """
+    GeoJSON FeatureCollection of all wells, cached per wells version and served gzipped with an ETag.
+    """
+    version = get_wells_version()
+    etag = '"wells-{0}"'.format(version)
+
+    if etag_matches(request, etag):
+        return not_modified(etag)
+
+    return gzip_json_response(request, get_wells_geojson(version), etag)
+
+
+@login_required()
+@instrument
+def wells_in_bbox(request):
+    """
+    GeoJSON wells inside ?bbox=minx,miny,maxx,maxy (degrees), at most ?limit=<n> of them.
+    """
+    try:
+        minx, miny, maxx, maxy = [float(v) for v in request.GET.get('bbox', '').split(',')]
+        limit = int(request.GET.get('limit', WELLS_BBOX_LIMIT))
+        if limit < 1:
+            raise ValueError('limit must be at least 1')
+        wells = get_wells_in_bbox(minx, miny, maxx, maxy, limit=min(limit, WELLS_BBOX_LIMIT))
+    except ValueError as e:
+        return JsonResponse({'error': 'Invalid bbox or limit: {0}'.format(e)}, status=400)
 
+    return JsonResponse(feature_collection([well.to_feature() for well in wells]))
 
 
 @permission_required('add_wells')
+@instrument
 def add_well(request):
     """
     Controller for the Add Well page.
@@ -221,13 +253,14 @@ def add_well(request):
         point_color='#FF0000'
     )
 
-    location_input = MapView(
-        height='300px',
-        width='100%',
-        basemap='OpenStreetMap',
-        draw=drawing_options,
-        view=initial_view
-    )
+    with timed('gizmos'):
+        location_input = MapView(
+            height='300px',
+            width='100%',
+            basemap='OpenStreetMap',
+            draw=drawing_options,
+            view=initial_view
+        )
 
     add_button = Button(
         display_text='Add',
@@ -256,71 +289,206 @@ def add_well(request):
         'can_add_wells': has_permission(request, 'add_wells'),
     }
 
-    return render(request, 'well_inventory/add_well.html', context)
+    with timed('render'):
+        return render(request, 'well_inventory/add_well.html', context)
 
 
-@login_required()
-def list_wells(request):
+WELL_TABLE_COLUMNS = ('name', 'owner', 'river', 'date_built', 'num_points', 'end_time')  #: sortable, in table order
+WELL_TABLE_PAGE_SIZES = (10, 25, 50, 100)
+WELL_TABLE_STATISTICS = ('mean', 'sens_slope', 'drawdown_rate')  #: analytics metrics shown after the sortable columns
+
+
+def well_table_row(well, statistics=None):
     """
-    Show all wells in a table view.
+    Cells of one row of the wells table, from the summary of a well.
     """
-    wells = get_all_wells()
-    table_rows = []
+    if well.hydrograph_id:
+        url = reverse('well_inventory:hydrograph', kwargs={'hydrograph_id': well.hydrograph_id})
+        well_hydrograph = format_html('<a class="btn btn-primary" href="{}">Hydrograph Plot</a>'.format(url))
+    else:
+        well_hydrograph = format_html('<a class="btn btn-primary disabled" title="No hydrograph assigned" '
+                                     'style="pointer-events: auto;">Hydrograph Plot</a>')
+
+    url = reverse('well_inventory:delete_well', kwargs={'well_id': well.well_id})
+    well_delete = format_html('<a class="btn btn-danger" href="{}">Delete Well</a>'.format(url))
+
+    return (
+        well.name, well.owner,
+        well.river, well.date_built,
+        well.num_points or 0, '' if well.end_time is None else well.end_time,
+    ) + tuple(
+        '' if not statistics or statistics[metric] is None else round(statistics[metric], 2)
+        for metric in WELL_TABLE_STATISTICS
+    ) + (
+        well_hydrograph, well_delete
+    )
 
-    for well in wells:
-        hydrograph_id = get_hydrograph(well.id)
-        well_id = well.id
-        if hydrograph_id:
-            url = reverse('well_inventory:hydrograph', kwargs={'hydrograph_id': hydrograph_id})
-            well_hydrograph = format_html('<a class="btn btn-primary" href="{}">Hydrograph Plot</a>'.format(url))
-        else:
-            well_hydrograph = format_html('<a class="btn btn-primary disabled" title="No hydrograph assigned" '
-                                         'style="pointer-events: auto;">Hydrograph Plot</a>')
 
-        if well_id == request.user.id:
-            url = reverse('well_inventory:delete_well', kwargs={'well_id': well.id})
-            well_delete = format_html('<a class="btn btn-danger" href="{}">Delete Well</a>'.format(url))
+@permission_required('add_wells')
+@instrument
+def import_wells(request):
+    """
+    Controller for the Import Wells page.
+    """
+    well_file_error = ''
+
+    if request.POST and 'import-button' in request.POST:
+        well_file = request.FILES.get('well-file', None)
+
+        if not well_file:
+            well_file_error = 'Well File is Required.'
         else:
-            url = reverse('well_inventory:delete_well', kwargs={'well_id': well.id})
-            well_delete = format_html('<a class="btn btn-danger" href="{}">Delete Well</a>'.format(url))
-
-        table_rows.append(
-            (
-                well.name, well.owner,
-                well.river, well.date_built,
-                well_hydrograph, well_delete
-            )
-        )
+            try:
+                rows = iter_well_rows(well_file, get_format(well_file.name))
+                report = import_well_rows(rows, west_longitudes=bool(request.POST.get('west-longitudes')))
+            except ValueError as e:
+                well_file_error = str(e)
+            else:
+                for row_number, reason in report['rejected'][:10]:
+                    messages.warning(request, 'Row {0} rejected: {1}'.format(row_number, reason))
+
+                messages.info(request, 'Imported {0} new and updated {1} well(s), rejected {2} row(s) '
+                                       '({3:.0f} rows/s).'.format(report['inserted'], report['updated'],
+                                                                  len(report['rejected']), report['rows_per_second']))
+                return redirect(reverse('well_inventory:wells'))
 
-    wells_table = DataTableView(
-        column_names=('Well Number', 'Owner', 'Aquifer', 'Date Built', 'Depth to GW Hydrograph', 'Manage'),
-        rows=table_rows,
-        searching=False,
-        orderClasses=False,
-        lengthMenu=[[10, 25, 50, -1], [10, 25, 50, "All"]],
+        messages.error(request, "Please fix errors.")
+
+    import_button = Button(
+        display_text='Import',
+        name='import-button',
+        icon='glyphicon glyphicon-import',
+        style='success',
+        attributes={'form': 'import-wells-form'},
+        submit=True
     )
 
+    cancel_button = Button(
+        display_text='Cancel',
+        name='cancel-button',
+        href=reverse('well_inventory:wells')
+    )
+
+    context = {
+        'well_file_error': well_file_error,
+        'import_button': import_button,
+        'cancel_button': cancel_button,
+        'can_add_wells': has_permission(request, 'add_wells')
+    }
+
+    with timed('render'):
+        return render(request, 'well_inventory/import_wells.html', context)
+
+
+@login_required()
+@instrument
+def list_wells(request):
+    """
+    Show all wells in a table view. Rows are fetched page by page from wells_table_data.
+    """
+    with timed('gizmos'):
+        wells_table = DataTableView(
+            column_names=('Well Number', 'Owner', 'Aquifer', 'Date Built', 'Points', 'Last Observation (hr)',
+                          'Mean Depth (ft)', "Sen's Slope (ft/yr)", 'Drawdown Rate (ft/yr)',
+                          'Depth to GW Hydrograph', 'Manage'),
+            rows=[],
+            searching=True,
+            orderClasses=False,
+            serverSide=True,
+            processing=True,
+            ajax=reverse('well_inventory:wells_table_data'),
+            columnDefs=[{'orderable': False, 'targets': [6, 7, 8, 9, 10]}],
+            lengthMenu=[list(WELL_TABLE_PAGE_SIZES), list(WELL_TABLE_PAGE_SIZES)],
+        )
+
     context = {
         'wells_table': wells_table,
         'can_add_wells': has_permission(request, 'add_wells')
     }
 
-    return render(request, 'well_inventory/list_wells.html', context)
+    with timed('render'):
+        return render(request, 'well_inventory/list_wells.html', context)
 
 
 @login_required()
+@instrument
+def wells_table_data(request):
+    """
+    DataTables server-side processing endpoint for the wells table.
+    """
+    try:
+        draw = int(request.GET.get('draw', 0))
+        offset = max(int(request.GET.get('start', 0)), 0)
+        limit = int(request.GET.get('length', WELL_TABLE_PAGE_SIZES[0]))
+        sort_index = int(request.GET.get('order[0][column]', 0))
+        after, before = (parse_cursor(request.GET.get(name)) for name in ('after', 'before'))
+    except (ValueError, TypeError):
+        return JsonResponse({'error': 'Invalid paging parameters.'}, status=400)
+
+    if limit not in WELL_TABLE_PAGE_SIZES:
+        limit = WELL_TABLE_PAGE_SIZES[0]
+
+    sort = WELL_TABLE_COLUMNS[sort_index] if 0 <= sort_index < len(WELL_TABLE_COLUMNS) else WELL_TABLE_COLUMNS[0]
+
+    search = request.GET.get('search[value]', '').strip()
+
+    try:
+        # Counts only change with the wells, so paging through them does not count them again
+        total, filtered, rows = get_wells_page(
+            offset=offset,
+            limit=limit,
+            sort=sort,
+            descending=request.GET.get('order[0][dir]') == 'desc',
+            search=search,
+            after=after,
+            before=before,
+            counts=get_wells_counts(get_wells_version(), search)
+        )
+    except (ValueError, TypeError):
+        return JsonResponse({'error': 'Invalid paging cursor.'}, status=400)
+
+    # Statistics of the page only, computed on first view of each hydrograph version
+    statistics = get_hydrograph_statistics([well.well_id for well in rows if well.hydrograph_id])
+
+    return JsonResponse({
+        'draw': draw,
+        'recordsTotal': total,
+        'recordsFiltered': filtered,
+        'data': [well_table_row(well, statistics=statistics.get(well.well_id)) for well in rows],
+        # Keyset cursors of the neighbouring pages, sent back by wells_table.js as after or before
+        'cursor': {
+            'start': offset,
+            'first': [getattr(rows[0], sort), rows[0].well_id] if rows else None,
+            'last': [getattr(rows[-1], sort), rows[-1].well_id] if rows else None,
+        },
+    })
+
+
+def parse_cursor(value):
+    """
+    Parse a keyset cursor of the wells table, a JSON [sort value, well id] pair, or None if not given.
+    """
+    if not value:
+        return None
+
+    sort_value, well_id = json.loads(value)
+    return sort_value, int(well_id)
+
+
+@login_required()
+@instrument
 def assign_hydrograph(request):
     """
     Controller for the Add Hydrograph page.
     """
     # Get wells from database
-    Session = app.get_persistent_store_database('primary_db', as_sessionmaker=True)
-    session = Session()
+    session = get_session()
     all_wells = session.query(Well).all()
 
     # Defaults
     well_select_options = [(well.name, well.id) for well in all_wells]
     selected_well = None
+    selected_mode = Hydrograph.REPLACE
     hydrograph_file = None
 
     # Errors
@@ -332,6 +500,10 @@ def assign_hydrograph(request):
         # Get Values
         has_errors = False
         selected_well = request.POST.get('well-select', None)
+        selected_mode = request.POST.get('upload-mode', Hydrograph.REPLACE)
+
+        if selected_mode not in Hydrograph.MODES:
+            selected_mode = Hydrograph.REPLACE
 
         if not selected_well:
             has_errors = True
@@ -342,20 +514,16 @@ def assign_hydrograph(request):
             # Get a list of the files
             hydrograph_file = request.FILES.getlist('hydrograph-file')
 
-        if not hydrograph_file and len(hydrograph_file) > 0:
+        if not hydrograph_file:
             has_errors = True
             hydrograph_file_error = 'Hydrograph File is Required.'
 
         if not has_errors:
-            # Process file here
-            success = assign_hydrograph_to_well(selected_well, hydrograph_file[0])
+            # Stage the file and let a background worker process it
+            job_id = submit_hydrograph_upload(selected_well, hydrograph_file[0], selected_mode)
 
-            # Provide feedback to user
-            if success:
-                messages.info(request, 'Successfully assigned hydrograph.')
-            else:
-                messages.info(request, 'Unable to assign hydrograph. Please try again.')
-            return redirect(reverse('well_inventory:home'))
+            messages.info(request, 'Hydrograph upload queued for processing.')
+            return redirect(reverse('well_inventory:ingest_job', kwargs={'job_id': job_id}))
 
         messages.error(request, "Please fix errors.")
 
@@ -368,6 +536,16 @@ def assign_hydrograph(request):
         error=well_select_errors
     )
 
+    mode_select_input = SelectInput(
+        display_text='Existing Hydrograph',
+        name='upload-mode',
+        multiple=False,
+        options=[('Replace it with the file', Hydrograph.REPLACE),
+                 ('Append points newer than its last observation', Hydrograph.APPEND),
+                 ('Merge, updating points at the same times', Hydrograph.MERGE)],
+        initial=selected_mode
+    )
+
     add_button = Button(
         display_text='Add',
         name='add-button',
@@ -385,66 +563,365 @@ def assign_hydrograph(request):
 
     context = {
         'well_select_input': well_select_input,
+        'mode_select_input': mode_select_input,
         'hydrograph_file_error': hydrograph_file_error,
         'add_button': add_button,
         'cancel_button': cancel_button,
         'can_add_wells': has_permission(request, 'add_wells')
     }
 
-    session.close()
+    with timed('render'):
+        return render(request, 'well_inventory/assign_hydrograph.html', context)
+
+
+MAX_PLOT_WIDTH = 2000  #: pixels, widest plot a series is downsampled for
+TIME_LIMITS = (-2 ** 31, 2 ** 31 - 1)  #: hours, the range of stored times
+
+
+def get_plot_options(request, plot_width):
+    """
+    Read range and downsampling options from the query string: ?t0=<hr>&t1=<hr>&width=<pixels>&method=lttb|minmax&full=1
+    """
+    try:
+        plot_width = min(max(int(request.GET.get('width', plot_width)), 1), MAX_PLOT_WIDTH)
+    except ValueError:
+        pass
+
+    time_range = []
+    for name in ('t0', 't1'):
+        try:
+            time_range.append(min(max(int(float(request.GET[name])), TIME_LIMITS[0]), TIME_LIMITS[1]))
+        except (KeyError, ValueError, OverflowError):
+            time_range.append(None)
+
+    method = request.GET.get('method', LTTB)
+    if method not in METHODS:
+        method = LTTB
+
+    return {
+        'plot_width': plot_width,
+        'method': method,
+        'full_resolution': request.GET.get('full', '').lower() in ('1', 'true', 'yes'),
+        't0': time_range[0],
+        't1': time_range[1],
+    }
 
-    return render(request, 'well_inventory/assign_hydrograph.html', context)
 
 @login_required()
+@instrument
+def ingest_job(request, job_id):
+    """
+    Controller for the hydrograph upload progress page.
+    """
+    job = get_ingest_job(job_id)
+
+    if not job:
+        messages.error(request, 'Hydrograph upload not found.')
+        return redirect(reverse('well_inventory:home'))
+
+    context = {
+        'job': job,
+        'status_url': reverse('well_inventory:ingest_job_status', kwargs={'job_id': job['id']}),
+        'can_add_wells': has_permission(request, 'add_wells')
+    }
+
+    with timed('render'):
+        return render(request, 'well_inventory/ingest_job.html', context)
+
+
+@login_required()
+@instrument
+def ingest_job_status(request, job_id):
+    """
+    JSON status and progress of a hydrograph upload job.
+    """
+    # Progress pages poll this, so jobs left behind by a restart are picked up while someone waits on them
+    recover_ingest_jobs()
+    job = get_ingest_job(job_id)
+
+    if not job:
+        return JsonResponse({'error': 'Hydrograph upload not found.'}, status=404)
+
+    return JsonResponse(job)
+
+
+@login_required()
+@instrument
 def hydrograph(request, hydrograph_id):
     """
     Controller for the Hydrograph Page.
     """
-    hydrograph_plot = create_hydrograph(hydrograph_id)
+    with timed('gizmos'):
+        hydrograph_plot = create_hydrograph(hydrograph_id, **get_plot_options(request, PLOT_WIDTH))
+    well_id = get_hydrograph_well_id(hydrograph_id)
 
     context = {
         'hydrograph_plot': hydrograph_plot,
+        'data_url': reverse('well_inventory:hydrograph_data', kwargs={'well_id': well_id}),
         'can_add_wells': has_permission(request, 'add_wells')
     }
-    return render(request, 'well_inventory/hydrograph.html', context)
+    with timed('render'):
+        return render(request, 'well_inventory/hydrograph.html', context)
 
 @login_required()
+@instrument
 def hydrograph_ajax(request, well_id):
     """
     Controller for the Hydrograph Page.
     """
     # Get wells from database
-    Session = app.get_persistent_store_database('primary_db', as_sessionmaker=True)
-    session = Session()
+    session = get_session()
     well = session.query(Well).get(int(well_id))
 
     if well.hydrograph:
-        hydrograph_plot = create_hydrograph(well.hydrograph.id, height='300px')
+        with timed('gizmos'):
+            hydrograph_plot = create_hydrograph(well.hydrograph.id, height='300px',
+                                                **get_plot_options(request, POPUP_PLOT_WIDTH))
     else:
         hydrograph_plot = None
 
     context = {
         'hydrograph_plot': hydrograph_plot,
+        'data_url': reverse('well_inventory:hydrograph_data', kwargs={'well_id': well.id}),
+    }
+
+    with timed('render'):
+        return render(request, 'well_inventory/hydrograph_ajax.html', context)
+
+MAX_POPUP_WIDTH = 2000  #: pixels, the popup series is not meant for full size plots
+
+
+@login_required()
+@instrument
+def hydrograph_popup(request, well_id):
+    """
+    Compact JSON series of the hydrograph of a well for the map popup, drawn in the browser by map.js.
+    """
+    hydrograph_version = get_well_hydrograph_version(well_id)
+
+    if hydrograph_version is None:
+        return JsonResponse({'error': 'No hydrograph assigned to this well.'}, status=404)
+
+    try:
+        plot_width = min(max(int(request.GET.get('width', POPUP_PLOT_WIDTH)), 1), MAX_POPUP_WIDTH)
+    except ValueError:
+        plot_width = POPUP_PLOT_WIDTH
+
+    # The series only changes with the hydrograph version, so browsers can revalidate against it
+    hydrograph_id, version = hydrograph_version
+    etag = '"hydrograph-{0}-{1}-popup-{2}"'.format(hydrograph_id, version, plot_width)
+    if etag_matches(request, etag):
+        return not_modified(etag)
+
+    response = JsonResponse(get_popup_series(hydrograph_id, version, plot_width))
+    response['ETag'] = etag
+    response['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+@login_required()
+@instrument
+def hydrograph_data(request, well_id):
+    """
+    JSON endpoint with the hydrograph points of a well between t0 and t1, at the requested resolution.
+    """
+    data = get_hydrograph_data(well_id, **get_plot_options(request, PLOT_WIDTH))
+
+    if data is None:
+        return JsonResponse({'error': 'No hydrograph assigned to this well.'}, status=404)
+
+    return JsonResponse(data)
+
+def get_well_selection(request):
+    """
+    Read a selection of wells from the query string: ?well_id=1&well_id=2, ?bbox=minx,miny,maxx,maxy and/or
+    ?river=<aquifer>. Returns (well_ids, bbox, river), raising ValueError when they do not parse.
+    """
+    well_ids = [int(well_id) for well_id in request.GET.getlist('well_id')]
+    bbox = request.GET.get('bbox', '')
+    bbox = [float(v) for v in bbox.split(',')] if bbox else None
+
+    if bbox is not None and len(bbox) != 4:
+        raise ValueError('a bounding box needs four values')
+
+    return well_ids, bbox, request.GET.get('river', '')
+
+
+@login_required()
+@instrument
+def compare_hydrographs(request):
+    """
+    Controller for the hydrograph comparison page: the wells listed as ?well_id=1&well_id=2, inside
+    ?bbox=minx,miny,maxx,maxy and/or in ?river=<aquifer>, overlaid on one plot.
+    """
+    options = get_plot_options(request, PLOT_WIDTH)
+    comparison_plot = None
+
+    try:
+        well_ids, bbox, river = get_well_selection(request)
+    except ValueError as e:
+        messages.error(request, 'Invalid selection: {0}'.format(e))
+        well_ids, bbox, river = [], None, ''
+
+    if well_ids or bbox or river:
+        # Ask for one well more than the plot takes to tell when the selection was cut short
+        wells = get_comparison_wells(well_ids or None, bbox, river, limit=MAX_COMPARE_WELLS + 1)
+
+        if len(wells) > MAX_COMPARE_WELLS:
+            messages.warning(request, 'Only the first {0} wells of the selection are compared.'.format(
+                MAX_COMPARE_WELLS))
+            wells = wells[:MAX_COMPARE_WELLS]
+
+        with timed('gizmos'):
+            comparison_plot = create_comparison_plot(wells, t0=options['t0'], t1=options['t1'])
+
+        if comparison_plot is None:
+            messages.warning(request, 'No hydrograph points found for the selected wells.')
+
+    well_select_input = SelectInput(
+        display_text='Wells',
+        name='well_id',
+        multiple=True,
+        options=[(well.name, well.well_id) for well in get_comparison_wells(limit=None)],
+        initial=[str(well_id) for well_id in well_ids],
+    )
+
+    river_select_input = SelectInput(
+        display_text='Aquifer',
+        name='river',
+        multiple=False,
+        options=[('', '')] + [(aquifer, aquifer) for aquifer in get_aquifers()],
+        initial=river,
+    )
+
+    compare_button = Button(
+        display_text='Compare',
+        name='compare-button',
+        icon='glyphicon glyphicon-stats',
+        style='success',
+        attributes={'form': 'compare-hydrographs-form'},
+        submit=True
+    )
+
+    context = {
+        'comparison_plot': comparison_plot,
+        'well_select_input': well_select_input,
+        'river_select_input': river_select_input,
+        'bbox': ','.join(str(v) for v in bbox) if bbox else '',
+        'compare_button': compare_button,
+        'export_url': reverse('well_inventory:export_hydrographs'),
+        'export_query': request.GET.urlencode(),
+        'max_wells': MAX_COMPARE_WELLS,
+        'can_add_wells': has_permission(request, 'add_wells')
     }
 
-    session.close()
-    return render(request, 'well_inventory/hydrograph_ajax.html', context)
+    with timed('render'):
+        return render(request, 'well_inventory/compare_hydrographs.html', context)
+
 
 @login_required()
+@instrument
+def export_hydrographs(request):
+    """
+    Stream the hydrographs of all wells, or of a selection as read by get_well_selection, as
+    ?format=csv.gz (default) or ?format=parquet.
+    """
+    try:
+        well_ids, bbox, river = get_well_selection(request)
+        wells = get_comparison_wells(well_ids or None, bbox, river, limit=None)
+        file_format = request.GET.get('format', CSV_GZIP)
+        content = export_stream(wells, file_format)
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+    response = StreamingHttpResponse(content, content_type=CONTENT_TYPES[file_format])
+    response['Content-Disposition'] = 'attachment; filename="{0}"'.format(export_filename(file_format))
+    return response
+
+
+@login_required()
+@instrument
+def hydrograph_statistics(request):
+    """
+    JSON endpoint with depth to groundwater statistics and trends of every well with a hydrograph,
+    or of the wells listed as ?well_id=1&well_id=2.
+    """
+    try:
+        well_ids = [int(well_id) for well_id in request.GET.getlist('well_id')] or None
+    except ValueError:
+        return JsonResponse({'error': 'Invalid well id.'}, status=400)
+
+    statistics = get_hydrograph_statistics(well_ids)
+
+    return JsonResponse({
+        'metrics': list(METRICS),
+        'units': dict({metric: 'ft' for metric in METRICS}, **UNITS),
+        'descriptions': DESCRIPTIONS,
+        'statistics': [dict(values, well_id=well_id) for well_id, values in sorted(statistics.items())],
+    })
+
+
+@api_view(['POST'])
+@authentication_classes((TokenAuthentication,))
+@instrument
+def telemetry(request):
+    """
+    Ingest API for data loggers. POST readings of any number of wells with an "Authorization: Token <api key>"
+    header, as JSON lines (application/x-ndjson) or packed binary records (application/octet-stream, see
+    telemetry.READING_DTYPE). Readings are buffered and written in bulk; when the buffer is full the response is
+    503 with a Retry-After header and nothing from the request is kept.
+    """
+    if not has_permission(request, 'ingest_telemetry'):
+        return JsonResponse({'error': 'Not allowed to ingest telemetry.'}, status=403)
+
+    try:
+        well_ids, times, depths = parse_readings(request.body, request.content_type)
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+    try:
+        pending = get_telemetry_buffer().add(well_ids, times, depths)
+    except BufferFull as e:
+        response = JsonResponse({'error': str(e)}, status=503)
+        response['Retry-After'] = str(e.retry_after)
+        return response
+
+    return JsonResponse({'accepted': len(times), 'pending': pending}, status=202)
+
+
+def metrics(request):
+    """
+    Prometheus-style latency percentiles per URL map name and figure cache counters of this process.
+    Disabled unless the enable_metrics setting is on.
+    """
+    if not app.get_custom_setting('enable_metrics'):
+        raise Http404('Metrics are disabled.')
+
+    figure_stats = get_figure_cache().stats()
+    counters = {
+        'well_inventory_figure_cache_hits_total': figure_stats['hits'],
+        'well_inventory_figure_cache_misses_total': figure_stats['misses'],
+    }
+    gauges = {
+        'well_inventory_figure_cache_size': figure_stats['size'],
+    }
+
+    # Readings waiting and the buffer size go up and down, the rest only add up
+    for name, value in get_telemetry_buffer().stats().items():
+        values = gauges if name in ('pending', 'capacity') else counters
+        values['well_inventory_telemetry_{0}'.format(name)] = value
+
+    return HttpResponse(prometheus_metrics(counters, gauges), content_type='text/plain; version=0.0.4')
+
+@login_required()
+@instrument
 def delete_well(request, well_id):
     """
     Controller for the deleting a well.
     """
-    Session = app.get_persistent_store_database('primary_db', as_sessionmaker=True)
-    session = Session()
-
-    # Delete well object
-    well = session.query(Well).get(int(well_id))
-    session.delete(well)
-    session.commit()
-    session.close()
+    name = remove_well(well_id)
 
-    messages.success(request, "{} Well has been successfully deleted.".format(well.name))
+    messages.success(request, "{} Well has been successfully deleted.".format(name))
 
     return redirect(reverse('well_inventory:wells'))
 
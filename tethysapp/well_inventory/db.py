@@ -0,0 +1,106 @@
+"""
+Process-wide database engine and request-scoped sessions. The engine and its connection pool are created once per
+process from the primary_db persistent store, configured by the db_pool_* settings. Model and helper functions all
+share the session of the current thread, which is removed when the request finishes (or when a background job ends),
+returning its connection to the pool.
+"""
+import threading
+
+from django.core.signals import request_finished
+from sqlalchemy import create_engine
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.orm import sessionmaker, scoped_session
+
+from .app import WellInventory as app
+
+DEFAULT_POOL_SIZE = 10
+DEFAULT_MAX_OVERFLOW = 10
+DEFAULT_POOL_RECYCLE = 1800  #: seconds, below the idle timeout of most servers and proxies
+
+Session = scoped_session(sessionmaker())
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def _setting(name, default):
+    value = app.get_custom_setting(name)
+    return default if value is None else value
+
+
+def create_pooled_engine(url, pool_size=DEFAULT_POOL_SIZE, max_overflow=DEFAULT_MAX_OVERFLOW,
+                         pool_recycle=DEFAULT_POOL_RECYCLE, pool_pre_ping=True):
+    """
+    Create an engine with a sized connection pool. SQLite keeps its default pool, which takes no sizing.
+    """
+    url = make_url(str(url))
+    options = {'pool_pre_ping': bool(pool_pre_ping)}
+
+    if url.get_backend_name() != 'sqlite':
+        options.update(
+            pool_size=int(pool_size),
+            max_overflow=int(max_overflow),
+            pool_recycle=int(pool_recycle),
+        )
+
+    return create_engine(url, **options)
+
+
+def get_engine():
+    """
+    Get the engine of this process, creating it and binding Session to it on first use.
+    """
+    global _engine
+
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                engine = create_pooled_engine(
+                    app.get_persistent_store_database('primary_db', as_url=True),
+                    pool_size=_setting('db_pool_size', DEFAULT_POOL_SIZE),
+                    max_overflow=_setting('db_max_overflow', DEFAULT_MAX_OVERFLOW),
+                    pool_recycle=_setting('db_pool_recycle', DEFAULT_POOL_RECYCLE),
+                    pool_pre_ping=_setting('db_pool_pre_ping', True),
+                )
+                Session.configure(bind=engine)
+                _engine = engine
+
+    return _engine
+
+
+def set_engine(engine):
+    """
+    Point this process at another database, as the benchmarks do with their scratch database.
+    """
+    global _engine
+
+    with _engine_lock:
+        Session.remove()
+        Session.configure(bind=engine)
+        _engine = engine
+
+
+def get_session():
+    """
+    Get the session of the current request or thread.
+    """
+    get_engine()
+    return Session()
+
+
+def create_session():
+    """
+    Create a session outside the request scope, for work that must commit independently. The caller closes it.
+    """
+    get_engine()
+    return Session.session_factory()
+
+
+def remove_session(**kwargs):
+    """
+    Close the session of the current request or thread, rolling back anything left uncommitted.
+    """
+    Session.remove()
+
+
+request_finished.connect(remove_session, dispatch_uid='well_inventory.remove_session')
@@ -0,0 +1,88 @@
+import numpy as np
+
+LTTB = 'lttb'  #: Largest-Triangle-Three-Buckets, keeps the visual shape of the series
+MIN_MAX = 'minmax'  #: min and max of each bucket, keeps every extreme
+METHODS = (LTTB, MIN_MAX)
+
+
+def lttb(x, y, threshold):
+    """
+    Downsample a series to threshold points with Largest-Triangle-Three-Buckets. Returns the kept indices.
+    """
+    n = len(x)
+
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+
+    xf = np.asarray(x, dtype=np.float64)
+    yf = np.asarray(y, dtype=np.float64)
+
+    # First and last points are always kept, the rest is split in threshold - 2 buckets
+    edges = np.linspace(1, n - 1, threshold - 1).astype(np.int64)
+    indices = np.empty(threshold, dtype=np.int64)
+    indices[0] = 0
+    indices[-1] = n - 1
+    a = 0
+
+    for i in range(threshold - 2):
+        start, end = edges[i], edges[i + 1]
+
+        # Third triangle vertex is the average of the next bucket (or the last point)
+        if i + 2 < len(edges):
+            next_start, next_end = edges[i + 1], edges[i + 2]
+            avg_x = xf[next_start:next_end].mean()
+            avg_y = yf[next_start:next_end].mean()
+        else:
+            avg_x = xf[n - 1]
+            avg_y = yf[n - 1]
+
+        areas = np.abs(
+            (xf[a] - avg_x) * (yf[start:end] - yf[a]) -
+            (xf[a] - xf[start:end]) * (avg_y - yf[a])
+        )
+        a = start + int(np.argmax(areas))
+        indices[i + 1] = a
+
+    return indices
+
+
+def min_max(x, y, threshold):
+    """
+    Downsample a series to about threshold points by keeping the min and max of each bucket. Returns the kept indices.
+    """
+    n = len(x)
+
+    if threshold >= n or threshold < 4:
+        return np.arange(n)
+
+    yf = np.asarray(y, dtype=np.float64)
+
+    # Pad to a whole number of equal buckets so all of them reduce in one call
+    bucket_size = int(np.ceil(n / (threshold // 2)))
+    num_buckets = int(np.ceil(n / bucket_size))
+    padded = np.full(num_buckets * bucket_size, np.nan)
+    padded[:n] = yf
+    buckets = padded.reshape(num_buckets, bucket_size)
+    offsets = np.arange(num_buckets) * bucket_size
+
+    mins = offsets + np.nanargmin(buckets, axis=1)
+    maxs = offsets + np.nanargmax(buckets, axis=1)
+
+    return np.unique(np.concatenate(([0, n - 1], mins, maxs)))
+
+
+def decimate(x, y, threshold, method=LTTB):
+    """
+    Downsample (x, y) to at most about threshold points with the given method.
+    """
+    if method == MIN_MAX:
+        indices = min_max(x, y, threshold)
+    elif method == LTTB:
+        indices = lttb(x, y, threshold)
+    else:
+        raise ValueError('Unknown downsampling method "{0}".'.format(method))
+
+    if len(indices) == len(x):
+        return x, y
+
+    return np.asarray(x)[indices], np.asarray(y)[indices]
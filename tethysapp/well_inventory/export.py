@@ -0,0 +1,119 @@
+"""
+Bulk export of hydrographs as gzip CSV or Parquet streams. Points are read in chunks through
+model.stream_hydrograph_points and each chunk is encoded and handed out as soon as it is read, so the download starts
+right away and memory stays flat however many points are exported. Parquet needs the optional pyarrow package;
+each chunk becomes a row group.
+"""
+import io
+import zlib
+
+import numpy as np
+
+from .db import get_engine
+from .model import stream_hydrograph_points
+
+CSV_GZIP = 'csv.gz'
+PARQUET = 'parquet'
+FORMATS = (CSV_GZIP, PARQUET)
+CONTENT_TYPES = {
+    CSV_GZIP: 'application/gzip',
+    PARQUET: 'application/vnd.apache.parquet',
+}
+
+CHUNK_SIZE = 500000  #: points read, encoded and sent at a time
+CSV_HEADER = b'well_id,time,depth\n'
+
+
+def export_filename(file_format):
+    return 'hydrographs.{0}'.format(file_format)
+
+
+def iter_well_chunks(wells, chunk_size=CHUNK_SIZE):
+    """
+    Read the hydrograph points of some well summaries as (well_ids, times, depths) chunks, on a connection of its
+    own that is closed when the export ends or is abandoned.
+    """
+    hydrograph_wells = {well.hydrograph_id: well.well_id for well in wells if well.hydrograph_id}
+
+    if not hydrograph_wells:
+        return
+
+    # Map hydrograph ids to well ids in bulk
+    keys = np.array(sorted(hydrograph_wells))
+    values = np.array([hydrograph_wells[key] for key in keys])
+
+    connection = get_engine().connect()
+    try:
+        for hydrograph_ids, times, flows in stream_hydrograph_points(connection, keys.tolist(), chunk_size):
+            yield values[np.searchsorted(keys, hydrograph_ids)], times, flows
+    finally:
+        connection.close()
+
+
+def write_csv_gzip(chunks):
+    """
+    Encode chunks as a gzip compressed CSV, yielding compressed bytes as they are produced.
+    """
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    yield compressor.compress(CSV_HEADER)
+
+    for well_ids, times, depths in chunks:
+        text = io.BytesIO()
+        np.savetxt(text, np.column_stack((well_ids, times, depths)), fmt=('%d', '%d', '%.6g'), delimiter=',')
+        data = compressor.compress(text.getvalue())
+
+        if data:
+            yield data
+
+    yield compressor.flush()
+
+
+def write_parquet(chunks):
+    """
+    Encode chunks as a Parquet file with one row group per chunk, yielding the bytes written after each one.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = pa.schema([('well_id', pa.int32()), ('time', pa.int32()), ('depth', pa.float64())])
+    sink = io.BytesIO()
+    writer = pq.ParquetWriter(sink, schema, compression='snappy')
+
+    def drain():
+        data = sink.getvalue()
+        sink.seek(0)
+        sink.truncate()
+        return data
+
+    try:
+        for well_ids, times, depths in chunks:
+            writer.write_table(pa.Table.from_arrays([
+                pa.array(np.asarray(well_ids, dtype=np.int32)),
+                pa.array(np.asarray(times, dtype=np.int32)),
+                pa.array(np.asarray(depths, dtype=np.float64)),
+            ], schema=schema))
+            yield drain()
+    finally:
+        writer.close()
+
+    # The footer is written on close
+    yield drain()
+
+
+def export_hydrographs(wells, file_format=CSV_GZIP, chunk_size=CHUNK_SIZE):
+    """
+    Get an iterator over the bytes of an export of the hydrographs of some well summaries.
+    Raises ValueError before anything is read when the format is unknown or its package is missing.
+    """
+    if file_format not in FORMATS:
+        raise ValueError('Unknown export format "{0}", use one of: {1}.'.format(file_format, ', '.join(FORMATS)))
+
+    if file_format == PARQUET:
+        try:
+            import pyarrow.parquet
+        except ImportError:
+            raise ValueError('Exporting Parquet files requires the pyarrow package.')
+
+        return write_parquet(iter_well_chunks(wells, chunk_size))
+
+    return write_csv_gzip(iter_well_chunks(wells, chunk_size))
@@ -0,0 +1,165 @@
+"""
+Cache of rendered hydrograph plots. Entries are keyed by hydrograph id, its content version and the plot options,
+so a replaced series is never served stale: the old version's keys simply stop being asked for. The in-process
+backend is a size-bounded LRU; the django and file backends share entries between processes and rely on the
+eviction of the underlying Django cache.
+"""
+import os
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+from .app import WellInventory as app
+
+MEMORY = 'memory'
+DJANGO = 'django'
+FILE = 'file'
+BACKENDS = (MEMORY, DJANGO, FILE)
+
+DEFAULT_SIZE = 256  #: plots kept by the in-process and file backends
+CACHE_PREFIX = 'well_inventory:figure'
+CACHE_TIMEOUT = 24 * 60 * 60  #: seconds, for the shared backends
+
+log = logging.getLogger('tethysapp.well_inventory.figures')
+
+_figure_cache = None
+_figure_cache_lock = threading.Lock()
+
+
+class FigureCache(object):
+    """
+    LRU cache of rendered plots with hit and miss counters. Set shared to a Django cache object to store
+    entries there instead of in this process.
+    """
+
+    def __init__(self, max_size=DEFAULT_SIZE, shared=None):
+        self.max_size = max(int(max_size), 1)
+        self.shared = shared
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def make_key(hydrograph_id, version, **options):
+        return (int(hydrograph_id), version or 0) + tuple(sorted(options.items()))
+
+    @staticmethod
+    def shared_key(key):
+        """
+        Key of a shared cache entry: the hydrograph id and version, then a digest of the plot options, so the key
+        stays short and free of the spaces and control characters memcached rejects.
+        """
+        digest = hashlib.sha1(repr(key[2:]).encode('utf-8')).hexdigest()
+        return '{0}:{1}:{2}:{3}'.format(CACHE_PREFIX, key[0], key[1], digest)
+
+    def get(self, key):
+        """
+        Get a cached plot, or None.
+        """
+        if self.shared is not None:
+            value = self.shared.get(self.shared_key(key))
+        else:
+            with self.lock:
+                value = self.entries.get(key)
+                if value is not None:
+                    self.entries.move_to_end(key)
+
+        with self.lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+
+        return value
+
+    def set(self, key, value):
+        """
+        Cache a plot, evicting the least recently used ones beyond max_size.
+        """
+        if self.shared is not None:
+            self.shared.set(self.shared_key(key), value, CACHE_TIMEOUT)
+            return
+
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def get_or_create(self, key, create):
+        """
+        Get a cached plot, rendering and caching it with create() on a miss.
+        """
+        value = self.get(key)
+
+        if value is None:
+            value = create()
+            self.set(key, value)
+
+        return value
+
+    def invalidate(self, hydrograph_id):
+        """
+        Drop the in-process plots of a hydrograph. Shared entries are left to expire, their version no longer matches.
+        """
+        with self.lock:
+            for key in [k for k in self.entries if k[0] == int(hydrograph_id)]:
+                del self.entries[key]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        """
+        Get the hit and miss counters of this process.
+        """
+        with self.lock:
+            requests = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': self.hits / requests if requests else 0.0,
+                'evictions': self.evictions,
+                'size': len(self.entries),
+            }
+
+
+def create_figure_cache(backend=MEMORY, max_size=DEFAULT_SIZE):
+    """
+    Create a figure cache for one of BACKENDS.
+    """
+    if backend == DJANGO:
+        from django.core.cache import cache
+        return FigureCache(max_size, shared=cache)
+
+    if backend == FILE:
+        from django.core.cache.backends.filebased import FileBasedCache
+        directory = os.path.join(app.get_app_workspace().path, 'figure_cache')
+        return FigureCache(max_size, shared=FileBasedCache(directory, {'OPTIONS': {'MAX_ENTRIES': max_size}}))
+
+    return FigureCache(max_size)
+
+
+def get_figure_cache():
+    """
+    Get the process-wide figure cache configured by the figure_cache_backend and figure_cache_size settings.
+    """
+    global _figure_cache
+
+    with _figure_cache_lock:
+        if _figure_cache is None:
+            backend = app.get_custom_setting('figure_cache_backend') or MEMORY
+
+            if backend not in BACKENDS:
+                log.warning('Unknown figure cache backend "%s", using "%s".', backend, MEMORY)
+                backend = MEMORY
+
+            _figure_cache = create_figure_cache(backend, app.get_custom_setting('figure_cache_size') or DEFAULT_SIZE)
+
+    return _figure_cache
@@ -1,30 +1,160 @@
+import base64
+
+import numpy as np
 from plotly import graph_objs as go
 from tethys_gizmos.gizmo_options import PlotlyView
 
-from .app import WellInventory as app
-from .model import Hydrograph
+from .db import get_session
+from .model import Hydrograph, get_hydrograph_version, get_series_batch
+from .figures import FigureCache, get_figure_cache
+from .downsample import decimate, LTTB, MIN_MAX
+from .pyramid import LEVEL_NAMES
+from . import compare
+
+PLOT_WIDTH = 1200  #: pixels, default width assumed for the hydrograph page
+POPUP_PLOT_WIDTH = 500  #: pixels, width of the map popup
+POPUP_TIME_DTYPE = np.dtype('<i4')  #: hours
+POPUP_FLOW_DTYPE = np.dtype('<f4')  #: ft, single precision is plenty for a 500 pixel plot
+
+
+def points_for_width(pixels, method=LTTB):
+    """
+    Number of points worth sending for a plot the given number of pixels wide.
+    """
+    # Min/max keeps two points per bucket, so give it two per pixel column
+    return int(pixels) * 2 if method == MIN_MAX else int(pixels)
+
+
+def select_series(hydrograph, max_points=None, method=LTTB, t0=None, t1=None):
+    """
+    Get (time, flow, level) for a hydrograph between t0 and t1, reduced to about max_points points.
+    Long ranges are read from the coarsest adequate aggregate level, in which case flow is the bucket mean, or with
+    MIN_MAX the low then the high of each bucket so that no extreme is lost.
+    """
+    level = hydrograph.select_level(max_points, t0, t1)
+
+    if level:
+        time, low, flow, high = hydrograph.get_aggregates(level, t0, t1)
+
+        if method == MIN_MAX:
+            time = np.repeat(time, 2)
+            flow = np.column_stack((low, high)).ravel()
+    else:
+        time, flow = hydrograph.get_series(t0, t1)
+
+    if max_points:
+        time, flow = decimate(time, flow, max_points, method=method)
+
+    return time, flow, level
+
+
+def series_name(well, level, method=LTTB):
+    """
+    Legend name of a hydrograph trace.
+    """
+    if level:
+        return '{0} {1} for {2}'.format(LEVEL_NAMES[level], 'range' if method == MIN_MAX else 'mean', well.name)
+
+    return 'Hydrograph for {0}'.format(well.name)
+
+
+def get_hydrograph_data(well_id, plot_width=PLOT_WIDTH, method=LTTB, full_resolution=False, t0=None, t1=None):
+    """
+    Get the hydrograph points of a well between t0 and t1 as a JSON-serializable dictionary, or None if
+    the well has no hydrograph.
+    """
+    session = get_session()
+    hydrograph = session.query(Hydrograph).filter_by(well_id=int(well_id)).first()
+
+    if not hydrograph:
+        return None
+
+    max_points = None if full_resolution else points_for_width(plot_width, method)
+    time, flow, level = select_series(hydrograph, max_points, method, t0, t1)
+
+    data = {
+        'well_id': hydrograph.well_id,
+        'hydrograph_id': hydrograph.id,
+        'name': series_name(hydrograph.well, level, method),
+        'level': level,
+        't0': t0,
+        't1': t1,
+        'time': time.tolist(),
+        'flow': flow.tolist(),
+    }
+    return data
+
+
+def encode_array(values, dtype):
+    """
+    Base64 of the little-endian bytes of an array, which browsers decode straight into a typed array.
+    """
+    return base64.b64encode(np.ascontiguousarray(values, dtype=dtype).tobytes()).decode('ascii')
 
 
-def create_hydrograph(hydrograph_id, height='520px', width='100%'):
+def get_popup_series(hydrograph_id, version, plot_width=POPUP_PLOT_WIDTH, method=LTTB):
     """
-    Generates a plotly view of a hydrograph.
+    Get the decimated series of a hydrograph for the map popup as a compact JSON-serializable dictionary, time as
+    base64 Int32 and flow as base64 Float32 arrays. Cached per hydrograph version like the plots.
+    """
+    key = FigureCache.make_key(hydrograph_id, version, popup=True, plot_width=plot_width, method=method)
+
+    def build():
+        session = get_session()
+        hydrograph = session.query(Hydrograph).get(int(hydrograph_id))
+        time, flow, level = select_series(hydrograph, points_for_width(plot_width, method), method)
+
+        return {
+            'hydrograph_id': hydrograph.id,
+            'well_id': hydrograph.well_id,
+            'version': version,
+            'level': level,
+            'name': '{0} mean'.format(LEVEL_NAMES[level]) if level else 'Depth to GW',
+            'count': len(time),
+            'time': encode_array(time, POPUP_TIME_DTYPE),
+            'flow': encode_array(flow, POPUP_FLOW_DTYPE),
+        }
+
+    return get_figure_cache().get_or_create(key, build)
+
+
+def create_hydrograph(hydrograph_id, height='520px', width='100%', plot_width=PLOT_WIDTH, method=LTTB,
+                      full_resolution=False, t0=None, t1=None):
+    """
+    Get the plotly view of a hydrograph between t0 and t1 hours, from the figure cache when this version of the
+    hydrograph was already rendered with the same options.
+    """
+    options = {
+        'height': height,
+        'width': width,
+        'plot_width': None if full_resolution else plot_width,
+        'method': method,
+        'full_resolution': full_resolution,
+        't0': t0,
+        't1': t1,
+    }
+    key = FigureCache.make_key(hydrograph_id, get_hydrograph_version(hydrograph_id), **options)
+    return get_figure_cache().get_or_create(key, lambda: render_hydrograph(hydrograph_id, **options))
+
+
+def render_hydrograph(hydrograph_id, height='520px', width='100%', plot_width=PLOT_WIDTH, method=LTTB,
+                      full_resolution=False, t0=None, t1=None):
+    """
+    Generates a plotly view of a hydrograph between t0 and t1 hours, downsampled to plot_width pixels
+    unless full_resolution is requested.
     """
     # Get objects from database
-    Session = app.get_persistent_store_database('primary_db', as_sessionmaker=True)
-    session = Session()
+    session = get_session()
     hydrograph = session.query(Hydrograph).get(int(hydrograph_id))
     well = hydrograph.well
-    time = []
-    flow = []
-    for hydro_point in hydrograph.points:
-        time.append(hydro_point.time)
-        flow.append(hydro_point.flow)
+    max_points = None if full_resolution else points_for_width(plot_width, method)
+    time, flow, level = select_series(hydrograph, max_points, method, t0, t1)
 
     # Build up Plotly plot
     hydrograph_go = go.Scatter(
         x=time,
         y=flow,
-        name='Hydrograph for {0}'.format(well.name),
+        name=series_name(well, level, method),
         line={'color': '#0080ff', 'width': 4, 'shape': 'spline'},
     )
     data = [hydrograph_go]
@@ -35,5 +165,49 @@ def create_hydrograph(hydrograph_id, height='520px', width='100%'):
     }
     figure = {'data': data, 'layout': layout}
     hydrograph_plot = PlotlyView(figure, height=height, width=width)
-    session.close()
     return hydrograph_plot
+
+
+def create_comparison_plot(wells, t0=None, t1=None, height='600px', width='100%', total_points=compare.TOTAL_POINTS):
+    """
+    Generates one plotly view overlaying the hydrographs of some well summaries between t0 and t1 hours. The series
+    are read in one batch and averaged on a common time axis, all of them together kept under total_points points.
+    Returns None when the wells have no points in the range.
+    """
+    time_range = compare.time_range(wells, t0, t1)
+
+    if not wells or time_range is None:
+        return None
+
+    t0, t1 = time_range
+    bins = compare.bins_per_series(len(wells), total_points)
+    level = compare.select_level(wells, bins, t0, t1)
+
+    # No more bins than buckets of the level read, so aggregates do not leave every other bin empty
+    bins = min(bins, max((t1 - t0) // (level or 1), 1))
+
+    series = get_series_batch([well.hydrograph_id for well in wells], level, t0, t1)
+    time, matrix = compare.align_series([series[well.hydrograph_id] for well in wells], t0, t1, bins)
+
+    # Build up Plotly plot
+    data = [
+        go.Scatter(
+            x=time,
+            y=flow,
+            name=well.name,
+            mode='lines',
+            connectgaps=True,
+            line={'width': 2},
+        )
+        for well, flow in zip(wells, matrix)
+    ]
+    layout = {
+        'title': 'Depth to GW Hydrographs of {0} Wells{1}'.format(
+            len(wells), ' ({0} means)'.format(LEVEL_NAMES[level]) if level else ''),
+        'xaxis': {'title': 'Time (hr)'},
+        'yaxis': {'title': 'Depth to Groundwater (ft)'},
+        'hovermode': 'x',
+    }
+    figure = {'data': data, 'layout': layout}
+    comparison_plot = PlotlyView(figure, height=height, width=width)
+    return comparison_plot
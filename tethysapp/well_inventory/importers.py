@@ -0,0 +1,213 @@
+"""
+Readers for bulk well imports. Each reader streams rows of a spreadsheet, CSV or GeoJSON file as dictionaries,
+which normalize_well turns into validated Well column values.
+"""
+import io
+import os
+import re
+import csv
+import json
+
+FORMATS = ('xlsx', 'csv', 'geojson')
+
+# Accepted spellings of each well field, compared lower case with spaces and underscores collapsed
+FIELD_ALIASES = {
+    'site_number': ('site number', 'site no', 'well number', 'file name'),
+    'name': ('name', 'well name', 'well number'),
+    'owner': ('owner',),
+    'river': ('aquifer', 'river', 'national aquifer', 'local aquifer'),
+    'date_built': ('date built',),
+    'latitude': ('latitude', 'lat'),
+    'longitude': ('longitude', 'lon', 'long', 'lng'),
+}
+
+DMS_PATTERN = re.compile(
+    r'^\s*(-)?(\d+(?:\.\d+)?)\s*°\s*'  # degrees
+    r'(?:(\d+(?:\.\d+)?)\s*[\'′])?\s*'  # minutes
+    r'(?:(\d+(?:\.\d+)?)\s*["″])?\s*'  # seconds
+    r'([NSEW])?\s*$',  # hemisphere
+    re.IGNORECASE
+)
+
+
+def get_format(filename):
+    """
+    Guess the import format of a file from its extension.
+    """
+    extension = os.path.splitext(filename)[1].lower().lstrip('.')
+
+    if extension == 'json':
+        extension = 'geojson'
+
+    if extension not in FORMATS:
+        raise ValueError('Unsupported well file "{0}", expected one of: {1}.'.format(filename, ', '.join(FORMATS)))
+
+    return extension
+
+
+def _key(header):
+    return re.sub(r'[\s_]+', ' ', str(header or '')).strip().lower()
+
+
+def iter_xlsx(well_file):
+    """
+    Stream the rows of the first worksheet of an XLSX file as dictionaries keyed by the header row.
+    """
+    try:
+        from openpyxl import load_workbook
+    except ImportError:
+        raise ValueError('Importing XLSX files requires the openpyxl package.')
+
+    # openpyxl raises anything from BadZipFile to KeyError for a file that is not a workbook
+    try:
+        workbook = load_workbook(well_file, read_only=True, data_only=True)
+        rows = workbook.worksheets[0].iter_rows(values_only=True)
+        headers = next(rows, None) or []
+    except Exception as e:
+        raise ValueError('Invalid XLSX file: {0}'.format(e))
+
+    for row in rows:
+        if any(value is not None for value in row):
+            yield dict(zip(headers, row))
+
+    workbook.close()
+
+
+def iter_csv(well_file):
+    """
+    Stream the rows of a CSV file, binary or text, as dictionaries keyed by the header row.
+    """
+    if not isinstance(well_file, io.TextIOBase):
+        well_file = io.TextIOWrapper(well_file, encoding='utf-8-sig', newline='')
+
+    try:
+        for row in csv.DictReader(well_file):
+            yield row
+    except csv.Error as e:
+        raise ValueError('Invalid CSV file: {0}'.format(e))
+
+
+def iter_geojson(well_file):
+    """
+    Get the properties of each Point feature of a GeoJSON file, with its coordinates as longitude and latitude.
+    Malformed features give rows without a location, which normalize_well rejects.
+    """
+    collection = json.load(well_file)
+
+    if not isinstance(collection, dict):
+        raise ValueError('Invalid GeoJSON file: expected a FeatureCollection or a Feature.')
+
+    features = collection.get('features', []) if collection.get('type') == 'FeatureCollection' else [collection]
+
+    if not isinstance(features, list):
+        raise ValueError('Invalid GeoJSON file: features must be a list.')
+
+    for feature in features:
+        feature = feature if isinstance(feature, dict) else {}
+        properties = feature.get('properties')
+        geometry = feature.get('geometry')
+        row = dict(properties) if isinstance(properties, dict) else {}
+        coordinates = geometry.get('coordinates') if isinstance(geometry, dict) else None
+
+        if geometry and geometry.get('type') == 'Point' and isinstance(coordinates, list) and len(coordinates) >= 2:
+            row['longitude'], row['latitude'] = coordinates[:2]
+
+        yield row
+
+
+READERS = {
+    'xlsx': iter_xlsx,
+    'csv': iter_csv,
+    'geojson': iter_geojson,
+}
+
+
+def iter_well_rows(well_file, file_format):
+    """
+    Stream raw rows of a well file in the given format.
+    """
+    return READERS[file_format](well_file)
+
+
+def parse_coordinate(value):
+    """
+    Parse decimal degrees or degrees-minutes-seconds such as 37°38'30"N into a float.
+    """
+    if isinstance(value, (int, float)):
+        return float(value)
+
+    text = str(value or '').strip()
+
+    if not text:
+        raise ValueError('missing coordinate')
+
+    try:
+        return float(text)
+    except ValueError:
+        pass
+
+    match = DMS_PATTERN.match(text)
+    if not match:
+        raise ValueError('invalid coordinate "{0}"'.format(text))
+
+    sign, degrees, minutes, seconds, hemisphere = match.groups()
+    decimal = float(degrees) + float(minutes or 0) / 60.0 + float(seconds or 0) / 3600.0
+
+    if sign or (hemisphere and hemisphere.upper() in 'SW'):
+        decimal = -decimal
+
+    return decimal
+
+
+def _text(value):
+    """
+    Cell value as text; whole numbers such as site numbers read from spreadsheets lose their trailing .0.
+    """
+    if value is None:
+        return ''
+
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+
+    return str(value).strip()
+
+
+def normalize_well(raw, west_longitudes=False):
+    """
+    Map a raw row onto Well columns and validate it. Raises ValueError with the reason a row is rejected.
+    Set west_longitudes for inventories that write western longitudes as positive values, as USGS site lists do.
+    """
+    fields = {_key(k): v for k, v in raw.items()}
+    well = {}
+
+    for field, aliases in FIELD_ALIASES.items():
+        for alias in (field.replace('_', ' '),) + aliases:
+            if alias in fields and fields[alias] not in (None, ''):
+                well[field] = fields[alias]
+                break
+
+    try:
+        latitude = parse_coordinate(well.get('latitude'))
+        longitude = parse_coordinate(well.get('longitude'))
+    except ValueError as e:
+        raise ValueError('Location: {0}'.format(e))
+
+    if west_longitudes and longitude > 0:
+        longitude = -longitude
+
+    if not -90.0 <= latitude <= 90.0 or not -180.0 <= longitude <= 180.0:
+        raise ValueError('Location ({0}, {1}) is out of range.'.format(longitude, latitude))
+
+    name = _text(well.get('name'))
+    if not name:
+        raise ValueError('Name is required.')
+
+    return {
+        'site_number': _text(well.get('site_number')) or None,
+        'name': name,
+        'owner': _text(well.get('owner')) or 'Other',
+        'river': _text(well.get('river')),
+        'date_built': _text(well.get('date_built')),
+        'latitude': latitude,
+        'longitude': longitude,
+    }
@@ -0,0 +1,120 @@
+import io
+import os
+import time
+import zipfile
+import itertools
+import numpy as np
+
+from .storage import TIME_DTYPE, FLOW_DTYPE
+
+CHUNK_SIZE = 100000  #: lines parsed per chunk
+
+
+def _parse_lines(lines):
+    """
+    Parse a list of "time,flow" byte lines into arrays, dropping lines that are not numeric.
+    """
+    try:
+        data = np.loadtxt(io.BytesIO(b''.join(lines)), delimiter=',', usecols=(0, 1), ndmin=2)
+    except ValueError:
+        # Headers or malformed lines; keep only the ones the original parser accepted
+        valid = []
+        for line in lines:
+            sline = line.split(b',')
+            try:
+                int(sline[0])
+                float(sline[1])
+            except (ValueError, IndexError):
+                continue
+            valid.append(line)
+
+        if not valid:
+            return np.empty(0, dtype=TIME_DTYPE), np.empty(0, dtype=FLOW_DTYPE)
+
+        data = np.loadtxt(io.BytesIO(b''.join(valid)), delimiter=',', usecols=(0, 1), ndmin=2)
+
+    # Times are whole hours within the range storage keeps, anything else is a malformed line
+    limits = np.iinfo(TIME_DTYPE)
+    keep = np.isfinite(data[:, 1]) & (data[:, 0] == np.floor(data[:, 0])) & \
+        (data[:, 0] >= limits.min) & (data[:, 0] <= limits.max)
+    return data[keep, 0].astype(TIME_DTYPE), data[keep, 1].astype(FLOW_DTYPE)
+
+
+def _split_lines(lines):
+    """
+    Split lines that hold bare carriage returns, as in files saved with classic Mac line endings.
+    """
+    for line in lines:
+        if b'\r' in line.rstrip(b'\r\n'):
+            for part in line.replace(b'\r\n', b'\n').replace(b'\r', b'\n').split(b'\n'):
+                if part:
+                    yield part + b'\n'
+        else:
+            yield line
+
+
+def iter_hydrograph_chunks(hydrograph_file, chunk_size=CHUNK_SIZE):
+    """
+    Lazily parse a hydrograph csv file (time, flow per line) into (times, flows) array chunks.
+    Memory use is bounded by chunk_size regardless of the size of the file.
+    """
+    lines = iter(hydrograph_file)
+
+    while True:
+        chunk = list(itertools.islice(lines, chunk_size))
+        if not chunk:
+            break
+
+        chunk = list(_split_lines(line if isinstance(line, bytes) else line.encode('utf-8') for line in chunk))
+        times, flows = _parse_lines(chunk)
+
+        if times.size > 0:
+            yield times, flows
+
+
+def list_hydrograph_files(path):
+    """
+    List the per-site hydrograph csv files of a directory or zip archive as (path, zip member or None) sources.
+    """
+    if zipfile.is_zipfile(path):
+        with zipfile.ZipFile(path) as archive:
+            return [(path, name) for name in sorted(archive.namelist())
+                    if name.lower().endswith('.csv') and not os.path.basename(name).startswith('.')]
+
+    return [(os.path.join(path, name), None) for name in sorted(os.listdir(path))
+            if name.lower().endswith('.csv') and not name.startswith('.')]
+
+
+def site_number(source):
+    """
+    Site number a hydrograph file belongs to, taken from its file name (e.g. 375050109034801.csv).
+    """
+    path, member = source
+    return os.path.splitext(os.path.basename(member or path))[0]
+
+
+def parse_hydrograph_source(source):
+    """
+    Parse a whole hydrograph file into arrays. Runs in worker processes, so it only returns plain data:
+    a dictionary with site, times, flows, parse_seconds and error.
+    """
+    start = time.time()
+    result = {'site': site_number(source), 'times': None, 'flows': None, 'error': None}
+
+    try:
+        path, member = source
+
+        if member:
+            with zipfile.ZipFile(path) as archive, archive.open(member) as hydrograph_file:
+                chunks = list(iter_hydrograph_chunks(hydrograph_file))
+        else:
+            with open(path, 'rb') as hydrograph_file:
+                chunks = list(iter_hydrograph_chunks(hydrograph_file))
+
+        result['times'] = np.concatenate([c[0] for c in chunks]) if chunks else np.empty(0, dtype=TIME_DTYPE)
+        result['flows'] = np.concatenate([c[1] for c in chunks]) if chunks else np.empty(0, dtype=FLOW_DTYPE)
+    except Exception as e:
+        result['error'] = str(e)
+
+    result['parse_seconds'] = time.time() - start
+    return result
@@ -0,0 +1,198 @@
+"""
+Per-request instrumentation of the controllers. Every SQL statement run while an instrumented controller handles a
+request is counted and timed through SQLAlchemy engine events, and timed() spans record other work such as
+building gizmos and rendering templates. Each request gets a Server-Timing header and a structured log line, and
+its latency is kept per URL map name for the optional Prometheus-style metrics endpoint.
+"""
+import json
+import time
+import logging
+import threading
+from collections import deque
+from contextlib import contextmanager
+from functools import wraps
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+LATENCY_WINDOW = 1000  #: most recent requests per URL map name used for the percentiles
+QUANTILES = (0.5, 0.95)
+
+log = logging.getLogger('tethysapp.well_inventory.requests')
+
+_local = threading.local()
+
+
+class LatencyStats(object):
+    """
+    Request counts, total time and a window of recent latencies per URL map name.
+    """
+
+    def __init__(self, window=LATENCY_WINDOW):
+        self.window = window
+        self.lock = threading.Lock()
+        self.latencies = {}
+        self.counts = {}
+        self.totals = {}
+
+    def add(self, name, seconds):
+        with self.lock:
+            if name not in self.latencies:
+                self.latencies[name] = deque(maxlen=self.window)
+                self.counts[name] = 0
+                self.totals[name] = 0.0
+
+            self.latencies[name].append(seconds)
+            self.counts[name] += 1
+            self.totals[name] += seconds
+
+    def summary(self):
+        """
+        Get {name: {'count', 'sum', quantile: seconds}} for every URL map name seen so far.
+        """
+        with self.lock:
+            summary = {}
+
+            for name, latencies in self.latencies.items():
+                ordered = sorted(latencies)
+                entry = {'count': self.counts[name], 'sum': self.totals[name]}
+
+                for quantile in QUANTILES:
+                    entry[quantile] = ordered[min(int(quantile * len(ordered)), len(ordered) - 1)]
+
+                summary[name] = entry
+
+            return summary
+
+
+latency_stats = LatencyStats()
+
+
+def current_record():
+    """
+    Get the instrumentation record of the request handled by this thread, or None.
+    """
+    return getattr(_local, 'record', None)
+
+
+@contextmanager
+def recording():
+    """
+    Record the SQL statements and spans of a block run by this thread. Recordings nest, an inner one adding its
+    counts to the outer one when it ends.
+    """
+    parent = current_record()
+    record = {'sql_count': 0, 'sql_seconds': 0.0, 'spans': {}}
+    _local.record = record
+
+    try:
+        yield record
+    finally:
+        _local.record = parent
+
+        if parent is not None:
+            parent['sql_count'] += record['sql_count']
+            parent['sql_seconds'] += record['sql_seconds']
+            for name, seconds in record['spans'].items():
+                parent['spans'][name] = parent['spans'].get(name, 0.0) + seconds
+
+
+@contextmanager
+def timed(name):
+    """
+    Add the time spent in a block to the named span of the current request.
+    """
+    start = time.time()
+
+    try:
+        yield
+    finally:
+        record = current_record()
+        if record is not None:
+            record['spans'][name] = record['spans'].get(name, 0.0) + time.time() - start
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if current_record() is not None:
+        conn.info.setdefault('well_inventory_query_start', []).append(time.time())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    record = current_record()
+    starts = conn.info.get('well_inventory_query_start')
+
+    if record is not None and starts:
+        record['sql_count'] += 1
+        record['sql_seconds'] += time.time() - starts.pop()
+
+
+def server_timing(record, total):
+    """
+    Format a Server-Timing header value, durations in milliseconds.
+    """
+    metrics = ['sql;dur={0:.1f};desc="{1} queries"'.format(1000.0 * record['sql_seconds'], record['sql_count'])]
+    metrics.extend('{0};dur={1:.1f}'.format(name, 1000.0 * seconds) for name, seconds in record['spans'].items())
+    metrics.append('total;dur={0:.1f}'.format(1000.0 * total))
+    return ', '.join(metrics)
+
+
+def instrument(controller):
+    """
+    Decorate a controller to count and time its SQL statements and spans, reporting them per request.
+    """
+    @wraps(controller)
+    def wrapper(request, *args, **kwargs):
+        resolver_match = getattr(request, 'resolver_match', None)
+        name = resolver_match.url_name if resolver_match else controller.__name__
+
+        start = time.time()
+
+        try:
+            with recording() as record:
+                response = controller(request, *args, **kwargs)
+        finally:
+            total = time.time() - start
+            latency_stats.add(name, total)
+
+        response['Server-Timing'] = server_timing(record, total)
+        log.info(json.dumps({
+            'url_map': name,
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'ms': round(1000.0 * total, 1),
+            'sql_count': record['sql_count'],
+            'sql_ms': round(1000.0 * record['sql_seconds'], 1),
+            'spans_ms': {span: round(1000.0 * seconds, 1) for span, seconds in record['spans'].items()},
+        }))
+
+        return response
+
+    return wrapper
+
+
+def prometheus_metrics(extra_counters=None, extra_gauges=None):
+    """
+    Render the latency summaries, and any extra {name: value} counters (values that only ever increase) and gauges,
+    in the Prometheus text format.
+    """
+    lines = [
+        '# HELP well_inventory_request_seconds Controller latency per URL map name.',
+        '# TYPE well_inventory_request_seconds summary',
+    ]
+
+    for name, entry in sorted(latency_stats.summary().items()):
+        for quantile in QUANTILES:
+            lines.append('well_inventory_request_seconds{{url_map="{0}",quantile="{1}"}} {2:.6f}'.format(
+                name, quantile, entry[quantile]))
+        lines.append('well_inventory_request_seconds_sum{{url_map="{0}"}} {1:.6f}'.format(name, entry['sum']))
+        lines.append('well_inventory_request_seconds_count{{url_map="{0}"}} {1}'.format(name, entry['count']))
+
+    for metric_type, values in (('counter', extra_counters), ('gauge', extra_gauges)):
+        for name, value in sorted((values or {}).items()):
+            lines.append('# TYPE {0} {1}'.format(name, metric_type))
+            lines.append('{0} {1}'.format(name, value))
+
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,179 @@
+"""
+Background processing of hydrograph uploads. Uploads are staged to the app workspace and recorded as IngestJob rows,
+then parsed and written by a pool of worker threads so requests return immediately. Jobs live in the database:
+queued jobs left behind by a restart are picked up when the pool starts and whenever a job page polls its status,
+running jobs that stopped reporting progress (their worker crashed or was restarted) are queued again, and workers
+claim a job atomically so web server processes sharing the database never run it twice.
+"""
+import os
+import uuid
+import time
+import datetime
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from .app import WellInventory as app
+from .db import remove_session
+from .model import IngestJob, Hydrograph, replace_hydrograph, create_ingest_job, claim_ingest_job, \
+    update_ingest_job, get_queued_ingest_jobs, requeue_stale_ingest_jobs
+
+DEFAULT_MAX_CONCURRENT_INGESTS = 2
+PROGRESS_LINES = 50000  #: lines read between progress updates
+STALE_JOB_SECONDS = 900  #: running jobs without a progress update for this long are queued again
+RECOVERY_SECONDS = 60  #: least time between two pickups of left-behind jobs by a process
+
+_executor = None
+_executor_lock = threading.Lock()
+_last_recovery = None
+_submitted = set()  # ids of the jobs waiting or running on the pool of this process
+
+
+def get_executor():
+    """
+    Get the process-wide ingest worker pool, sized by the max_concurrent_ingests setting. Jobs left behind by a
+    restart are picked up when it starts.
+    """
+    global _executor
+
+    with _executor_lock:
+        started = _executor is None
+        if started:
+            workers = app.get_custom_setting('max_concurrent_ingests') or DEFAULT_MAX_CONCURRENT_INGESTS
+            _executor = ThreadPoolExecutor(max_workers=max(int(workers), 1))
+
+    if started:
+        recover_ingest_jobs(force=True)
+
+    return _executor
+
+
+def submit_ingest_job(job_id, well_id, path, mode=Hydrograph.REPLACE):
+    """
+    Run a queued job on the pool of this process, unless it is already waiting or running there.
+    Returns whether it was submitted.
+    """
+    executor = get_executor()
+
+    with _executor_lock:
+        if job_id in _submitted:
+            return False
+        _submitted.add(job_id)
+
+    executor.submit(run_ingest_job, job_id, well_id, path, mode)
+    return True
+
+
+def recover_ingest_jobs(force=False):
+    """
+    Queue again running jobs that stopped reporting progress and run the queued jobs no worker has, such as those
+    left behind by a restart. Does nothing if it ran less than RECOVERY_SECONDS ago, unless forced.
+    Returns the number of jobs submitted.
+    """
+    global _last_recovery
+
+    with _executor_lock:
+        now = time.time()
+        if not force and _last_recovery is not None and now - _last_recovery < RECOVERY_SECONDS:
+            return 0
+        _last_recovery = now
+
+    requeue_stale_ingest_jobs(STALE_JOB_SECONDS)
+    submitted = 0
+
+    for job_id, well_id, path, mode in get_queued_ingest_jobs():
+        if submit_ingest_job(job_id, well_id, path, mode or Hydrograph.REPLACE):
+            submitted += 1
+
+    return submitted
+
+
+def get_upload_directory():
+    """
+    Directory of the app workspace where uploads wait for their job.
+    """
+    directory = os.path.join(app.get_app_workspace().path, 'uploads')
+    os.makedirs(directory, exist_ok=True)
+    return directory
+
+
+class ProgressFile(object):
+    """
+    Iterates over the lines of a binary file, reporting the number of bytes read every PROGRESS_LINES lines.
+    """
+
+    def __init__(self, hydrograph_file, callback):
+        self.hydrograph_file = hydrograph_file
+        self.callback = callback
+
+    def __iter__(self):
+        processed_bytes = 0
+
+        for line_number, line in enumerate(self.hydrograph_file, start=1):
+            processed_bytes += len(line)
+
+            if line_number % PROGRESS_LINES == 0:
+                self.callback(processed_bytes)
+
+            yield line
+
+        self.callback(processed_bytes)
+
+
+def run_ingest_job(job_id, well_id, path, mode=Hydrograph.REPLACE):
+    """
+    Process one staged upload, replacing or adding to the hydrograph of the well by mode, recording status, progress
+    and result on its job.
+    """
+    def report_progress(processed_bytes):
+        # Progress is informational; never fail an ingest because it could not be recorded (e.g. SQLite locks)
+        try:
+            update_ingest_job(job_id, processed_bytes=processed_bytes)
+        except Exception as e:
+            print(e)
+
+    try:
+        if not claim_ingest_job(job_id):
+            return
+
+        try:
+            with open(path, 'rb') as hydrograph_file:
+                stats = replace_hydrograph(well_id, ProgressFile(hydrograph_file, report_progress), mode)
+        except Exception as e:
+            # Careful not to hide error. At the very least log it to the console
+            print(e)
+            update_ingest_job(job_id, status=IngestJob.FAILED, error=str(e), finished=datetime.datetime.utcnow())
+        else:
+            # Appending a file with nothing new is not an error
+            if stats['points'] == 0 and mode == Hydrograph.REPLACE:
+                update_ingest_job(job_id, status=IngestJob.FAILED, error='No hydrograph points found in the file.',
+                                  finished=datetime.datetime.utcnow())
+            else:
+                update_ingest_job(job_id, status=IngestJob.DONE, points=stats['points'],
+                                  processed_bytes=os.path.getsize(path), finished=datetime.datetime.utcnow())
+
+        if os.path.exists(path):
+            os.remove(path)
+    finally:
+        # Workers are not request threads, release their session here
+        remove_session()
+
+        with _executor_lock:
+            _submitted.discard(job_id)
+
+
+def submit_hydrograph_upload(well_id, uploaded_file, mode=Hydrograph.REPLACE):
+    """
+    Stage an uploaded hydrograph file and queue it for a background worker. Returns the job id.
+    """
+    # Start the pool first so its pickup of queued jobs cannot include this one as well
+    get_executor()
+    path = os.path.join(get_upload_directory(), '{0}-{1}.csv'.format(int(time.time()), uuid.uuid4().hex))
+
+    with open(path, 'wb') as staged_file:
+        for chunk in uploaded_file.chunks():
+            staged_file.write(chunk)
+
+    job_id = create_ingest_job(well_id, path, os.path.getsize(path), mode)
+    submit_ingest_job(job_id, int(well_id), path, mode)
+
+    return job_id
@@ -1,11 +1,25 @@
+import io
+import itertools
 import os
-import uuid
+import time
 import json
+import datetime
+import warnings
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy import Column, Integer, Float, String, ForeignKey
-from sqlalchemy.orm import sessionmaker, relationship
+from sqlalchemy import Column, Integer, BigInteger, Float, String, DateTime, ForeignKey, LargeBinary, Index, \
+    inspect, func, cast, or_, and_, event
+from sqlalchemy.orm import sessionmaker, relationship, deferred, object_session
+from sqlalchemy.sql import bindparam, select, exists, tuple_
+from sqlalchemy.schema import CreateTable, CreateIndex
 
 from .app import WellInventory as app
+from . import storage, pyramid, tiles, spatial, analytics
+from .importers import normalize_well
+from .ingest import iter_hydrograph_chunks, list_hydrograph_files, parse_hydrograph_source
+from .figures import get_figure_cache
+from .db import get_session, create_session
 
 Base = declarative_base()
 
@@ -19,46 +33,681 @@ class Well(Base):
 
     # Columns
     id = Column(Integer, primary_key=True)
+    site_number = Column(String, index=True, unique=True)  #: e.g. USGS site number, used to match imports
     latitude = Column(Float)
     longitude = Column(Float)
-    name = Column(String)
-    owner = Column(String)
-    river = Column(String)
+    name = Column(String, index=True)
+    owner = Column(String, index=True)
+    river = Column(String, index=True)
     date_built = Column(String)
+    cell = Column(Integer, index=True)  #: grid cell id, see spatial.grid_cell
 
     # Relationships
     hydrograph = relationship('Hydrograph', cascade="all,delete", back_populates='well', uselist=False)
 
+    def to_feature(self):
+        """
+        Get the well as a GeoJSON Point Feature.
+        """
+        return {
+            'type': 'Feature',
+            'geometry': {
+                'type': 'Point',
+                'coordinates': [self.longitude, self.latitude],
+            },
+            'properties': {
+                'id': self.id,
+                'name': self.name,
+                'owner': self.owner,
+                'river': self.river,
+                'date_built': self.date_built
+            }
+        }
+
+@event.listens_for(Well, 'before_insert')
+@event.listens_for(Well, 'before_update')
+def set_well_cell(mapper, connection, well):
+    """
+    Keep the grid cell of a well in sync with its location.
+    """
+    well.cell = spatial.grid_cell(well.longitude, well.latitude)
+
+
 class Hydrograph(Base):
     """
     SQLAlchemy Hydrograph DB Model
     """
     __tablename__ = 'hydrographs'
 
+    # Upload modes
+    REPLACE = 'replace'  #: the upload replaces the stored series
+    APPEND = 'append'  #: only points after the stored end time are added
+    MERGE = 'merge'  #: all points are added, replacing stored ones at the same times
+    MODES = (REPLACE, APPEND, MERGE)
+
     # Columns
     id = Column(Integer, primary_key=True)
     well_id = Column(ForeignKey('wells.id'))
+    num_points = Column(Integer, default=0)
+    start_time = Column(Integer)  #: hours
+    end_time = Column(Integer)  #: hours
+    end_flow = Column(Float)  #: flow at end_time
+    version = Column(Integer, default=0)  #: bumped each time the series is replaced
+    series = deferred(Column(LargeBinary))  #: packed (time, flow) arrays, see storage.pack_series
 
     # Relationships
     well = relationship('Well', back_populates='hydrograph')
     points = relationship('HydrographPoint', cascade="all,delete", back_populates='hydrograph')
+    aggregates = relationship('HydrographAggregate', cascade="all,delete", back_populates='hydrograph')
 
+    def get_series(self, t0=None, t1=None):
+        """
+        Get the (time, flow) arrays of this hydrograph between t0 and t1 (inclusive), whichever backend holds them.
+        """
+        if self.series is not None:
+            times, flows = storage.unpack_series(self.series, self.num_points)
+            lo = 0 if t0 is None else np.searchsorted(times, t0, side='left')
+            hi = len(times) if t1 is None else np.searchsorted(times, t1, side='right')
+            return times[lo:hi], flows[lo:hi]
 
-class HydrographPoint(Base):
+        # Fall back to per-row points, selecting plain columns instead of building ORM objects
+        session = object_session(self)
+        query = session.query(HydrographPoint.time, HydrographPoint.flow).\
+            filter(HydrographPoint.hydrograph_id == self.id)
+
+        if t0 is not None:
+            query = query.filter(HydrographPoint.time >= t0)
+        if t1 is not None:
+            query = query.filter(HydrographPoint.time <= t1)
+
+        rows = query.order_by(HydrographPoint.time).all()
+        return storage.as_series([r[0] for r in rows], [r[1] for r in rows])
+
+    def get_aggregates(self, level, t0=None, t1=None):
+        """
+        Get the (time, min, mean, max) arrays of one pyramid level between t0 and t1.
+        """
+        session = object_session(self)
+        query = session.query(HydrographAggregate.time, HydrographAggregate.min_flow,
+                              HydrographAggregate.mean_flow, HydrographAggregate.max_flow).\
+            filter(HydrographAggregate.hydrograph_id == self.id, HydrographAggregate.level == level)
+
+        # Include the buckets that straddle the range boundaries
+        if t0 is not None:
+            query = query.filter(HydrographAggregate.time > t0 - level)
+        if t1 is not None:
+            query = query.filter(HydrographAggregate.time <= t1)
+
+        rows = query.order_by(HydrographAggregate.time).all()
+        columns = list(zip(*rows)) or [[], [], [], []]
+        return (
+            np.asarray(columns[0], dtype=storage.TIME_DTYPE),
+            np.asarray(columns[1], dtype=storage.FLOW_DTYPE),
+            np.asarray(columns[2], dtype=storage.FLOW_DTYPE),
+            np.asarray(columns[3], dtype=storage.FLOW_DTYPE),
+        )
+
+    def select_level(self, max_points, t0=None, t1=None):
+        """
+        Get the coarsest pyramid level able to fill max_points over the range, or None to read raw points.
+        """
+        if not self.num_points or self.start_time is None or self.end_time is None:
+            return None
+
+        t0 = self.start_time if t0 is None else max(t0, self.start_time)
+        t1 = self.end_time if t1 is None else min(t1, self.end_time)
+        total_span = max(self.end_time - self.start_time, 1)
+        span = max(t1 - t0, 0)
+
+        # Assume points are spread evenly over the record to estimate how many fall in range
+        num_points = self.num_points * span / float(total_span)
+        return pyramid.select_level(num_points, span, max_points)
+
+    def has_series(self):
+        """
+        Whether any points are stored, whichever backend holds them. Checks the points themselves rather than
+        num_points, which rows saved before it existed may leave empty.
+        """
+        session = object_session(self)
+        if self.id is None or session is None:
+            return self.__dict__.get('series') is not None
+
+        return self.id in get_stored_hydrograph_ids(session, [self.id])
+
+    def set_series(self, times, flows, backend=None):
+        """
+        Replace the series of this hydrograph using the configured storage backend.
+        """
+        return self.load_series([(times, flows)], backend=backend)
+
+    def load_series(self, chunks, backend=None):
+        """
+        Replace the series of this hydrograph from an iterable of (times, flows) chunks. Returns the number of points.
+        The aggregate pyramid is rebuilt from the same chunks as they stream through.
+        """
+        backend = backend or get_storage_backend()
+        session = object_session(self)
+        builder = pyramid.PyramidBuilder()
+
+        # Make sure the hydrograph has an id before points reference it
+        session.flush()
+
+        # Remove old points, if any, in one statement
+        delete_points(session, self.id)
+        num_points = 0
+
+        if backend == storage.COLUMNAR:
+            # The packed buffer is built in one go, but at 12 bytes per point
+            chunks = list(chunks)
+            times = np.concatenate([c[0] for c in chunks]) if chunks else []
+            flows = np.concatenate([c[1] for c in chunks]) if chunks else []
+            times, flows = storage.unique_series(times, flows)
+            builder.add(times, flows)
+            self.series = storage.pack_series(times, flows)
+            num_points = len(times)
+        else:
+            self.series = None
+            last = None
+            overlapped = False
+
+            for times, flows in chunks:
+                times, flows = storage.unique_series(times, flows)
+
+                if len(times) == 0:
+                    continue
+
+                # A chunk going back in time may repeat times already written, the later flow wins as within a chunk
+                if last is not None and times[0] <= last:
+                    num_points -= delete_points(session, self.id, times)
+                    overlapped = True
+
+                builder.add(times, flows)
+                num_points += insert_points(session, self.id, times, flows)
+                last = int(times[-1]) if last is None else max(last, int(times[-1]))
+
+            # The builder counted the repeated times twice, start it over from the stored points
+            if overlapped:
+                builder = pyramid.PyramidBuilder()
+                builder.add(*self.get_series())
+
+        self.num_points = num_points
+        self.version = (self.version or 0) + 1
+        self.start_time = builder.start_time
+        self.end_time = builder.end_time
+        self.end_flow = builder.end_flow
+        write_aggregates(session, self.id, builder.build())
+        return num_points
+
+    def merge_series(self, chunks, mode=APPEND):
+        """
+        Add (times, flows) chunks to the stored series instead of replacing it, as APPEND or MERGE. Only the
+        aggregate buckets around the new points are recomputed, so the cost follows the number of new points rather
+        than the length of the record (a columnar series is still repacked whole). Returns the number of points
+        written.
+        """
+        if mode not in (self.APPEND, self.MERGE):
+            raise ValueError('Unknown merge mode "{0}".'.format(mode))
+
+        session = object_session(self)
+
+        # Counters missing on rows saved before they existed are needed below, recompute them from the points
+        if self.num_points is None:
+            self.rebuild_pyramid()
+
+        stored_end = self.end_time
+        num_points = self.num_points or 0
+        written = 0
+        first = last = last_flow = None
+
+        def new_points(times, flows):
+            times, flows = storage.unique_series(times, flows)
+
+            if mode == self.APPEND and stored_end is not None:
+                keep = times > stored_end
+                times, flows = times[keep], flows[keep]
+
+            return times, flows
+
+        if self.series is not None:
+            chunks = [new_points(times, flows) for times, flows in chunks]
+            times = np.concatenate([c[0] for c in chunks] + [np.empty(0, dtype=storage.TIME_DTYPE)])
+            flows = np.concatenate([c[1] for c in chunks] + [np.empty(0, dtype=storage.FLOW_DTYPE)])
+            times, flows = storage.unique_series(times, flows)
+
+            if len(times):
+                # New points go last, so unique_series keeps them over stored ones at the same time
+                old_times, old_flows = self.get_series()
+                merged_times, merged_flows = storage.unique_series(np.concatenate((old_times, times)),
+                                                                   np.concatenate((old_flows, flows)))
+                self.series = storage.pack_series(merged_times, merged_flows)
+                num_points = len(merged_times)
+                written = len(times)
+                first, last, last_flow = int(times[0]), int(times[-1]), float(flows[-1])
+        else:
+            for times, flows in chunks:
+                times, flows = new_points(times, flows)
+
+                if len(times) == 0:
+                    continue
+
+                # Appended chunks only need this when they overlap each other
+                if mode == self.MERGE or (last is not None and times[0] <= last):
+                    num_points -= delete_points(session, self.id, times)
+
+                num_points += insert_points(session, self.id, times, flows)
+                written += len(times)
+                first = int(times[0]) if first is None else min(first, int(times[0]))
+
+                if last is None or times[-1] >= last:
+                    last, last_flow = int(times[-1]), float(flows[-1])
+
+        if not written:
+            return 0
+
+        self.num_points = num_points
+        self.version = (self.version or 0) + 1
+        self.start_time = first if self.start_time is None else min(self.start_time, first)
+
+        if self.end_time is None or last >= self.end_time:
+            self.end_time = last
+            self.end_flow = last_flow
+
+        # Rebuild the buckets of every level that hold new points, from the points stored around them
+        start, end = pyramid.aligned_range(first, last)
+        builder = pyramid.PyramidBuilder()
+        builder.add(*self.get_series(start, end - 1))
+        write_aggregates(session, self.id, builder.build(), start, end)
+        return written
+
+    def rebuild_pyramid(self):
+        """
+        Recompute the aggregate pyramid from the stored series.
+        """
+        builder = pyramid.PyramidBuilder()
+        times, flows = self.get_series()
+        builder.add(times, flows)
+        self.num_points = len(times)
+        self.start_time = builder.start_time
+        self.end_time = builder.end_time
+        self.end_flow = builder.end_flow
+        write_aggregates(object_session(self), self.id, builder.build())
+
+
+class HydrographAggregate(Base):
     """
-    SQLAlchemy Hydrograph Point DB Model
+    SQLAlchemy Hydrograph Aggregate DB Model, one bucket of one pyramid level
     """
-    __tablename__ = 'hydrograph_points'
+    __tablename__ = 'hydrograph_aggregates'
+    __table_args__ = (
+        Index('ix_hydrograph_aggregates_hydrograph_level_time', 'hydrograph_id', 'level', 'time'),
+    )
 
     # Columns
     id = Column(Integer, primary_key=True)
     hydrograph_id = Column(ForeignKey('hydrographs.id'))
-    time = Column(Integer)  #: hours
+    level = Column(Integer)  #: hours per bucket
+    time = Column(Integer)  #: hours, start of bucket
+    count = Column(Integer)
+    min_flow = Column(Float)
+    mean_flow = Column(Float)
+    max_flow = Column(Float)
+
+    # Relationships
+    hydrograph = relationship('Hydrograph', back_populates='aggregates')
+
+
+class HydrographStatistics(Base):
+    """
+    SQLAlchemy Hydrograph Statistics DB Model, the analytics.METRICS of one version of a hydrograph
+    """
+    __tablename__ = 'hydrograph_statistics'
+
+    # Columns
+    hydrograph_id = Column(ForeignKey('hydrographs.id'), primary_key=True)
+    version = Column(Integer)  #: Hydrograph.version the statistics were computed from
+    count = Column(Integer)
+    minimum = Column(Float)  #: ft
+    maximum = Column(Float)
+    mean = Column(Float)
+    daily_p10 = Column(Float)  #: of the daily means
+    daily_median = Column(Float)
+    daily_p90 = Column(Float)
+    winter_mean = Column(Float)
+    spring_mean = Column(Float)
+    summer_mean = Column(Float)
+    autumn_mean = Column(Float)
+    linear_trend = Column(Float)  #: ft/yr
+    sens_slope = Column(Float)
+    drawdown_rate = Column(Float)
+
+    def to_dict(self):
+        return {metric: getattr(self, metric) for metric in analytics.METRICS}
+
+
+class HydrographPoint(Base):
+    """
+    SQLAlchemy Hydrograph Point DB Model, keyed by hydrograph and time so the points of a hydrograph are one range
+    of the primary key. See rebuild_hydrograph_points for partitioning on PostgreSQL.
+    """
+    __tablename__ = 'hydrograph_points'
+
+    # Columns
+    hydrograph_id = Column(ForeignKey('hydrographs.id'), primary_key=True)
+    time = Column(Integer, primary_key=True)  #: hours
     flow = Column(Float)  #: cfs
 
     # Relationships
     hydrograph = relationship('Hydrograph', back_populates='points')
 
+
+class WellSummary(Base):
+    """
+    SQLAlchemy Well Summary DB Model, a well with the summary of its hydrograph as read by the wells table and the map.
+    Rows are kept up to date from wells and hydrographs by refresh_well_summary.
+    """
+    __tablename__ = 'well_summary'
+    __table_args__ = (
+        # Pages of the wells table are ranges of these, see get_wells_page
+        Index('ix_well_summary_name_well_id', 'name', 'well_id'),
+        Index('ix_well_summary_owner_well_id', 'owner', 'well_id'),
+        Index('ix_well_summary_river_well_id', 'river', 'well_id'),
+        Index('ix_well_summary_date_built_well_id', 'date_built', 'well_id'),
+        Index('ix_well_summary_num_points_well_id', 'num_points', 'well_id'),
+        Index('ix_well_summary_end_time_well_id', 'end_time', 'well_id'),
+    )
+
+    # Columns
+    well_id = Column(ForeignKey('wells.id'), primary_key=True)
+    name = Column(String)
+    owner = Column(String)
+    river = Column(String)
+    date_built = Column(String)
+    latitude = Column(Float)
+    longitude = Column(Float)
+    cell = Column(Integer, index=True)  #: grid cell id, see spatial.grid_cell
+    hydrograph_id = Column(Integer)
+    num_points = Column(Integer)
+    start_time = Column(Integer)  #: hours
+    end_time = Column(Integer)  #: hours
+    latest_depth = Column(Float)  #: ft, at end_time
+
+    def to_feature(self):
+        """
+        Get the well as a GeoJSON Point Feature.
+        """
+        return {
+            'type': 'Feature',
+            'geometry': {
+                'type': 'Point',
+                'coordinates': [self.longitude, self.latitude],
+            },
+            'properties': {
+                'id': self.well_id,
+                'name': self.name,
+                'owner': self.owner,
+                'river': self.river,
+                'date_built': self.date_built,
+                'has_hydrograph': self.hydrograph_id is not None
+            }
+        }
+
+
+# Prefix search of the wells table on lower(column), see get_wells_page; text_pattern_ops lets PostgreSQL use them
+# for LIKE 'term%' whatever the database collation
+Index('ix_well_summary_name_prefix', func.lower(WellSummary.__table__.c.name).label('name_lower'),
+      postgresql_ops={'name_lower': 'text_pattern_ops'})
+Index('ix_well_summary_owner_prefix', func.lower(WellSummary.__table__.c.owner).label('owner_lower'),
+      postgresql_ops={'owner_lower': 'text_pattern_ops'})
+Index('ix_well_summary_river_prefix', func.lower(WellSummary.__table__.c.river).label('river_lower'),
+      postgresql_ops={'river_lower': 'text_pattern_ops'})
+
+
+class CacheVersion(Base):
+    """
+    SQLAlchemy Cache Version DB Model, a counter bumped whenever the data behind a cache changes
+    """
+    __tablename__ = 'cache_versions'
+
+    WELLS = 'wells'  #: well locations and attributes
+
+    # Columns
+    name = Column(String, primary_key=True)
+    version = Column(Integer, default=0)
+
+
+class IngestJob(Base):
+    """
+    SQLAlchemy Ingest Job DB Model, a hydrograph upload waiting for or being processed by a background worker
+    """
+    __tablename__ = 'ingest_jobs'
+
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+
+    # Columns
+    id = Column(Integer, primary_key=True)
+    well_id = Column(ForeignKey('wells.id', ondelete='CASCADE'))
+    path = Column(String)  #: staged upload in the app workspace
+    mode = Column(String, default='replace')  #: one of Hydrograph.MODES
+    status = Column(String, default=QUEUED, index=True)
+    total_bytes = Column(BigInteger, default=0)
+    processed_bytes = Column(BigInteger, default=0)
+    points = Column(BigInteger, default=0)
+    error = Column(String)
+    created = Column(DateTime, default=datetime.datetime.utcnow)
+    started = Column(DateTime)
+    updated = Column(DateTime)  #: last progress update while running
+    finished = Column(DateTime)
+
+    def to_dict(self):
+        """
+        Get the job as a JSON-serializable dictionary.
+        """
+        progress = 1.0 if self.status == self.DONE else \
+            (self.processed_bytes or 0) / float(self.total_bytes) if self.total_bytes else 0.0
+
+        return {
+            'id': self.id,
+            'well_id': self.well_id,
+            'mode': self.mode,
+            'status': self.status,
+            'progress': min(progress, 1.0),
+            'total_bytes': self.total_bytes,
+            'processed_bytes': self.processed_bytes,
+            'points': self.points,
+            'error': self.error,
+            'created': self.created.isoformat() if self.created else None,
+            'started': self.started.isoformat() if self.started else None,
+            'finished': self.finished.isoformat() if self.finished else None,
+        }
+
+
+DELETE_BATCH_SIZE = 1000  #: times per DELETE when deleting points at given times
+
+
+def delete_points(session, hydrograph_id, times=None):
+    """
+    Delete all points of a hydrograph with a single set-based DELETE, or only its points at the given times.
+    Returns the number of points deleted.
+    """
+    query = session.query(HydrographPoint).filter(HydrographPoint.hydrograph_id == hydrograph_id)
+
+    if times is None:
+        return query.delete(synchronize_session=False)
+
+    times = [int(t) for t in times]
+    deleted = 0
+
+    for i in range(0, len(times), DELETE_BATCH_SIZE):
+        deleted += query.filter(HydrographPoint.time.in_(times[i:i + DELETE_BATCH_SIZE])).\
+            delete(synchronize_session=False)
+
+    return deleted
+
+
+def get_stored_hydrograph_ids(session, hydrograph_ids):
+    """
+    Get the ids, among hydrograph_ids, of hydrographs with a packed series or stored points, in one query and
+    without loading the series.
+    """
+    if not hydrograph_ids:
+        return set()
+
+    query = session.query(Hydrograph.id).\
+        filter(Hydrograph.id.in_(list(hydrograph_ids))).\
+        filter(or_(Hydrograph.series.isnot(None), exists().where(HydrographPoint.hydrograph_id == Hydrograph.id)))
+
+    return set(hydrograph_id for hydrograph_id, in query)
+
+
+def insert_points(session, hydrograph_id, times, flows):
+    """
+    Bulk insert points of a hydrograph, using COPY on PostgreSQL and executemany elsewhere.
+    Repeated times keep their last flow.
+    """
+    times, flows = storage.unique_series(times, flows)
+    connection = session.connection()
+
+    if connection.dialect.name == 'postgresql':
+        buffer = io.StringIO()
+        for t, f in zip(times.tolist(), flows.tolist()):
+            buffer.write('{0},{1},{2!r}\n'.format(hydrograph_id, t, f))
+        buffer.seek(0)
+
+        cursor = connection.connection.cursor()
+        cursor.copy_expert('COPY hydrograph_points (hydrograph_id, time, flow) FROM STDIN WITH CSV', buffer)
+        cursor.close()
+    else:
+        connection.execute(
+            HydrographPoint.__table__.insert(),
+            [{'hydrograph_id': hydrograph_id, 'time': t, 'flow': f} for t, f in zip(times.tolist(), flows.tolist())]
+        )
+
+    return len(times)
+
+
+def write_aggregates(session, hydrograph_id, levels, t0=None, t1=None):
+    """
+    Replace the aggregate pyramid of a hydrograph with the output of PyramidBuilder.build, or only its buckets
+    starting from t0 and before t1.
+    """
+    query = session.query(HydrographAggregate).filter(HydrographAggregate.hydrograph_id == hydrograph_id)
+
+    if t0 is not None:
+        query = query.filter(HydrographAggregate.time >= t0)
+    if t1 is not None:
+        query = query.filter(HydrographAggregate.time < t1)
+
+    query.delete(synchronize_session=False)
+
+    rows = []
+    for level, (times, counts, mins, means, maxs) in levels.items():
+        for t, count, low, mean, high in zip(times.tolist(), counts.tolist(), mins.tolist(), means.tolist(),
+                                             maxs.tolist()):
+            rows.append({'hydrograph_id': hydrograph_id, 'level': level, 'time': t, 'count': count,
+                         'min_flow': low, 'mean_flow': mean, 'max_flow': high})
+
+    if rows:
+        session.connection().execute(HydrographAggregate.__table__.insert(), rows)
+
+
+def get_storage_backend():
+    """
+    Get the configured hydrograph storage backend.
+    """
+    backend = app.get_custom_setting('hydrograph_storage') or storage.POINTS
+
+    if backend not in storage.BACKENDS:
+        raise ValueError('Unknown hydrograph storage backend "{0}".'.format(backend))
+
+    return backend
+
+
+WELL_SUMMARY_COLUMNS = (
+    (WellSummary.well_id, Well.id),
+    (WellSummary.name, Well.name),
+    (WellSummary.owner, Well.owner),
+    (WellSummary.river, Well.river),
+    (WellSummary.date_built, Well.date_built),
+    (WellSummary.latitude, Well.latitude),
+    (WellSummary.longitude, Well.longitude),
+    (WellSummary.cell, Well.cell),
+    (WellSummary.hydrograph_id, Hydrograph.id),
+    (WellSummary.num_points, Hydrograph.num_points),
+    (WellSummary.start_time, Hydrograph.start_time),
+    (WellSummary.end_time, Hydrograph.end_time),
+    (WellSummary.latest_depth, Hydrograph.end_flow),
+)
+
+
+def refresh_well_summary(connection, condition):
+    """
+    Rebuild the well_summary rows of the wells matching a SQL condition on Well (e.g. Well.id == 1),
+    with one delete and one insert from a select of wells joined to their hydrographs.
+    """
+    connection.execute(
+        WellSummary.__table__.delete().
+        where(WellSummary.well_id.in_(select([Well.id]).where(condition)))
+    )
+    connection.execute(
+        WellSummary.__table__.insert().from_select(
+            [summary.key for summary, source in WELL_SUMMARY_COLUMNS],
+            select([source for summary, source in WELL_SUMMARY_COLUMNS]).
+            select_from(Well.__table__.outerjoin(Hydrograph.__table__, Hydrograph.well_id == Well.id)).
+            where(condition)
+        )
+    )
+
+
+@event.listens_for(Well, 'after_insert')
+@event.listens_for(Well, 'after_update')
+def update_well_summary(mapper, connection, well):
+    """
+    Keep the summary of a well in sync when it is saved through the ORM.
+    """
+    refresh_well_summary(connection, Well.id == well.id)
+
+
+@event.listens_for(Hydrograph, 'after_insert')
+@event.listens_for(Hydrograph, 'after_update')
+def update_hydrograph_summary(mapper, connection, hydrograph):
+    """
+    Keep the summary of the well of a hydrograph in sync when the hydrograph is saved through the ORM.
+    """
+    if hydrograph.well_id is not None:
+        refresh_well_summary(connection, Well.id == hydrograph.well_id)
+
+
+@event.listens_for(Well, 'before_delete')
+def delete_well_summary(mapper, connection, well):
+    connection.execute(WellSummary.__table__.delete().where(WellSummary.well_id == well.id))
+
+
+def get_cache_version(name):
+    """
+    Get the current version of a cache.
+    """
+    session = get_session()
+
+    version = session.query(CacheVersion.version).filter(CacheVersion.name == name).scalar()
+
+    return version or 0
+
+
+def bump_cache_version(session, name):
+    """
+    Invalidate a cache as part of the transaction of session.
+    """
+    updated = session.query(CacheVersion).\
+        filter(CacheVersion.name == name).\
+        update({'version': CacheVersion.version + 1}, synchronize_session=False)
+
+    if not updated:
+        session.add(CacheVersion(name=name, version=1))
+
+
 def add_new_well(location, name, owner, river, date_built):
     """
     Persist new well.
@@ -80,15 +729,77 @@ def add_new_well(location, name, owner, river, date_built):
     )
 
     # Get connection/session to database
-    Session = app.get_persistent_store_database('primary_db', as_sessionmaker=True)
-    session = Session()
+    session = get_session()
 
     # Add the new well record to the session
     session.add(new_well)
+    bump_cache_version(session, CacheVersion.WELLS)
 
-    # Commit the session and close the connection
+    # Commit the session
     session.commit()
-    session.close()
+
+
+def delete_well(well_id):
+    """
+    Delete a well with its hydrograph, using set-based deletes for the hydrograph rows. Returns the well name.
+    """
+    session = get_session()
+
+    well = session.query(Well).get(int(well_id))
+    name = well.name
+    hydrograph_ids = [h for h, in session.query(Hydrograph.id).filter(Hydrograph.well_id == well.id)]
+
+    for hydrograph_id in hydrograph_ids:
+        delete_points(session, hydrograph_id)
+        session.query(HydrographAggregate).\
+            filter(HydrographAggregate.hydrograph_id == hydrograph_id).\
+            delete(synchronize_session=False)
+
+    session.query(HydrographStatistics).\
+        filter(HydrographStatistics.hydrograph_id.in_(hydrograph_ids)).\
+        delete(synchronize_session=False)
+    session.query(Hydrograph).filter(Hydrograph.well_id == well.id).delete(synchronize_session=False)
+    session.query(WellSummary).filter(WellSummary.well_id == well.id).delete(synchronize_session=False)
+    session.query(Well).filter(Well.id == well.id).delete(synchronize_session=False)
+    bump_cache_version(session, CacheVersion.WELLS)
+
+    session.commit()
+
+    for hydrograph_id in hydrograph_ids:
+        get_figure_cache().invalidate(hydrograph_id)
+
+    return name
+
+
+def get_well_features():
+    """
+    Get all wells as GeoJSON features, reading plain columns of the well summary rather than objects.
+    Features only hold what changes with CacheVersion.WELLS, not the latest depth that every reading moves.
+    """
+    session = get_session()
+
+    rows = session.query(WellSummary.well_id, WellSummary.name, WellSummary.owner, WellSummary.river,
+                         WellSummary.date_built, WellSummary.longitude, WellSummary.latitude,
+                         WellSummary.hydrograph_id).order_by(WellSummary.well_id).all()
+
+    return [
+        {
+            'type': 'Feature',
+            'geometry': {
+                'type': 'Point',
+                'coordinates': [longitude, latitude],
+            },
+            'properties': {
+                'id': well_id,
+                'name': name,
+                'owner': owner,
+                'river': river,
+                'date_built': date_built,
+                'has_hydrograph': hydrograph_id is not None
+            }
+        }
+        for well_id, name, owner, river, date_built, longitude, latitude, hydrograph_id in rows
+    ]
 
 
 def get_all_wells():
@@ -96,119 +807,1162 @@ def get_all_wells():
     Get all persisted wells.
     """
     # Get connection/session to database
-    Session = app.get_persistent_store_database('primary_db', as_sessionmaker=True)
-    session = Session()
+    session = get_session()
 
     # Query for all well records
     wells = session.query(Well).all()
-    session.close()
 
     return wells
 
 
-def init_primary_db(engine, first_time):
+def floor_int(expression, dialect):
     """
-    Initializer for the primary database.
+    Floor a non-negative SQL expression to an integer. SQLite has no floor function, but its cast truncates.
     """
-    # Create all the tables
-    Base.metadata.create_all(engine)
+    if dialect.name == 'sqlite':
+        return cast(expression, Integer)
 
-    # Add data
-    if first_time:
-        # Make session
-        Session = sessionmaker(bind=engine)
-        session = Session()
+    return cast(func.floor(expression), Integer)
 
-        # Initialize database with two wells
-        well1 = Well(
-            latitude=40.406624,
-            longitude=-111.529133,
-            name="Deer Creek",
-            owner="Reclamation",
-            river="Provo Aquifer",
-            date_built="April 12, 1993"
-        )
 
-        well2 = Well(
-            latitude=40.598168,
-            longitude=-111.424055,
-            name="Jordanelle",
-            owner="Reclamation",
-            river="Provo Aquifer",
-            date_built="1941"
-        )
+def rebuild_hydrograph_points(engine, partitions=0):
+    """
+    Recreate the hydrograph_points table from the current model, keyed by hydrograph and time, and copy the points
+    back in key order, keeping the last one inserted for each hydrograph and time. With partitions, the table is
+    hash partitioned by hydrograph on PostgreSQL so the points of a hydrograph stay in one partition.
+    Returns the number of points kept.
+    """
+    partitions = int(partitions or 0)
+    if partitions and engine.dialect.name != 'postgresql':
+        raise ValueError('Partitioning hydrograph points requires PostgreSQL.')
 
-        # Add the wells to the session, commit, and close
-        session.add(well1)
-        session.add(well2)
-        session.commit()
-        session.close()
+    table = HydrographPoint.__table__
+    old_columns = [c['name'] for c in inspect(engine).get_columns(table.name)]
+
+    if 'id' in old_columns:
+        # Tables created before the composite key may repeat a time within a hydrograph
+        latest = 'WHERE id IN (SELECT MAX(id) FROM hydrograph_points GROUP BY hydrograph_id, time)'
+    else:
+        latest = 'WHERE 1 = 1'
+
+    with engine.begin() as connection:
+        # Park the points in a plain table, so the new table and its partitions can take the old names
+        connection.execute(
+            'CREATE TABLE hydrograph_points_copy AS SELECT hydrograph_id, time, flow FROM hydrograph_points {0} '
+            'AND hydrograph_id IS NOT NULL AND time IS NOT NULL'.format(latest))
+        connection.execute('DROP TABLE hydrograph_points')
+
+        if partitions:
+            connection.execute(str(CreateTable(table).compile(dialect=engine.dialect)).strip() +
+                               ' PARTITION BY HASH (hydrograph_id)')
+            for remainder in range(partitions):
+                connection.execute(
+                    'CREATE TABLE hydrograph_points_p{0} PARTITION OF hydrograph_points '
+                    'FOR VALUES WITH (MODULUS {1}, REMAINDER {0})'.format(remainder, partitions))
+        else:
+            table.create(bind=connection)
 
-def assign_hydrograph_to_well(well_id, hydrograph_file):
+        # Insert in key order, which also lays the rows out by hydrograph and time on disk
+        connection.execute(
+            'INSERT INTO hydrograph_points (hydrograph_id, time, flow) '
+            'SELECT hydrograph_id, time, flow FROM hydrograph_points_copy ORDER BY hydrograph_id, time')
+        connection.execute('DROP TABLE hydrograph_points_copy')
+
+        count = connection.execute(select([func.count()]).select_from(table)).scalar()
+
+    return count
+
+
+def upgrade_schema(engine):
     """
-    Parse hydrograph file and add to database, assigning to appropriate well.
+    Bring an existing database up to date: create missing tables and add columns introduced after they were created.
     """
-    # Parse file
-    hydro_points = []
+    Base.metadata.create_all(engine)
 
-    try:
-        for line in hydrograph_file:
-            line = line.decode('utf-8')
-            sline = line.split(',')
+    new_columns = (
+        ('wells', 'site_number', String()),
+        ('wells', 'cell', Integer()),
+        ('hydrographs', 'num_points', Integer()),
+        ('hydrographs', 'start_time', Integer()),
+        ('hydrographs', 'end_time', Integer()),
+        ('hydrographs', 'series', LargeBinary()),
+        ('hydrographs', 'version', Integer()),
+        ('hydrographs', 'end_flow', Float()),
+        ('ingest_jobs', 'mode', String()),
+        ('ingest_jobs', 'updated', DateTime()),
+    )
 
-            try:
-                time = int(sline[0])
-                flow = float(sline[1])
-                hydro_points.append(HydrographPoint(time=time, flow=flow))
-            except ValueError:
-                continue
+    inspector = inspect(engine)
+    existing = {}
 
-        if len(hydro_points) > 0:
-            Session = app.get_persistent_store_database('primary_db', as_sessionmaker=True)
-            session = Session()
+    with engine.begin() as connection:
+        for table, column, column_type in new_columns:
+            if table not in existing:
+                existing[table] = [c['name'] for c in inspector.get_columns(table)]
 
-            # Get well object
-            well = session.query(Well).get(int(well_id))
+            if column not in existing[table]:
+                connection.execute('ALTER TABLE {0} ADD COLUMN {1} {2}'.format(
+                    table, column, column_type.compile(dialect=engine.dialect)))
 
-            # Overwrite old hydrograph
-            hydrograph = well.hydrograph
+    # Statistics only cache each hydrograph version, drop those saved before their percentiles were named for the
+    # daily means they are taken from so they are computed again
+    if 'p10' in [c['name'] for c in inspector.get_columns('hydrograph_statistics')]:
+        HydrographStatistics.__table__.drop(engine)
+        HydrographStatistics.__table__.create(engine)
 
-            # Create new hydrograph if not assigned already
-            if not hydrograph:
-                hydrograph = Hydrograph()
-                well.hydrograph = hydrograph
+    # Replace the surrogate id of hydrograph points with the (hydrograph_id, time) key
+    if 'id' in [c['name'] for c in inspector.get_columns('hydrograph_points')]:
+        rebuild_hydrograph_points(engine)
 
-            # Remove old points if any
-            for hydro_point in hydrograph.points:
-                session.delete(hydro_point)
+    # Locate wells created before the grid index existed
+    with engine.begin() as connection:
+        connection.execute(
+            Well.__table__.update().
+            where(Well.cell.is_(None)).
+            where(Well.longitude.isnot(None)).
+            where(Well.latitude.isnot(None)).
+            values(cell=floor_int((Well.latitude + 90.0) / spatial.CELL_SIZE, engine.dialect) * spatial.COLUMNS +
+                   floor_int((Well.longitude + 180.0) / spatial.CELL_SIZE, engine.dialect))
+        )
 
-            # Assign points to hydrograph
-            hydrograph.points = hydro_points
+    # Summarize hydrographs stored as points before their summary columns existed
+    point = HydrographPoint.__table__.c
+    hydrograph = Hydrograph.__table__.c
+    with engine.begin() as connection:
+        backfilled = connection.execute(
+            Hydrograph.__table__.update().
+            where(hydrograph.num_points.is_(None)).
+            where(hydrograph.series.is_(None)).
+            values(num_points=select([func.count(point.time)]).where(point.hydrograph_id == hydrograph.id).as_scalar(),
+                   start_time=select([func.min(point.time)]).where(point.hydrograph_id == hydrograph.id).as_scalar(),
+                   end_time=select([func.max(point.time)]).where(point.hydrograph_id == hydrograph.id).as_scalar())
+        ).rowcount
 
-            # Persist to database
-            session.commit()
-            session.close()
+        connection.execute(Hydrograph.__table__.update().where(hydrograph.version.is_(None)).values(version=1))
 
-    except Exception as e:
-        # Careful not to hide error. At the very least log it to the console
-        print(e)
-        return False
+    # Latest depth of hydrographs stored as points before it was recorded; columnar ones get it from build-pyramids
+    with engine.begin() as connection:
+        connection.execute(
+            Hydrograph.__table__.update().
+            where(hydrograph.end_flow.is_(None)).
+            where(hydrograph.end_time.isnot(None)).
+            values(end_flow=select([func.max(point.flow)]).
+                   where(point.hydrograph_id == hydrograph.id).
+                   where(point.time == hydrograph.end_time).
+                   as_scalar())
+        )
+
+        # Summarize wells created before the well_summary table existed, or all of them when hydrographs were
+        # backfilled above, since their summary rows were copied from the empty columns
+        if backfilled:
+            refresh_well_summary(connection, Well.id.isnot(None))
+        else:
+            refresh_well_summary(connection, ~exists().where(WellSummary.well_id == Well.id))
+
+    # create_all skips indexes of tables that already exist. Expression indexes are never reflected, so those not
+    # listed are created only if missing
+    for table in Base.metadata.sorted_tables:
+        with warnings.catch_warnings():
+            warnings.filterwarnings('ignore', 'Skipped unsupported reflection of expression-based index')
+            index_names = [i['name'] for i in inspector.get_indexes(table.name)]
+
+        for index in table.indexes:
+            if index.name not in index_names:
+                ddl = str(CreateIndex(index).compile(dialect=engine.dialect))
+                engine.execute(ddl.replace('CREATE INDEX ', 'CREATE INDEX IF NOT EXISTS ', 1))
+
+    build_missing_pyramids(engine)
+
+
+def in_bbox(minx, miny, maxx, maxy):
+    """
+    Get a filter selecting wells inside a bounding box, narrowed with the grid cell index first.
+    """
+    cells = [WellSummary.cell.between(first, last) for first, last in spatial.cell_ranges(minx, miny, maxx, maxy)]
+
+    return and_(
+        or_(*cells),
+        WellSummary.longitude >= minx, WellSummary.longitude <= maxx,
+        WellSummary.latitude >= miny, WellSummary.latitude <= maxy,
+    )
+
+
+def get_wells_in_bbox(minx, miny, maxx, maxy, limit=None):
+    """
+    Get the wells inside a bounding box, at most limit of them.
+    """
+    session = get_session()
+
+    query = session.query(WellSummary).filter(in_bbox(minx, miny, maxx, maxy)).order_by(WellSummary.well_id)
+
+    if limit is not None:
+        query = query.limit(max(int(limit), 0))
+
+    wells = query.all()
+
+    return wells
+
+
+def import_wells(raw_rows, west_longitudes=False, batch_size=1000):
+    """
+    Validate and persist well rows from importers.iter_well_rows in batched transactions. Rows with a site number
+    already in the inventory update that well, the rest are inserted.
+    Returns a report with inserted, updated, rejected ([(row number, reason)]), seconds and rows_per_second.
+    """
+    start = time.time()
+    report = {'inserted': 0, 'updated': 0, 'rejected': []}
+
+    session = get_session()
+
+    def flush(batch):
+        # Later rows win when a site number repeats within the batch
+        by_site = {}
+        for well in batch:
+            if well['site_number']:
+                by_site[well['site_number']] = well
+        unnumbered = [well for well in batch if not well['site_number']]
+
+        existing = dict(session.query(Well.site_number, Well.id).filter(Well.site_number.in_(list(by_site))).all()) \
+            if by_site else {}
+
+        inserts = unnumbered + [well for site, well in by_site.items() if site not in existing]
+        updates = [dict(well, well_id=existing[site]) for site, well in by_site.items() if site in existing]
+
+        # Core statements skip ORM events, so set the grid cell here
+        for well in inserts + updates:
+            well['cell'] = spatial.grid_cell(well['longitude'], well['latitude'])
+
+        connection = session.connection()
+        if inserts:
+            # New ids are above the current largest one, which finds their rows for the summary
+            last_id = session.query(func.max(Well.id)).scalar() or 0
+            connection.execute(Well.__table__.insert(), inserts)
+            refresh_well_summary(connection, Well.id > last_id)
+        if updates:
+            connection.execute(
+                Well.__table__.update().where(Well.id == bindparam('well_id')),
+                [{k: v for k, v in well.items() if k != 'site_number'} for well in updates]
+            )
+            refresh_well_summary(connection, Well.id.in_([well['well_id'] for well in updates]))
+
+        bump_cache_version(session, CacheVersion.WELLS)
+        session.commit()
+        report['inserted'] += len(inserts)
+        report['updated'] += len(updates)
+
+    batch = []
+    num_rows = 0
+
+    try:
+        for row_number, raw in enumerate(raw_rows, start=1):
+            num_rows = row_number
+
+            try:
+                batch.append(normalize_well(raw, west_longitudes=west_longitudes))
+            except ValueError as e:
+                report['rejected'].append((row_number, str(e)))
+                continue
+
+            if len(batch) >= batch_size:
+                flush(batch)
+                batch = []
+
+        if batch:
+            flush(batch)
+    except Exception:
+        session.rollback()
+        raise
+
+    seconds = time.time() - start
+    report['seconds'] = seconds
+    report['rows_per_second'] = num_rows / seconds if seconds > 0 else 0.0
+    return report
+
+
+def get_wells_center():
+    """
+    Get the [longitude, latitude] average of all wells, or None if there are no wells.
+    """
+    session = get_session()
+
+    longitude, latitude = session.query(func.avg(WellSummary.longitude), func.avg(WellSummary.latitude)).one()
+
+    if longitude is None or latitude is None:
+        return None
+
+    return [float(longitude), float(latitude)]
+
+
+def get_well_tile(z, x, y):
+    """
+    Get the GeoJSON features of the wells in tile z/x/y. Below tiles.CLUSTER_MAX_ZOOM, wells sharing a cell of
+    the tile grid are merged into one cluster feature with a count property.
+    """
+    minx, miny, maxx, maxy = tiles.tile_bounds(z, x, y)
+
+    session = get_session()
+
+    # Wells on a shared tile edge belong to the tile right of or below it, those on the east or south edge of the
+    # world to the last tile column or row
+    east = WellSummary.longitude <= maxx if maxx >= 180.0 else WellSummary.longitude < maxx
+    south = WellSummary.latitude >= miny if miny <= -90.0 else WellSummary.latitude > miny
+    in_tile = (in_bbox(minx, miny, maxx, maxy), east, south)
+
+    if z >= tiles.CLUSTER_MAX_ZOOM:
+        wells = session.query(WellSummary).filter(*in_tile).all()
+        return [well.to_feature() for well in wells]
+
+    # Group wells by grid cell in the database
+    dialect = session.connection().dialect
+    cell_size = tiles.tile_size(z) / tiles.CLUSTER_GRID_SIZE
+    cell_x = floor_int((WellSummary.longitude - minx) / cell_size, dialect)
+    cell_y = floor_int((maxy - WellSummary.latitude) / cell_size, dialect)
+
+    cells = session.query(func.count(WellSummary.well_id), func.min(WellSummary.well_id),
+                          func.avg(WellSummary.longitude), func.avg(WellSummary.latitude)).\
+        filter(*in_tile).\
+        group_by(cell_x, cell_y).\
+        all()
+
+    features = []
+    single_ids = []
+
+    for count, well_id, longitude, latitude in cells:
+        if count == 1:
+            single_ids.append(well_id)
+            continue
+
+        features.append({
+            'type': 'Feature',
+            'geometry': {
+                'type': 'Point',
+                'coordinates': [float(longitude), float(latitude)],
+            },
+            'properties': {
+                'cluster': True,
+                'count': count
+            }
+        })
+
+    if single_ids:
+        wells = session.query(WellSummary).filter(WellSummary.well_id.in_(single_ids))
+        features.extend(well.to_feature() for well in wells)
+
+    return features
+
+
+def init_primary_db(engine, first_time):
+    """
+    Initializer for the primary database.
+    """
+    # Create all the tables
+    Base.metadata.create_all(engine)
+    upgrade_schema(engine)
+
+    # Add data
+    if first_time:
+        # Make session
+        Session = sessionmaker(bind=engine)
+        session = Session()
+
+        # Initialize database with two wells
+        well1 = Well(
+            latitude=40.406624,
+            longitude=-111.529133,
+            name="Deer Creek",
+            owner="Reclamation",
+            river="Provo Aquifer",
+            date_built="April 12, 1993"
+        )
+
+        well2 = Well(
+            latitude=40.598168,
+            longitude=-111.424055,
+            name="Jordanelle",
+            owner="Reclamation",
+            river="Provo Aquifer",
+            date_built="1941"
+        )
+
+        # Add the wells to the session, commit, and close
+        session.add(well1)
+        session.add(well2)
+        session.commit()
+        session.close()
+
+def replace_hydrograph(well_id, hydrograph_file, mode=Hydrograph.REPLACE):
+    """
+    Parse hydrograph file and replace the hydrograph of a well with it, or add its points to the hydrograph with
+    Hydrograph.APPEND or Hydrograph.MERGE. Errors are raised.
+    Returns ingest statistics (points, seconds, points_per_second), points counting the points written.
+    """
+    start = time.time()
+
+    # Parse file lazily, chunk by chunk, as it is written to the database
+    chunks = iter_hydrograph_chunks(hydrograph_file)
+
+    # Peek at the first chunk so files without any valid points leave the well untouched
+    first_chunk = next(chunks, None)
+    num_points = 0
+
+    if first_chunk is not None:
+        session = get_session()
+
+        try:
+            # Get well object
+            well = session.query(Well).get(int(well_id))
+
+            # Overwrite old hydrograph
+            hydrograph = well.hydrograph
+
+            # Create new hydrograph if not assigned already, which the map shows
+            if not hydrograph:
+                hydrograph = Hydrograph()
+                well.hydrograph = hydrograph
+                bump_cache_version(session, CacheVersion.WELLS)
+
+            if mode != Hydrograph.REPLACE and hydrograph.has_series():
+                # Add to the old series
+                num_points = hydrograph.merge_series(itertools.chain([first_chunk], chunks), mode)
+            else:
+                # Replace old series with the new one
+                num_points = hydrograph.load_series(itertools.chain([first_chunk], chunks))
+
+            # Persist to database
+            session.commit()
+            hydrograph_id = hydrograph.id
+        except Exception:
+            session.rollback()
+            raise
+
+        # Plots of the old series are unreachable by version, free them right away
+        get_figure_cache().invalidate(hydrograph_id)
+
+    seconds = time.time() - start
+    return {
+        'points': num_points,
+        'seconds': seconds,
+        'points_per_second': num_points / seconds if seconds > 0 else 0.0,
+    }
+
+
+def assign_hydrograph_to_well(well_id, hydrograph_file, mode=Hydrograph.REPLACE):
+    """
+    Parse hydrograph file and add to database, assigning to appropriate well.
+    Returns ingest statistics (points, seconds, points_per_second), or None on failure.
+    """
+    try:
+        return replace_hydrograph(well_id, hydrograph_file, mode)
+    except Exception as e:
+        # Careful not to hide error. At the very least log it to the console
+        print(e)
+        return None
+
+
+def get_well_ids(well_ids=(), site_numbers=()):
+    """
+    Look up wells by id and by site number in one query. Returns (ids found, {site_number: id}).
+    """
+    session = get_session()
+    well_ids = [int(well_id) for well_id in set(well_ids)]
+    site_numbers = list(set(site_numbers))
+
+    if not well_ids and not site_numbers:
+        return set(), {}
+
+    rows = session.query(Well.id, Well.site_number).\
+        filter(or_(Well.id.in_(well_ids), Well.site_number.in_(site_numbers))).all()
+
+    return set(row[0] for row in rows), {row[1]: row[0] for row in rows if row[1] in site_numbers}
+
+
+def write_telemetry(well_ids, times, flows):
+    """
+    Merge logger readings of many wells into their hydrographs, grouped by well, in one transaction. Later readings
+    win over earlier ones at the same time. Readings of wells deleted in the meantime are dropped.
+    Returns the number of points written.
+    """
+    session = get_session()
+    well_ids = np.asarray(well_ids)
+    order = np.lexsort((times, well_ids))
+    well_ids, times, flows = well_ids[order], np.asarray(times)[order], np.asarray(flows)[order]
+    bounds = np.r_[analytics.group_starts(well_ids), len(well_ids)] if len(well_ids) else []
+    written = 0
+    hydrograph_ids = []
+    created = False
+
+    wells = session.query(Well).filter(Well.id.in_(np.unique(well_ids).tolist())).all()
+    wells = {well.id: well for well in wells}
+    stored = get_stored_hydrograph_ids(session, [well.hydrograph.id for well in wells.values() if well.hydrograph])
+
+    try:
+        for first, last in zip(bounds[:-1], bounds[1:]):
+            well = wells.get(int(well_ids[first]))
+            if well is None:
+                continue
+
+            if not well.hydrograph:
+                well.hydrograph = Hydrograph()
+                created = True
+
+            chunk = (times[first:last], flows[first:last])
+            if well.hydrograph.id in stored:
+                written += well.hydrograph.merge_series([chunk], Hydrograph.MERGE)
+            else:
+                written += well.hydrograph.load_series([chunk])
+
+            hydrograph_ids.append(well.hydrograph.id)
+
+        # Merges only bump the version of their hydrograph, the map changes when a well gets its first one
+        if created:
+            bump_cache_version(session, CacheVersion.WELLS)
+
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+
+    for hydrograph_id in hydrograph_ids:
+        get_figure_cache().invalidate(hydrograph_id)
+
+    return written
+
+
+def get_wells_with_hydrographs():
+    """
+    Get the summary of all wells, with their hydrograph id, point count and last observation time, in one query.
+    The hydrograph columns are None for wells without hydrograph.
+    """
+    session = get_session()
+
+    rows = session.query(WellSummary).order_by(WellSummary.well_id).all()
+
+    return rows
+
+
+WELL_SORT_COLUMNS = {
+    'name': WellSummary.name,
+    'owner': WellSummary.owner,
+    'river': WellSummary.river,
+    'date_built': WellSummary.date_built,
+    'num_points': WellSummary.num_points,
+    'end_time': WellSummary.end_time,
+}
+
+
+def search_wells(query, search):
+    """
+    Filter a query of well summaries to those whose name, owner or aquifer starts with search, case insensitive.
+    """
+    if not search:
+        return query
+
+    escaped = search.lower().replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    pattern = '{0}%'.format(escaped)
+    return query.filter(or_(
+        func.lower(WellSummary.name).like(pattern, escape='\\'),
+        func.lower(WellSummary.owner).like(pattern, escape='\\'),
+        func.lower(WellSummary.river).like(pattern, escape='\\'),
+    ))
+
+
+def count_wells(search=''):
+    """
+    Count the well summaries, all of them and those matching search. Returns (total, filtered).
+    """
+    session = get_session()
+
+    total = session.query(func.count(WellSummary.well_id)).scalar()
+    filtered = search_wells(session.query(func.count(WellSummary.well_id)), search).scalar() if search else total
+
+    return total, filtered
+
+
+def get_wells_page(offset=0, limit=10, sort='name', descending=False, search='', after=None, before=None,
+                   counts=None):
+    """
+    Get one page of well summaries, sorted and filtered in the database.
+    Wells are ordered by the sort column, NULLs last, then by id, or the exact reverse when descending. Pages next to
+    the one shown are read from a keyset cursor, the (sort value, well id) of its last row as after or of its first
+    row as before, so that every page costs the same however deep it is. Without a cursor, offset is used.
+    The search matches the start of the name, owner or aquifer, case insensitive. counts are the (total, filtered)
+    of count_wells for the same search, counted here unless given.
+    Returns (total, filtered, rows) where rows are WellSummary objects.
+    """
+    session = get_session()
+
+    total, filtered = counts or count_wells(search)
+    query = search_wells(session.query(WellSummary), search)
+
+    column = WELL_SORT_COLUMNS.get(sort, WellSummary.name)
+
+    if after is not None:
+        rows = keyset_page(query, column, descending, after, limit)
+    elif before is not None:
+        rows = keyset_page(query, column, not descending, before, limit)[::-1]
+    elif offset > filtered // 2:
+        # Pages past the middle are nearer the end, count back from it in reverse order
+        count = max(min(limit, filtered - offset), 0)
+        rows = sorted_wells(query, column, not descending).offset(max(filtered - offset - limit, 0)).limit(count).\
+            all()[::-1] if count else []
+    else:
+        rows = sorted_wells(query, column, descending).offset(offset).limit(limit).all()
+
+    return total, filtered, rows
+
+
+def sorted_wells(query, column, descending):
+    """
+    Order a query of well summaries by a sort column, NULLs last, then by id, or the exact reverse when descending,
+    the order of the (column, well_id) indexes.
+    """
+    if descending:
+        return query.order_by(column.desc().nullsfirst(), WellSummary.well_id.desc())
+
+    return query.order_by(column.asc().nullslast(), WellSummary.well_id.asc())
+
+
+def keyset_page(query, column, descending, cursor, limit):
+    """
+    Get the limit well summaries following cursor, a (sort value, well id) pair, in the order of sorted_wells.
+    Rows with and without a sort value are read by separate range queries, since NULLs compare to nothing.
+    """
+    value, well_id = cursor
+    value = None if value is None else column.type.python_type(value)
+    later = WellSummary.well_id < int(well_id) if descending else WellSummary.well_id > int(well_id)
+    rows = []
+
+    # Non-NULL values come first ascending, last descending
+    with_values = query.filter(column.isnot(None))
+    nulls = query.filter(column.is_(None))
+
+    if value is None:
+        segments = [nulls.filter(later)] + ([with_values] if descending else [])
+    else:
+        key = tuple_(column, WellSummary.well_id)
+        following = with_values.filter(key < (value, int(well_id)) if descending else key > (value, int(well_id)))
+        segments = [following] + ([] if descending else [nulls])
+
+    for segment in segments:
+        rows += sorted_wells(segment, column, descending).limit(limit - len(rows)).all()
+        if len(rows) >= limit:
+            break
+
+    return rows
+
+
+MAX_COMPARE_WELLS = 50  #: wells overlaid on one comparison plot
+
+
+def get_comparison_wells(well_ids=None, bbox=None, river=None, limit=MAX_COMPARE_WELLS):
+    """
+    Get the summaries of the wells with a hydrograph among the given ids, inside a (minx, miny, maxx, maxy) bounding
+    box and/or in an aquifer, ordered by name, at most limit of them.
+    """
+    session = get_session()
+
+    query = session.query(WellSummary).filter(WellSummary.hydrograph_id.isnot(None))
+
+    if well_ids is not None:
+        query = query.filter(WellSummary.well_id.in_([int(well_id) for well_id in well_ids]))
+    if bbox is not None:
+        query = query.filter(in_bbox(*bbox))
+    if river:
+        query = query.filter(WellSummary.river == river)
+
+    wells = query.order_by(WellSummary.name, WellSummary.well_id).limit(limit).all()
+
+    return wells
+
+
+def get_aquifers():
+    """
+    Get the names of the aquifers of wells with a hydrograph, in order.
+    """
+    session = get_session()
+
+    rows = session.query(WellSummary.river).\
+        filter(WellSummary.hydrograph_id.isnot(None), WellSummary.river.isnot(None)).\
+        distinct().order_by(WellSummary.river).all()
+
+    return [row[0] for row in rows]
+
+
+def get_series_batch(hydrograph_ids, level=None, t0=None, t1=None):
+    """
+    Get the series of many hydrographs between t0 and t1 as {hydrograph_id: (times, flows)}, reading the mean of
+    one pyramid level, or the raw points when level is None, with one query per storage backend instead of one
+    per hydrograph.
+    """
+    session = get_session()
+    hydrograph_ids = sorted(set(int(hydrograph_id) for hydrograph_id in hydrograph_ids))
+    series = {}
+
+    if not hydrograph_ids:
+        return series
+
+    if level:
+        aggregate = HydrographAggregate.__table__.c
+        query = select([aggregate.hydrograph_id, aggregate.time, aggregate.mean_flow]).\
+            where(aggregate.hydrograph_id.in_(hydrograph_ids)).\
+            where(aggregate.level == level)
+
+        # Include the buckets that straddle the range boundaries
+        if t0 is not None:
+            query = query.where(aggregate.time > t0 - level)
+        if t1 is not None:
+            query = query.where(aggregate.time <= t1)
+
+        queries = [query.order_by(aggregate.hydrograph_id, aggregate.time)]
+    else:
+        blobs = session.query(Hydrograph.id, Hydrograph.num_points, Hydrograph.series).\
+            filter(Hydrograph.id.in_(hydrograph_ids), Hydrograph.series.isnot(None)).all()
+
+        for hydrograph_id, num_points, blob in blobs:
+            times, flows = storage.unpack_series(blob, num_points)
+            lo = 0 if t0 is None else np.searchsorted(times, t0, side='left')
+            hi = len(times) if t1 is None else np.searchsorted(times, t1, side='right')
+            series[hydrograph_id] = (times[lo:hi], flows[lo:hi])
+
+        # The rest keep one row per point
+        remaining = [hydrograph_id for hydrograph_id in hydrograph_ids if hydrograph_id not in series]
+        point = HydrographPoint.__table__.c
+        query = select([point.hydrograph_id, point.time, point.flow]).where(point.hydrograph_id.in_(remaining))
+
+        if t0 is not None:
+            query = query.where(point.time >= t0)
+        if t1 is not None:
+            query = query.where(point.time <= t1)
+
+        queries = [query.order_by(point.hydrograph_id, point.time)] if remaining else []
+
+    for query in queries:
+        data = np.array(session.connection().execute(query).fetchall(), dtype=float).reshape(-1, 3)
+        ids = data[:, 0].astype(int)
+        bounds = np.r_[analytics.group_starts(ids), len(ids)] if len(ids) else []
+
+        for first, last in zip(bounds[:-1], bounds[1:]):
+            series[int(ids[first])] = (data[first:last, 1].astype(storage.TIME_DTYPE),
+                                       data[first:last, 2].astype(storage.FLOW_DTYPE))
+
+    for hydrograph_id in hydrograph_ids:
+        series.setdefault(hydrograph_id, storage.as_series([], []))
+
+    return series
+
+
+def stream_hydrograph_points(connection, hydrograph_ids, chunk_size=100000):
+    """
+    Read the points of many hydrographs as (hydrograph_ids, times, flows) array chunks of at most chunk_size points,
+    each hydrograph's points contiguous and in time order. Per-row points are read through one server-side cursor
+    and columnar series one hydrograph at a time, so memory does not grow with the number of points exported.
+    """
+    hydrograph_ids = sorted(set(int(hydrograph_id) for hydrograph_id in hydrograph_ids))
+    hydrograph = Hydrograph.__table__.c
+    point = HydrographPoint.__table__.c
+
+    columnar = dict(connection.execute(
+        select([hydrograph.id, hydrograph.num_points]).
+        where(hydrograph.id.in_(hydrograph_ids)).
+        where(hydrograph.series.isnot(None))
+    ).fetchall()) if hydrograph_ids else {}
+
+    for hydrograph_id in sorted(columnar):
+        blob = connection.execute(select([hydrograph.series]).where(hydrograph.id == hydrograph_id)).scalar()
+        times, flows = storage.unpack_series(blob, columnar[hydrograph_id])
+
+        for start in range(0, len(times), chunk_size):
+            yield (np.full(len(times[start:start + chunk_size]), hydrograph_id),
+                   times[start:start + chunk_size], flows[start:start + chunk_size])
+
+    remaining = [hydrograph_id for hydrograph_id in hydrograph_ids if hydrograph_id not in columnar]
+    if not remaining:
+        return
+
+    result = connection.execution_options(stream_results=True).execute(
+        select([point.hydrograph_id, point.time, point.flow]).
+        where(point.hydrograph_id.in_(remaining)).
+        order_by(point.hydrograph_id, point.time)
+    )
+
+    try:
+        while True:
+            rows = result.fetchmany(chunk_size)
+            if not rows:
+                break
+
+            # Build the arrays column by column, numpy keeps memory around when given result rows directly
+            ids, times, flows = zip(*rows)
+            yield np.array(ids, dtype=int), np.array(times, dtype=storage.TIME_DTYPE), \
+                np.array(flows, dtype=storage.FLOW_DTYPE)
+    finally:
+        result.close()
+
+
+def ingest_hydrograph_folder(path, workers=None, batch_size=50, mode=Hydrograph.REPLACE):
+    """
+    Assign every per-site csv of a directory or zip archive to the well with the matching site number (or name),
+    replacing or adding to its hydrograph according to mode (see Hydrograph.MODES).
+    Files are parsed in parallel by a pool of worker processes, while this process writes them in transactions of
+    batch_size files. Returns a report with the per-file timings in files, plus total seconds and points_per_second.
+    """
+    start = time.time()
+    sources = list_hydrograph_files(path)
+    workers = workers or os.cpu_count() or 1
+    report = {'files': [], 'points': 0}
+
+    session = get_session()
+
+    # Site numbers are matched first, names second for wells entered by hand
+    well_ids = dict(session.query(Well.name, Well.id).all())
+    well_ids.update(session.query(Well.site_number, Well.id).filter(Well.site_number.isnot(None)).all())
+
+    def write(result):
+        entry = {'site': result['site'], 'points': 0, 'parse_seconds': result['parse_seconds'], 'write_seconds': 0.0,
+                 'error': result['error']}
+
+        if not entry['error'] and result['site'] not in well_ids:
+            entry['error'] = 'No well with site number {0}.'.format(result['site'])
+
+        if not entry['error'] and len(result['times']) == 0:
+            entry['error'] = 'No hydrograph points found.'
+
+        if not entry['error']:
+            write_start = time.time()
+            well = session.query(Well).get(well_ids[result['site']])
+
+            if not well.hydrograph:
+                well.hydrograph = Hydrograph()
+                bump_cache_version(session, CacheVersion.WELLS)
+
+            if mode != Hydrograph.REPLACE and well.hydrograph.has_series():
+                entry['points'] = well.hydrograph.merge_series([(result['times'], result['flows'])], mode)
+            else:
+                entry['points'] = well.hydrograph.set_series(result['times'], result['flows'])
+            entry['write_seconds'] = time.time() - write_start
+            report['points'] += entry['points']
+
+        report['files'].append(entry)
+
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            # Keep a bounded window of files in flight so parsed arrays do not pile up in memory
+            pending = set()
+            sources = iter(sources)
+            written = 0
+
+            while True:
+                for source in itertools.islice(sources, workers * 2 - len(pending)):
+                    pending.add(executor.submit(parse_hydrograph_source, source))
+
+                if not pending:
+                    break
+
+                done = next(as_completed(pending))
+                pending.remove(done)
+                write(done.result())
+                written += 1
+
+                if written % batch_size == 0:
+                    session.commit()
+
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+
+    seconds = time.time() - start
+    report['seconds'] = seconds
+    report['points_per_second'] = report['points'] / seconds if seconds > 0 else 0.0
+    return report
+
+
+def create_ingest_job(well_id, path, total_bytes, mode=Hydrograph.REPLACE):
+    """
+    Persist a new queued ingest job for a staged hydrograph upload. Returns the job id.
+    """
+    session = get_session()
+
+    job = IngestJob(well_id=int(well_id), path=path, total_bytes=total_bytes, mode=mode, status=IngestJob.QUEUED)
+    session.add(job)
+    session.commit()
+    job_id = job.id
+
+    return job_id
+
+
+def update_ingest_job(job_id, **values):
+    """
+    Update columns of an ingest job. Uses a session of its own, as progress is recorded while the ingest
+    transaction of the same thread is still open.
+    """
+    session = create_session()
+    values.setdefault('updated', datetime.datetime.utcnow())
+
+    try:
+        session.query(IngestJob).filter(IngestJob.id == job_id).update(values, synchronize_session=False)
+        session.commit()
+    finally:
+        session.close()
+
+
+def claim_ingest_job(job_id):
+    """
+    Atomically move a queued ingest job to running. Returns False if another worker claimed it first.
+    """
+    session = get_session()
+    now = datetime.datetime.utcnow()
+
+    claimed = session.query(IngestJob).\
+        filter(IngestJob.id == job_id, IngestJob.status == IngestJob.QUEUED).\
+        update({'status': IngestJob.RUNNING, 'started': now, 'updated': now, 'processed_bytes': 0},
+               synchronize_session=False)
+    session.commit()
+
+    return claimed == 1
+
+
+def requeue_stale_ingest_jobs(max_age):
+    """
+    Queue again the running ingest jobs without a progress update in max_age seconds, left behind by a worker that
+    crashed or was restarted. Returns the number of jobs requeued.
+    """
+    session = get_session()
+    cutoff = datetime.datetime.utcnow() - datetime.timedelta(seconds=max_age)
+
+    requeued = session.query(IngestJob).\
+        filter(IngestJob.status == IngestJob.RUNNING).\
+        filter(func.coalesce(IngestJob.updated, IngestJob.started) < cutoff).\
+        update({'status': IngestJob.QUEUED}, synchronize_session=False)
+    session.commit()
+
+    return requeued
+
+
+def get_ingest_job(job_id):
+    """
+    Get an ingest job as a dictionary, or None if it does not exist.
+    """
+    session = get_session()
+
+    job = session.query(IngestJob).get(int(job_id))
+    job_dict = job.to_dict() if job else None
+
+    return job_dict
+
+
+def get_queued_ingest_jobs():
+    """
+    Get (id, well_id, path, mode) of the ingest jobs waiting for a worker.
+    """
+    session = get_session()
+
+    jobs = session.query(IngestJob.id, IngestJob.well_id, IngestJob.path, IngestJob.mode).\
+        filter(IngestJob.status == IngestJob.QUEUED).\
+        order_by(IngestJob.id).\
+        all()
+
+    return jobs
 
-    return True
 
 def get_hydrograph(well_id):
     """
     Get hydrograph id from well id.
     """
-    Session = app.get_persistent_store_database('primary_db', as_sessionmaker=True)
-    session = Session()
+    session = get_session()
 
     # Query if hydrograph exists for well
     hydrograph = session.query(Hydrograph).filter_by(well_id=well_id).first()
-    session.close()
 
     if hydrograph:
         return hydrograph.id
     else:
         return None
 
+
+def get_well_hydrograph_version(well_id):
+    """
+    Get the (hydrograph_id, version) of the hydrograph of a well in one query, or None if it has none.
+    """
+    session = get_session()
+
+    row = session.query(Hydrograph.id, Hydrograph.version).filter(Hydrograph.well_id == int(well_id)).first()
+
+    if row:
+        return row[0], row[1] or 0
+    else:
+        return None
+
+
+def get_hydrograph_well_id(hydrograph_id):
+    """
+    Get well id from hydrograph id.
+    """
+    session = get_session()
+
+    hydrograph = session.query(Hydrograph).get(int(hydrograph_id))
+
+    if hydrograph:
+        return hydrograph.well_id
+    else:
+        return None
+
+
+def compute_hydrograph_statistics(session, versions, batch_size=500):
+    """
+    Compute and store the statistics of hydrographs given as {hydrograph_id: version}, reading their daily
+    aggregates in bulk, batch_size hydrographs per query.
+    """
+    hydrograph_ids = sorted(versions)
+    aggregate = HydrographAggregate.__table__.c
+
+    for i in range(0, len(hydrograph_ids), batch_size):
+        batch = hydrograph_ids[i:i + batch_size]
+
+        rows = session.connection().execute(
+            HydrographAggregate.__table__.select().
+            with_only_columns([aggregate.hydrograph_id, aggregate.time, aggregate.count, aggregate.min_flow,
+                               aggregate.mean_flow, aggregate.max_flow]).
+            where(aggregate.hydrograph_id.in_(batch)).
+            where(aggregate.level == pyramid.LEVELS[0]).
+            order_by(aggregate.hydrograph_id, aggregate.time)
+        ).fetchall()
+
+        data = np.array(rows, dtype=float).reshape(-1, 6)
+        statistics = analytics.compute_statistics(data[:, 0].astype(int), data[:, 1], data[:, 2], data[:, 3],
+                                                  data[:, 4], data[:, 5])
+
+        # Hydrographs without points still get a row, so they are not recomputed on every request
+        session.query(HydrographStatistics).\
+            filter(HydrographStatistics.hydrograph_id.in_(batch)).\
+            delete(synchronize_session=False)
+        session.connection().execute(HydrographStatistics.__table__.insert(), [
+            dict(statistics.get(hydrograph_id, {'count': 0}), hydrograph_id=hydrograph_id,
+                 version=versions[hydrograph_id])
+            for hydrograph_id in batch
+        ])
+
+    session.commit()
+
+
+def get_hydrograph_statistics(well_ids=None):
+    """
+    Get the statistics of the hydrographs of some wells, or of all wells, as {well_id: dict} with hydrograph_id and
+    analytics.METRICS. Statistics missing or computed from an older version of a hydrograph are recomputed first.
+    """
+    session = get_session()
+
+    query = session.query(Hydrograph.id, Hydrograph.well_id, Hydrograph.version, HydrographStatistics.version).\
+        outerjoin(HydrographStatistics, HydrographStatistics.hydrograph_id == Hydrograph.id)
+
+    if well_ids is not None:
+        if not well_ids:
+            return {}
+        query = query.filter(Hydrograph.well_id.in_([int(well_id) for well_id in well_ids]))
+
+    rows = query.all()
+    stale = {hydrograph_id: version or 0 for hydrograph_id, well_id, version, computed in rows
+             if computed is None or computed != (version or 0)}
+
+    if stale:
+        compute_hydrograph_statistics(session, stale)
+
+    wells = {hydrograph_id: well_id for hydrograph_id, well_id, version, computed in rows}
+    statistics = {}
+
+    query = session.query(HydrographStatistics)
+    if well_ids is not None:
+        query = query.filter(HydrographStatistics.hydrograph_id.in_(list(wells)))
+
+    for hydrograph_statistics in query:
+        if hydrograph_statistics.hydrograph_id in wells:
+            statistics[wells[hydrograph_statistics.hydrograph_id]] = dict(
+                hydrograph_statistics.to_dict(), hydrograph_id=hydrograph_statistics.hydrograph_id)
+
+    return statistics
+
+
+def get_hydrograph_version(hydrograph_id):
+    """
+    Get the content version of a hydrograph, or None if it does not exist.
+    """
+    session = get_session()
+
+    version = session.query(Hydrograph.version).filter(Hydrograph.id == int(hydrograph_id)).scalar()
+
+    return version
+
+
+def migrate_hydrograph_storage(engine, backend=storage.COLUMNAR):
+    """
+    Convert every stored hydrograph to the given storage backend. Returns the number of hydrographs converted.
+    """
+    upgrade_schema(engine)
+
+    Session = sessionmaker(bind=engine)
+    session = Session()
+    converted = 0
+
+    for hydrograph_id, in session.query(Hydrograph.id).all():
+        hydrograph = session.query(Hydrograph).get(hydrograph_id)
+        in_columnar = hydrograph.series is not None
+
+        if in_columnar == (backend == storage.COLUMNAR):
+            continue
+
+        times, flows = hydrograph.get_series()
+        hydrograph.set_series(times.copy(), flows.copy(), backend=backend)
+
+        # Commit per hydrograph so memory stays bounded by the largest series
+        session.commit()
+        session.expunge_all()
+        converted += 1
+
+    session.close()
+    return converted
+
+
+def build_missing_pyramids(engine):
+    """
+    Build the aggregate pyramid of hydrographs with points but no aggregates, such as those saved before pyramids
+    existed, so that their plots read aggregates instead of every point. Returns the number of hydrographs built.
+    """
+    Session = sessionmaker(bind=engine)
+    session = Session()
+    built = 0
+
+    missing = session.query(Hydrograph.id).\
+        filter(Hydrograph.num_points > 0).\
+        filter(~exists().where(HydrographAggregate.hydrograph_id == Hydrograph.id)).\
+        all()
+
+    for hydrograph_id, in missing:
+        hydrograph = session.query(Hydrograph).get(hydrograph_id)
+        hydrograph.rebuild_pyramid()
+        session.commit()
+        session.expunge_all()
+        built += 1
+
+    session.close()
+    return built
+
+
+def rebuild_hydrograph_pyramids(engine):
+    """
+    Recompute the aggregate pyramid of every hydrograph. Returns the number of hydrographs rebuilt.
+    """
+    upgrade_schema(engine)
+
+    Session = sessionmaker(bind=engine)
+    session = Session()
+    rebuilt = 0
+
+    for hydrograph_id, in session.query(Hydrograph.id).all():
+        hydrograph = session.query(Hydrograph).get(hydrograph_id)
+        hydrograph.rebuild_pyramid()
+        session.commit()
+        session.expunge_all()
+        rebuilt += 1
+
+    session.close()
+    return rebuilt
@@ -0,0 +1,41 @@
+// Refetch only the visible window of a hydrograph plot when the user zooms.
+var HYDROGRAPH_PLOT = (function() {
+    function attach(container) {
+        var url = $(container).data('url');
+        var plot = $(container).find('.js-plotly-plot').get(0);
+
+        if (!url || !plot || plot.dataset.zoomAttached) {
+            return;
+        }
+        plot.dataset.zoomAttached = true;
+
+        plot.on('plotly_relayout', function(e) {
+            var params = {'width': Math.round($(plot).width())};
+
+            if (e['xaxis.range[0]'] !== undefined) {
+                params.t0 = Math.floor(e['xaxis.range[0]']);
+                params.t1 = Math.ceil(e['xaxis.range[1]']);
+            } else if (e['xaxis.range'] !== undefined) {
+                params.t0 = Math.floor(e['xaxis.range'][0]);
+                params.t1 = Math.ceil(e['xaxis.range'][1]);
+            } else if (!e['xaxis.autorange']) {
+                // Not a zoom on the time axis
+                return;
+            }
+
+            $.getJSON(url, params, function(data) {
+                Plotly.restyle(plot, {'x': [data.time], 'y': [data.flow], 'name': data.name}, [0]);
+            });
+        });
+    }
+
+    $(function() {
+        $('.hydrograph-plot').each(function() {
+            attach(this);
+        });
+    });
+
+    return {
+        attach: attach
+    };
+}());
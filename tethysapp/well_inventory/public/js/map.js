@@ -13,6 +13,150 @@ $(function() {
     // Add the popup overlay to the map
     map.addOverlay(popup);
 
+    // Style single wells as before and clusters with their well count
+    var well_style = new ol.style.Style({
+        image: new ol.style.Circle({
+            radius: 10,
+            fill: new ol.style.Fill({color: '#d84e1f'}),
+            stroke: new ol.style.Stroke({color: '#ffffff', width: 1})
+        })
+    });
+
+    var wells_style = function(feature) {
+        var count = feature.get('count');
+
+        if (!count || count < 2) {
+            return well_style;
+        }
+
+        return new ol.style.Style({
+            image: new ol.style.Circle({
+                radius: 10 + Math.min(Math.log(count) / Math.LN10 * 5, 15),
+                fill: new ol.style.Fill({color: '#d84e1f'}),
+                stroke: new ol.style.Stroke({color: '#ffffff', width: 2})
+            }),
+            text: new ol.style.Text({
+                text: String(count),
+                fill: new ol.style.Fill({color: '#ffffff'})
+            })
+        });
+    };
+
+    // Load wells tile by tile from the server, using the same square-degree grid as tiles.py
+    var wells_tile_grid = ol.tilegrid.createXYZ({extent: [-180, -90, 180, 90], maxZoom: 18});
+    var wells_format = new ol.format.GeoJSON();
+    var wells_source = new ol.source.Vector({
+        strategy: ol.loadingstrategy.tile(wells_tile_grid),
+        loader: function(extent, resolution, projection) {
+            var size = extent[2] - extent[0];
+            var z = Math.round(Math.log(360 / size) / Math.LN2);
+            var x = Math.round((extent[0] + 180) / size);
+            var y = Math.round((90 - extent[3]) / size);
+
+            $.getJSON('/apps/well-inventory/wells/tiles/' + z + '/' + x + '/' + y + '/', function(data) {
+                wells_source.addFeatures(wells_format.readFeatures(data, {featureProjection: projection}));
+            });
+        }
+    });
+
+    map.getLayers().forEach(function(layer) {
+        if (layer.tethys_legend_title === 'Wells') {
+            layer.setSource(wells_source);
+            layer.setStyle(wells_style);
+        }
+    });
+
+    // Clusters differ per zoom level, so start over whenever the tile zoom changes
+    var wells_tile_z = wells_tile_grid.getZForResolution(map.getView().getResolution());
+
+    map.getView().on('change:resolution', function() {
+        var z = wells_tile_grid.getZForResolution(map.getView().getResolution());
+
+        if (z !== wells_tile_z) {
+            wells_tile_z = z;
+            wells_source.clear();
+        }
+    });
+
+    // Compare the wells inside the current view
+    $('#compare-wells-button').on('click', function(e) {
+        var extent = ol.proj.transformExtent(map.getView().calculateExtent(map.getSize()),
+                                             map.getView().getProjection(), 'EPSG:4326');
+
+        e.preventDefault();
+        window.location.href = $(this).attr('href') + '?bbox=' + extent.map(function(v) {
+            return v.toFixed(5);
+        }).join(',');
+    });
+
+    // Popup hydrographs are fetched as compact JSON once per well and kept for the rest of the visit
+    var hydrograph_cache = {};
+
+    var decode_array = function(encoded, ArrayType) {
+        var binary = atob(encoded);
+        var bytes = new Uint8Array(binary.length);
+
+        for (var i = 0; i < binary.length; i++) {
+            bytes[i] = binary.charCodeAt(i);
+        }
+
+        return new ArrayType(bytes.buffer);
+    };
+
+    var fetch_hydrograph = function(well_id) {
+        if (!hydrograph_cache[well_id]) {
+            hydrograph_cache[well_id] = $.getJSON('/apps/well-inventory/hydrographs/' + well_id + '/popup/').then(
+                function(data) {
+                    data.time = decode_array(data.time, Int32Array);
+                    data.flow = decode_array(data.flow, Float32Array);
+                    return data;
+                },
+                function(xhr, status, error) {
+                    // Do not cache failures, the next hover or click tries again. Stay rejected so done handlers
+                    // never see the failure as data
+                    delete hydrograph_cache[well_id];
+                    return $.Deferred().reject(xhr, status, error);
+                }
+            );
+        }
+
+        return hydrograph_cache[well_id];
+    };
+
+    var draw_hydrograph = function(container, data) {
+        var plot = $('<div>').appendTo($(container).empty()).get(0);
+
+        Plotly.newPlot(plot, [{
+            x: data.time,
+            y: data.flow,
+            name: data.name,
+            mode: 'lines',
+            line: {color: '#0080ff', width: 2}
+        }], {
+            height: 250,
+            margin: {l: 50, r: 10, t: 10, b: 40},
+            xaxis: {title: 'Time (hr)'},
+            yaxis: {title: 'Depth to GW (ft)'}
+        }, {displaylogo: false});
+
+        // Zooming refetches the visible window at full detail
+        HYDROGRAPH_PLOT.attach(container);
+    };
+
+    // Prefetch the hydrograph of a well as soon as the pointer rests on it
+    map.on('pointermove', function(e) {
+        if (e.dragging) {
+            return;
+        }
+
+        map.forEachFeatureAtPixel(e.pixel, function(feature) {
+            if (!feature.get('cluster') && feature.get('has_hydrograph')) {
+                fetch_hydrograph(feature.get('id'));
+            }
+            return true;
+        });
+    });
+
     // When selected, call function to display properties
     select_interaction.getFeatures().on('change:length', function(e)
     {
@@ -26,6 +170,15 @@ $(function() {
             // Get coordinates of the point to set position of the popup
             var coordinates = selected_feature.getGeometry().getCoordinates();
 
+            // Zoom into clusters instead of showing a popup
+            if (selected_feature.get('cluster')) {
+                $(popup_element).popover('destroy');
+                e.target.clear();
+                map.getView().animate({center: coordinates, zoom: map.getView().getZoom() + 2});
+                return;
+            }
+
+            var well_id = selected_feature.get('id');
             var popup_content = '<div class="well-popup">' + '<h6>Well Number:</h6>' +
                                     '<h5>' + selected_feature.get('name') + '</h5>' +
                                     '<h6>Owner:</h6>' +
@@ -34,29 +187,34 @@ $(function() {
                                     '<span>' + selected_feature.get('river') + '</span>' +
                                     '<h6>Date Built:</h6>' +
                                     '<span>' + selected_feature.get('date_built') + '</span>' +
-                                    '<div id="plot-content"></div>' +
+                                    '<div id="plot-content" class="hydrograph-plot" data-url="' +
+                                        '/apps/well-inventory/hydrographs/' + well_id + '/data/"></div>' +
                                 '</div>';
 
-            // Clean up last popup and reinitialize
+            // Without animation the previous popover is gone as soon as destroy returns
             $(popup_element).popover('destroy');
+            popup.setPosition(coordinates);
 
-            // Delay arbitrarily to wait for previous popover to
-            // be deleted before showing new popover.
-            setTimeout(function() {
-                popup.setPosition(coordinates);
+            $(popup_element).popover({
+              'placement': 'top',
+              'animation': false,
+              'html': true,
+              'content': popup_content
+            });
 
-                $(popup_element).popover({
-                  'placement': 'top',
-                  'animation': true,
-                  'html': true,
-                  'content': popup_content
-                });
+            $(popup_element).popover('show');
 
-                $(popup_element).popover('show');
+            // Draw the hydrograph from the browser cache, fetching it if the hover did not already
+            if (selected_feature.get('has_hydrograph') !== false) {
+                fetch_hydrograph(well_id).done(function(data) {
+                    var container = $('#plot-content');
 
-                // Load hydrograph dynamically
-                $('#plot-content').load('/apps/well-inventory/hydrographs/' + selected_feature.get('id') + '/ajax/');
-            }, 500);
+                    // Skip if another well was selected in the meantime
+                    if (container.length && container.data('url').indexOf('/' + data.well_id + '/') !== -1) {
+                        draw_hydrograph(container.get(0), data);
+                    }
+                });
+            }
         } else {
             // remove pop up when selecting nothing on the map
             $(popup_element).popover('destroy');
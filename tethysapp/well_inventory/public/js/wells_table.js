@@ -0,0 +1,32 @@
+// Page the wells table by keyset: the next and previous pages are requested after the last or before the first
+// row of the page shown, so that deep pages cost no more than the first one. Other jumps fall back to offsets.
+(function() {
+    var page = null;  // cursor of the page shown, with the paging state it was read with
+
+    function paging_state(data) {
+        return JSON.stringify([data.order, data.search.value, data.length]);
+    }
+
+    $(document).on('preXhr.dt', function(e, settings, data) {
+        if (!page || page.state !== paging_state(data)) {
+            return;
+        }
+
+        if (data.start === page.start + data.length && page.last) {
+            data.after = JSON.stringify(page.last);
+        } else if (data.start === page.start - data.length && data.start > 0 && page.first) {
+            data.before = JSON.stringify(page.first);
+        }
+    });
+
+    $(document).on('xhr.dt', function(e, settings, json) {
+        var data = settings.oAjaxData;
+
+        if (!json || !json.cursor || !data) {
+            page = null;
+            return;
+        }
+
+        page = $.extend({'state': paging_state(data)}, json.cursor);
+    });
+}());
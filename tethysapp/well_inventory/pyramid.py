@@ -0,0 +1,110 @@
+from functools import reduce
+from math import gcd
+
+import numpy as np
+
+LEVELS = (24, 168, 720)  #: hours per bucket: daily, weekly and 30-day aggregates
+LEVEL_NAMES = {24: 'Daily', 168: 'Weekly', 720: '30-Day'}
+
+
+def _group(buckets, counts, sums, mins, maxs):
+    """
+    Combine partial aggregates that share a bucket.
+    """
+    order = np.argsort(buckets, kind='mergesort')
+    buckets = buckets[order]
+    starts = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+
+    return (
+        buckets[starts],
+        np.add.reduceat(counts[order], starts),
+        np.add.reduceat(sums[order], starts),
+        np.minimum.reduceat(mins[order], starts),
+        np.maximum.reduceat(maxs[order], starts),
+    )
+
+
+class PyramidBuilder(object):
+    """
+    Accumulates (times, flows) chunks into min/mean/max aggregates for each pyramid level.
+    Memory is bounded by the number of buckets at the finest level, not the number of points.
+    """
+
+    def __init__(self, levels=LEVELS):
+        self.levels = tuple(sorted(levels))
+        self.partials = None  #: (buckets, counts, sums, mins, maxs) at the finest level
+        self.start_time = None
+        self.end_time = None
+        self.end_flow = None  #: flow at end_time
+
+    def add(self, times, flows):
+        """
+        Fold a chunk of points into the pyramid.
+        """
+        if len(times) == 0:
+            return
+
+        times = np.asarray(times, dtype=np.int64)
+        flows = np.asarray(flows, dtype=np.float64)
+
+        chunk_start, chunk_end = int(times.min()), int(times.max())
+
+        # Keep the flow of the latest point seen so far
+        if self.end_time is None or chunk_end >= self.end_time:
+            self.end_flow = float(flows[np.argmax(times)])
+
+        self.start_time = chunk_start if self.start_time is None else min(self.start_time, chunk_start)
+        self.end_time = chunk_end if self.end_time is None else max(self.end_time, chunk_end)
+
+        chunk = _group(times // self.levels[0], np.ones(len(times), dtype=np.int64), flows, flows, flows)
+
+        if self.partials is not None:
+            chunk = _group(*[np.concatenate((old, new)) for old, new in zip(self.partials, chunk)])
+
+        self.partials = chunk
+
+    def build(self):
+        """
+        Get {level: (times, counts, mins, means, maxs)}, where times are the bucket start in hours.
+        """
+        levels = {}
+
+        if self.partials is None:
+            return levels
+
+        finest = self.levels[0]
+        buckets, counts, sums, mins, maxs = self.partials
+
+        # Every level is derived from the finest one, which nests evenly in all of them
+        for level in self.levels:
+            if level == finest:
+                grouped = self.partials
+            else:
+                grouped = _group(buckets * finest // level, counts, sums, mins, maxs)
+
+            level_buckets, level_counts, level_sums, level_mins, level_maxs = grouped
+            levels[level] = (level_buckets * level, level_counts, level_mins, level_sums / level_counts, level_maxs)
+
+        return levels
+
+
+def select_level(num_points, span, max_points, levels=LEVELS):
+    """
+    Pick the coarsest level that still has max_points buckets over span hours, or None when raw points are needed.
+    """
+    if not max_points or num_points <= max_points:
+        return None
+
+    for level in sorted(levels, reverse=True):
+        if span / float(level) >= max_points:
+            return level
+
+    return None
+
+
+def aligned_range(t0, t1, levels=LEVELS):
+    """
+    Widen the range t0 to t1 (inclusive) to whole buckets of every level. Returns (start, end), end exclusive.
+    """
+    step = reduce(lambda a, b: a * b // gcd(a, b), levels)
+    return t0 // step * step, (t1 // step + 1) * step
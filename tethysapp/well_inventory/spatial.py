@@ -0,0 +1,41 @@
+"""
+Grid spatial index for wells. Each well stores the id of the CELL_SIZE degree grid cell it falls in, and
+bounding box queries become a few B-tree range scans over that id before the exact coordinate filter.
+"""
+CELL_SIZE = 0.25  #: degrees
+COLUMNS = int(360 / CELL_SIZE) + 1  #: cells per row, one extra so longitude 180 does not wrap to the next row
+MAX_RANGES = 64  #: above this many cell rows, scan one range covering all of them
+
+
+def grid_row(latitude):
+    return int((latitude + 90.0) // CELL_SIZE)
+
+
+def grid_column(longitude):
+    return int((longitude + 180.0) // CELL_SIZE)
+
+
+def grid_cell(longitude, latitude):
+    """
+    Get the grid cell id of a location, or None if the location is incomplete.
+    """
+    if longitude is None or latitude is None:
+        return None
+
+    return grid_row(latitude) * COLUMNS + grid_column(longitude)
+
+
+def cell_ranges(minx, miny, maxx, maxy):
+    """
+    Get the (first, last) cell id ranges covering a bounding box, one per grid row.
+    """
+    if minx > maxx or miny > maxy:
+        raise ValueError('Bounding box minimums must not exceed its maximums.')
+
+    first_row, last_row = grid_row(max(miny, -90.0)), grid_row(min(maxy, 90.0))
+    first_column, last_column = grid_column(max(minx, -180.0)), grid_column(min(maxx, 180.0))
+
+    if last_row - first_row + 1 > MAX_RANGES:
+        return [(first_row * COLUMNS + first_column, last_row * COLUMNS + last_column)]
+
+    return [(row * COLUMNS + first_column, row * COLUMNS + last_column) for row in range(first_row, last_row + 1)]
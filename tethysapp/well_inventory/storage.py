@@ -0,0 +1,66 @@
+import zlib
+import numpy as np
+
+# Hydrograph storage backends
+POINTS = 'points'  #: one hydrograph_points row per sample
+COLUMNAR = 'columnar'  #: one compressed blob of packed arrays per hydrograph
+BACKENDS = (POINTS, COLUMNAR)
+
+TIME_DTYPE = np.dtype('<i4')  #: hours
+FLOW_DTYPE = np.dtype('<f8')  #: ft
+
+
+def as_series(times, flows):
+    """
+    Coerce time and flow sequences to the packed dtypes, sorted by time.
+    """
+    times = np.asarray(times, dtype=TIME_DTYPE)
+    flows = np.asarray(flows, dtype=FLOW_DTYPE)
+
+    if times.shape != flows.shape:
+        raise ValueError('Time and flow arrays must be the same length.')
+
+    # Most files are already in order, so only pay for the sort when needed
+    if times.size > 1 and np.any(times[1:] < times[:-1]):
+        order = np.argsort(times, kind='mergesort')
+        times = times[order]
+        flows = flows[order]
+
+    return times, flows
+
+
+def unique_series(times, flows):
+    """
+    Coerce a series like as_series and keep only the last flow given for each time, as the points table holds one
+    row per hydrograph and time.
+    """
+    times, flows = as_series(times, flows)
+
+    # The sort in as_series is stable, so the last of equal times is the last one given
+    if times.size > 1 and np.any(times[1:] == times[:-1]):
+        keep = np.r_[times[1:] != times[:-1], True]
+        times = times[keep]
+        flows = flows[keep]
+
+    return times, flows
+
+
+def pack_series(times, flows):
+    """
+    Pack a series into a single compressed buffer: all times followed by all flows.
+    """
+    times, flows = as_series(times, flows)
+    return zlib.compress(times.tobytes() + flows.tobytes())
+
+
+def unpack_series(blob, num_points):
+    """
+    Decode a buffer written by pack_series into (times, flows) arrays.
+    """
+    if not blob or not num_points:
+        return np.empty(0, dtype=TIME_DTYPE), np.empty(0, dtype=FLOW_DTYPE)
+
+    raw = zlib.decompress(blob)
+    times = np.frombuffer(raw, dtype=TIME_DTYPE, count=num_points)
+    flows = np.frombuffer(raw, dtype=FLOW_DTYPE, count=num_points, offset=num_points * TIME_DTYPE.itemsize)
+    return times, flows
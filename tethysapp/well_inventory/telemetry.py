@@ -0,0 +1,292 @@
+"""
+Real-time ingest of logger readings. Loggers POST batches of readings for any number of wells to the telemetry API,
+as JSON lines or packed binary records. Readings are held in a per-process buffer and written by a background thread
+in grouped bulk writes (see model.write_telemetry) once flush_size readings are waiting or every flush_seconds.
+The buffer is bounded: when it is full, requests are refused with a retry delay instead of queueing without limit,
+and readings stay counted against it until they are written, so a slow or unavailable database pushes back on clients.
+"""
+import json
+import time
+import logging
+import threading
+
+import numpy as np
+
+from .app import WellInventory as app
+from . import storage
+from .db import remove_session
+from .model import get_well_ids, write_telemetry
+
+JSON_LINES = 'application/x-ndjson'
+BINARY = 'application/octet-stream'
+CONTENT_TYPES = (JSON_LINES, BINARY)
+
+#: Packed binary reading, little-endian: well id, time (hours) and depth to groundwater (ft)
+READING_DTYPE = np.dtype([('well_id', '<i4'), ('time', '<i4'), ('depth', '<f8')])
+
+MAX_READINGS_PER_REQUEST = 100000
+DEFAULT_BUFFER_SIZE = 200000
+DEFAULT_FLUSH_SIZE = 10000
+DEFAULT_FLUSH_SECONDS = 2.0
+MAX_WRITE_ATTEMPTS = 5  #: failed writes of a request's readings before they are dropped
+
+log = logging.getLogger('tethysapp.well_inventory.telemetry')
+
+_buffer = None
+_buffer_lock = threading.Lock()
+
+
+class BufferFull(Exception):
+    """
+    Raised when the buffer cannot take a batch of readings. retry_after is a suggested delay in seconds.
+    """
+
+    def __init__(self, retry_after):
+        super(BufferFull, self).__init__('Telemetry buffer is full, retry in {0} s.'.format(retry_after))
+        self.retry_after = retry_after
+
+
+def parse_json_lines(body):
+    """
+    Parse JSON lines of readings, each {"well_id": 1, "time": 8760, "depth": 12.5} or with "site" (the well site
+    number) instead of "well_id". A line may batch the readings of one well as lists: "time": [...], "depth": [...].
+    Returns (well_ids, site_numbers, times, depths) lists, with None for the key a line does not use.
+    """
+    well_ids, site_numbers, times, depths = [], [], [], []
+
+    for line_number, line in enumerate(body.splitlines(), start=1):
+        if not line.strip():
+            continue
+
+        try:
+            record = json.loads(line)
+            line_times = np.atleast_1d(np.asarray(record['time'], dtype=float))
+            line_depths = np.atleast_1d(np.asarray(record['depth'], dtype=float))
+        except (ValueError, KeyError, TypeError) as e:
+            raise ValueError('Line {0}: {1}'.format(line_number, e))
+
+        if line_times.shape != line_depths.shape or line_times.ndim != 1:
+            raise ValueError('Line {0}: time and depth must have the same length.'.format(line_number))
+
+        well_id, site_number = record.get('well_id'), record.get('site')
+        if well_id is None and site_number is None:
+            raise ValueError('Line {0}: a well_id or site is required.'.format(line_number))
+
+        well_ids.extend([well_id] * len(line_times))
+        site_numbers.extend([None if well_id is not None else str(site_number)] * len(line_times))
+        times.append(line_times)
+        depths.append(line_depths)
+
+    times = np.concatenate(times) if times else np.empty(0)
+    depths = np.concatenate(depths) if depths else np.empty(0)
+    return well_ids, site_numbers, times, depths
+
+
+def parse_binary(body):
+    """
+    Parse packed READING_DTYPE records. Returns (well_ids, site_numbers, times, depths) like parse_json_lines.
+    """
+    if len(body) % READING_DTYPE.itemsize:
+        raise ValueError('Binary readings must be whole {0} byte records.'.format(READING_DTYPE.itemsize))
+
+    records = np.frombuffer(body, dtype=READING_DTYPE)
+    return records['well_id'], [None] * len(records), records['time'].astype(float), records['depth']
+
+
+def parse_readings(body, content_type):
+    """
+    Parse a request body of readings and resolve their wells. Returns (well_ids, times, depths) arrays, raising
+    ValueError for malformed readings or unknown wells.
+    """
+    if content_type == BINARY:
+        well_ids, site_numbers, times, depths = parse_binary(body)
+    elif content_type in (JSON_LINES, 'application/json', 'text/plain'):
+        well_ids, site_numbers, times, depths = parse_json_lines(body.decode('utf-8'))
+    else:
+        raise ValueError('Send readings as {0}.'.format(' or '.join(CONTENT_TYPES)))
+
+    if len(times) > MAX_READINGS_PER_REQUEST:
+        raise ValueError('At most {0} readings per request.'.format(MAX_READINGS_PER_REQUEST))
+
+    # Times are whole hours, as in hydrograph files, within the range storage keeps
+    limits = np.iinfo(storage.TIME_DTYPE)
+    if not np.all(np.isfinite(depths)) or not np.all(times == np.floor(times)):
+        raise ValueError('Times must be whole hours and depths finite numbers.')
+    if not np.all((times >= limits.min) & (times <= limits.max)):
+        raise ValueError('Times must be between {0} and {1} hours.'.format(limits.min, limits.max))
+
+    ids = set(int(well_id) for well_id in well_ids if well_id is not None)
+    sites = set(site for site in site_numbers if site is not None)
+    found, site_ids = get_well_ids(ids, sites)
+
+    unknown = sorted(ids - found) + sorted(sites - set(site_ids))
+    if unknown:
+        raise ValueError('Unknown wells: {0}.'.format(', '.join(str(well) for well in unknown[:20])))
+
+    if sites:
+        well_ids = [site_ids[site] if well_id is None else well_id for well_id, site in zip(well_ids, site_numbers)]
+
+    return np.asarray(well_ids, dtype=np.int64), times.astype(np.int64), np.asarray(depths, dtype=float)
+
+
+class TelemetryBuffer(object):
+    """
+    Bounded in-memory buffer of readings, written to the database by a background thread. add() is called from
+    request threads; write is called with (well_ids, times, depths) arrays of everything waiting. Each request's
+    readings are kept as one chunk, retried on its own after a failed write and dropped after max_attempts failures.
+    """
+
+    def __init__(self, capacity=DEFAULT_BUFFER_SIZE, flush_size=DEFAULT_FLUSH_SIZE,
+                 flush_seconds=DEFAULT_FLUSH_SECONDS, write=write_telemetry, max_attempts=MAX_WRITE_ATTEMPTS):
+        self.capacity = int(capacity)
+        self.flush_size = max(min(int(flush_size), self.capacity), 1)
+        self.flush_seconds = float(flush_seconds)
+        self.write = write
+        self.max_attempts = max(int(max_attempts), 1)
+
+        self._condition = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._chunks = []
+        self._waiting = 0  # readings in _chunks
+        self._pending = 0  # readings not yet written, including those being flushed
+        self._thread = None
+
+        self.accepted = 0
+        self.rejected = 0
+        self.flushed = 0
+        self.failed = 0
+        self.dropped = 0
+
+    @property
+    def pending(self):
+        return self._pending
+
+    def add(self, well_ids, times, depths):
+        """
+        Queue readings, raising BufferFull if they do not fit. Returns the number of readings pending.
+        """
+        count = len(times)
+
+        with self._condition:
+            if self._pending + count > self.capacity:
+                self.rejected += count
+                raise BufferFull(retry_after=max(int(np.ceil(self.flush_seconds)), 1))
+
+            self._chunks.append((well_ids, times, depths, 0))
+            self._waiting += count
+            self._pending += count
+            self.accepted += count
+
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='telemetry-flush')
+                self._thread.daemon = True
+                self._thread.start()
+
+            if self._waiting >= self.flush_size:
+                self._condition.notify()
+
+            return self._pending
+
+    def _run(self):
+        while True:
+            with self._condition:
+                deadline = time.time() + self.flush_seconds
+                while self._waiting < self.flush_size:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        break
+                    self._condition.wait(remaining)
+
+            # Give the database a moment before retrying a failed write
+            if not self.flush():
+                time.sleep(self.flush_seconds)
+
+    def flush(self):
+        """
+        Write everything waiting, in the calling thread: in one grouped write, or chunk by chunk when retrying after
+        a failure so that readings that cannot be written only hold up themselves. Failed readings go back to the
+        front of the buffer and stay pending, so that a database outage fills the buffer and turns into backpressure
+        on clients, until they have failed max_attempts times and are dropped. Returns True unless a write failed.
+        """
+        # Take and write under one lock so concurrent flushes cannot reorder readings of the same well and time
+        with self._flush_lock:
+            with self._condition:
+                chunks, self._chunks, self._waiting = self._chunks, [], 0
+
+            if any(chunk[3] for chunk in chunks):
+                groups = [[chunk] for chunk in chunks]
+            else:
+                groups = [chunks] if chunks else []
+
+            for index, group in enumerate(groups):
+                count = sum(len(chunk[1]) for chunk in group)
+
+                try:
+                    self.write(np.concatenate([chunk[0] for chunk in group]),
+                               np.concatenate([chunk[1] for chunk in group]),
+                               np.concatenate([chunk[2] for chunk in group]))
+                except Exception:
+                    log.exception('Failed to write %s telemetry readings.', count)
+                    self._requeue(group, [chunk for rest in groups[index + 1:] for chunk in rest])
+                    return False
+                finally:
+                    remove_session()
+
+                with self._condition:
+                    self._pending -= count
+                    self.flushed += count
+
+        return True
+
+    def _requeue(self, failed, unwritten):
+        """
+        Put the chunks of a failed write, less those out of attempts, and the chunks not tried yet back at the front
+        of the buffer.
+        """
+        retry = []
+        dropped = 0
+
+        for well_ids, times, depths, attempts in failed:
+            if attempts + 1 >= self.max_attempts:
+                dropped += len(times)
+            else:
+                retry.append((well_ids, times, depths, attempts + 1))
+
+        if dropped:
+            log.error('Dropped %s telemetry readings after %s failed writes.', dropped, self.max_attempts)
+
+        with self._condition:
+            self.failed += 1
+            self.dropped += dropped
+            self._pending -= dropped
+            self._chunks = retry + unwritten + self._chunks
+            self._waiting += sum(len(chunk[1]) for chunk in retry + unwritten)
+
+    def stats(self):
+        with self._condition:
+            return {
+                'accepted': self.accepted,
+                'rejected': self.rejected,
+                'flushed': self.flushed,
+                'failed': self.failed,
+                'dropped': self.dropped,
+                'pending': self._pending,
+                'capacity': self.capacity,
+            }
+
+
+def get_telemetry_buffer():
+    """
+    Get the telemetry buffer of this process, created from the app settings on first use.
+    """
+    global _buffer
+
+    with _buffer_lock:
+        if _buffer is None:
+            _buffer = TelemetryBuffer(
+                capacity=app.get_custom_setting('telemetry_buffer_size') or DEFAULT_BUFFER_SIZE,
+                flush_size=app.get_custom_setting('telemetry_flush_size') or DEFAULT_FLUSH_SIZE,
+                flush_seconds=app.get_custom_setting('telemetry_flush_seconds') or DEFAULT_FLUSH_SECONDS,
+            )
+
+        return _buffer
@@ -1,10 +1,48 @@
 # Most of your test classes should inherit from TethysTestCase
+import os
+import base64
+import gzip
+import json
+import time
+import datetime
+import tempfile
+import threading
+import zipfile
+from io import BytesIO
+from math import isnan
+import numpy as np
+from sqlalchemy import event, inspect
+from sqlalchemy.engine import Engine
+from django.core.cache import cache
+from django.core.signals import request_finished
 from tethys_sdk.testing import TethysTestCase
 
 # Use if your app has persistent stores that will be tested against.
 # Your app class from app.py must be passed as an argument to the TethysTestCase functions to both
 # create and destroy the temporary persistent stores for your app used during testing
-# from ..app import WellInventory
+from ..app import WellInventory
+from ..model import Well, Hydrograph, HydrographPoint, HydrographAggregate, get_wells_with_hydrographs, upgrade_schema, \
+    replace_hydrograph, write_telemetry, IngestJob, requeue_stale_ingest_jobs, get_wells_page, create_ingest_job, \
+    migrate_hydrograph_storage, get_well_tile, import_wells, get_wells_in_bbox, get_cache_version, CacheVersion, \
+    get_ingest_job, rebuild_hydrograph_points, get_hydrograph_version, ingest_hydrograph_folder, add_new_well, \
+    get_well_hydrograph_version, get_comparison_wells
+from ..db import get_session, get_engine, remove_session
+from .. import storage
+from ..ingest import iter_hydrograph_chunks
+from ..downsample import lttb, min_max, decimate, MIN_MAX
+from ..pyramid import PyramidBuilder, LEVELS, select_level, aligned_range
+from ..tiles import tile_bounds, tile_size, CLUSTER_MAX_ZOOM
+from ..importers import get_format, iter_well_rows, parse_coordinate, normalize_well
+from ..helpers import select_series, get_popup_series, POPUP_PLOT_WIDTH
+from ..figures import FigureCache, get_figure_cache
+from ..instrumentation import prometheus_metrics, latency_stats
+from ..benchmarks import compare_results
+from ..compare import align_series, bins_per_series, TOTAL_POINTS
+from ..cache import get_wells_version, get_wells_counts, get_map_center
+from ..export import export_hydrographs, CSV_GZIP, PARQUET
+from ..analytics import compute_statistics, HOURS_PER_YEAR
+from ..telemetry import TelemetryBuffer, BufferFull, parse_json_lines, parse_readings, JSON_LINES
+from ..jobs import recover_ingest_jobs
 
 # Use if you'd like a simplified way to test rendered HTML templates.
 # You likely need to install BeautifulSoup, as it is not included by default in Tethys Platform
@@ -162,4 +200,1358 @@ class WellInventoryTestCase(TethysTestCase):
 
         context = response.context
         self.assertEqual(context['my_integer'], 10)
-        '''
\ No newline at end of file
+        '''
+
+
+class ListWellsQueryCountTestCase(TethysTestCase):
+    """
+    The wells list must be built with the same number of SQL statements whatever the number of wells.
+    """
+
+    def set_up(self):
+        self.create_test_persistent_stores_for_app(WellInventory)
+        self.statements = []
+        event.listen(Engine, 'before_cursor_execute', self.record_statement)
+
+    def tear_down(self):
+        event.remove(Engine, 'before_cursor_execute', self.record_statement)
+        remove_session()
+        self.destroy_test_persistent_stores_for_app(WellInventory)
+
+    def record_statement(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement)
+
+    def add_wells(self, count):
+        Session = WellInventory.get_persistent_store_database('primary_db', as_sessionmaker=True)
+        session = Session()
+
+        for i in range(count):
+            well = Well(latitude=40.0 + i * 0.01, longitude=-111.0, name='Well {0}'.format(i), owner='USGS',
+                        river='Provo Aquifer', date_built='2000')
+
+            # Give every other well a hydrograph so both sides of the join are exercised
+            if i % 2 == 0:
+                well.hydrograph = Hydrograph(num_points=10, start_time=0, end_time=9)
+
+            session.add(well)
+
+        session.commit()
+        session.close()
+
+    def count_statements(self):
+        remove_session()
+        self.statements = []
+        rows = get_wells_with_hydrographs()
+        return len(self.statements), len(rows)
+
+    def test_list_wells_statement_count_is_constant(self):
+        self.add_wells(2)
+        few_statements, few_wells = self.count_statements()
+
+        self.add_wells(50)
+        many_statements, many_wells = self.count_statements()
+
+        self.assertLess(few_wells, many_wells)
+        self.assertEqual(few_statements, many_statements)
+
+    def test_list_wells_rows(self):
+        self.add_wells(4)
+
+        rows = get_wells_with_hydrographs()
+        with_hydrograph = [well for well in rows if well.hydrograph_id is not None]
+
+        self.assertTrue(with_hydrograph)
+        for well in with_hydrograph:
+            self.assertEqual(well.num_points, 10)
+            self.assertEqual(well.end_time, 9)
+
+
+def add_legacy_hydrograph(num_points):
+    """
+    Save a well with a hydrograph as the baseline schema left it: points only, with the summary columns empty.
+    Returns (well id, hydrograph id).
+    """
+    Session = WellInventory.get_persistent_store_database('primary_db', as_sessionmaker=True)
+    session = Session()
+    well = Well(latitude=40.0, longitude=-111.0, name='Legacy', owner='USGS', river='Provo Aquifer',
+                date_built='2000')
+    well.hydrograph = Hydrograph()
+    session.add(well)
+    session.flush()
+    ids = well.id, well.hydrograph.id
+
+    if num_points:
+        session.execute(HydrographPoint.__table__.insert(),
+                        [{'hydrograph_id': ids[1], 'time': t, 'flow': 10.0 + t} for t in range(num_points)])
+    session.execute(Hydrograph.__table__.update().where(Hydrograph.id == ids[1]).
+                    values(num_points=None, start_time=None, end_time=None, end_flow=None, version=None))
+    session.commit()
+    session.close()
+    return ids
+
+
+class SessionTeardownTestCase(TethysTestCase):
+    """
+    Every thread shares one engine but gets its own session, which hands its connection back to the pool and drops
+    uncommitted changes when the request finishes.
+    """
+
+    def set_up(self):
+        self.create_test_persistent_stores_for_app(WellInventory)
+        remove_session()
+        self.engine = get_engine()
+        self.checked_out = 0
+        event.listen(self.engine, 'checkout', self.on_checkout)
+        event.listen(self.engine, 'checkin', self.on_checkin)
+
+    def tear_down(self):
+        event.remove(self.engine, 'checkout', self.on_checkout)
+        event.remove(self.engine, 'checkin', self.on_checkin)
+        remove_session()
+        self.destroy_test_persistent_stores_for_app(WellInventory)
+
+    def on_checkout(self, dbapi_connection, connection_record, connection_proxy):
+        self.checked_out += 1
+
+    def on_checkin(self, dbapi_connection, connection_record):
+        self.checked_out -= 1
+
+    def add_well(self):
+        session = get_session()
+        session.add(Well(latitude=40.0, longitude=-111.0, name='Pending', owner='USGS', river='Provo Aquifer',
+                         date_built='2000'))
+        session.flush()
+        self.assertEqual(self.checked_out, 1)
+        return session
+
+    def count_pending(self):
+        return get_session().query(Well).filter(Well.name == 'Pending').count()
+
+    def test_request_finished(self):
+        session = self.add_well()
+        self.assertIs(get_session(), session)
+
+        request_finished.send(sender=self.__class__)
+
+        self.assertEqual(self.checked_out, 0)
+        self.assertIsNot(get_session(), session)
+        self.assertEqual(self.count_pending(), 0)
+
+    def test_thread_sessions(self):
+        sessions = []
+        thread = threading.Thread(target=lambda: sessions.append((get_session(), get_engine())) or remove_session())
+        thread.start()
+        thread.join()
+
+        self.assertIsNot(sessions[0][0], get_session())
+        self.assertIs(sessions[0][1], self.engine)
+
+        self.add_well()
+        remove_session()
+        self.assertEqual(self.checked_out, 0)
+
+
+class UpgradeSchemaTestCase(TethysTestCase):
+    """
+    Hydrographs saved before the summary columns and pyramids existed are summarized and aggregated from their
+    points by the upgrade.
+    """
+
+    def set_up(self):
+        self.create_test_persistent_stores_for_app(WellInventory)
+        self.engine = WellInventory.get_persistent_store_database('primary_db')
+
+    def tear_down(self):
+        remove_session()
+        self.destroy_test_persistent_stores_for_app(WellInventory)
+
+    def test_legacy_hydrograph_backfilled(self):
+        well_id, hydrograph_id = add_legacy_hydrograph(100)
+
+        upgrade_schema(self.engine)
+
+        Session = WellInventory.get_persistent_store_database('primary_db', as_sessionmaker=True)
+        session = Session()
+        hydrograph = session.query(Hydrograph).get(hydrograph_id)
+        self.assertEqual((hydrograph.num_points, hydrograph.start_time, hydrograph.end_time), (100, 0, 99))
+        self.assertEqual(hydrograph.end_flow, 109.0)
+        self.assertEqual(hydrograph.version, 1)
+
+        # Built by the upgrade rather than left for build-pyramids
+        levels = session.query(HydrographAggregate.level).filter_by(hydrograph_id=hydrograph_id).distinct().all()
+        self.assertEqual(sorted(level for level, in levels), [24, 168, 720])
+        session.close()
+
+        summary = [well for well in get_wells_with_hydrographs() if well.hydrograph_id == hydrograph_id][0]
+        self.assertEqual((summary.num_points, summary.end_time, summary.latest_depth), (100, 99, 109.0))
+
+
+class RebuildPointsTestCase(TethysTestCase):
+    """
+    Points tables keyed by a surrogate id are rebuilt onto the (hydrograph_id, time) key, keeping the last point
+    inserted for each hydrograph and time and nothing else lost, and rebuilding again changes nothing.
+    """
+
+    def set_up(self):
+        self.create_test_persistent_stores_for_app(WellInventory)
+        self.engine = WellInventory.get_persistent_store_database('primary_db')
+
+    def tear_down(self):
+        remove_session()
+        self.destroy_test_persistent_stores_for_app(WellInventory)
+
+    def points(self):
+        return self.engine.execute('SELECT hydrograph_id, time, flow FROM hydrograph_points '
+                                   'ORDER BY hydrograph_id, time').fetchall()
+
+    def test_rebuild_id_keyed_points(self):
+        first = add_legacy_hydrograph(0)[1]
+        second = add_legacy_hydrograph(0)[1]
+
+        # The table as it was before the composite key, repeating times 1 and 2 of the first hydrograph
+        self.engine.execute('DROP TABLE hydrograph_points')
+        self.engine.execute('CREATE TABLE hydrograph_points (id INTEGER PRIMARY KEY, hydrograph_id INTEGER, '
+                            'time INTEGER, flow FLOAT)')
+        rows = [(first, 0, 1.0), (first, 1, 2.0), (first, 2, 3.0), (second, 1, 7.0), (first, 1, 4.0),
+                (first, 2, 5.0), (first, 2, 6.0), (second, 0, 8.0), (first, None, 9.0)]
+        for row_id, row in enumerate(rows, start=1):
+            self.engine.execute('INSERT INTO hydrograph_points (id, hydrograph_id, time, flow) VALUES (%s, %s, %s, %s)'
+                                % ((row_id,) + tuple('NULL' if value is None else value for value in row)))
+
+        upgrade_schema(self.engine)
+
+        expected = [(first, 0, 1.0), (first, 1, 4.0), (first, 2, 6.0), (second, 0, 8.0), (second, 1, 7.0)]
+        self.assertEqual([tuple(row) for row in self.points()], expected)
+        self.assertEqual(inspect(self.engine).get_pk_constraint('hydrograph_points')['constrained_columns'],
+                         ['hydrograph_id', 'time'])
+        self.assertEqual(get_session().query(Hydrograph).get(first).num_points, 3)
+
+        # Upgrading or rebuilding again keeps every point
+        upgrade_schema(self.engine)
+        self.assertEqual(rebuild_hydrograph_points(self.engine), 5)
+        self.assertEqual([tuple(row) for row in self.points()], expected)
+
+
+class UploadModeTestCase(TethysTestCase):
+    """
+    Appended and merged uploads and telemetry add to the stored series, including hydrographs saved before their
+    summary columns existed, instead of replacing it.
+    """
+
+    def set_up(self):
+        self.create_test_persistent_stores_for_app(WellInventory)
+        self.well_id, self.hydrograph_id = add_legacy_hydrograph(100)
+
+    def tear_down(self):
+        remove_session()
+        self.destroy_test_persistent_stores_for_app(WellInventory)
+
+    def upload(self, content, mode):
+        return replace_hydrograph(self.well_id, BytesIO(content), mode)['points']
+
+    def series(self):
+        remove_session()
+        hydrograph = get_session().query(Hydrograph).get(self.hydrograph_id)
+        times, flows = hydrograph.get_series()
+        return times.tolist(), flows.tolist(), hydrograph.num_points
+
+    def test_append_to_legacy_hydrograph(self):
+        self.assertEqual(self.upload(b'99,0.5\n100,1.5\n101,2.5\n', Hydrograph.APPEND), 2)
+
+        times, flows, num_points = self.series()
+        self.assertEqual(times, list(range(102)))
+        self.assertEqual(flows[-3:], [109.0, 1.5, 2.5])
+        self.assertEqual(num_points, 102)
+
+    def test_merge_replaces_same_times(self):
+        self.assertEqual(self.upload(b'5,-1\n200,3\n', Hydrograph.MERGE), 2)
+
+        times, flows, num_points = self.series()
+        self.assertEqual(len(times), 101)
+        self.assertEqual((flows[5], flows[-1]), (-1.0, 3.0))
+        self.assertEqual(num_points, 101)
+
+    def test_replace(self):
+        self.assertEqual(self.upload(b'0,1\n1,2\n', Hydrograph.REPLACE), 2)
+        self.assertEqual(self.series(), ([0, 1], [1.0, 2.0], 2))
+
+    def assert_pyramid_rebuilt(self):
+        remove_session()
+        hydrograph = get_session().query(Hydrograph).get(self.hydrograph_id)
+        builder = PyramidBuilder()
+        builder.add(*hydrograph.get_series())
+
+        for level, (times, counts, mins, means, maxs) in builder.build().items():
+            stored = hydrograph.get_aggregates(level)
+            self.assertEqual([stored[0].tolist(), stored[1].tolist(), stored[3].tolist()],
+                             [times.tolist(), mins.tolist(), maxs.tolist()])
+            self.assertTrue(np.allclose(stored[2], means))
+
+    def append_and_merge(self):
+        self.assertEqual(self.upload(b'99,0.5\n150,1\n6000,2\n', Hydrograph.APPEND), 2)
+        self.assert_pyramid_rebuilt()
+
+        self.assertEqual(self.upload(b'5,-1\n200,3\n5039,4\n5040,5\n', Hydrograph.MERGE), 4)
+        self.assert_pyramid_rebuilt()
+
+        self.assertEqual(self.upload(b'10,7\n6000,8\n', Hydrograph.APPEND), 0)
+
+        times, flows, num_points = self.series()
+        self.assertEqual(times[-6:], [99, 150, 200, 5039, 5040, 6000])
+        self.assertEqual(flows[-6:], [109.0, 1.0, 3.0, 4.0, 5.0, 2.0])
+        self.assertEqual((flows[5], flows[10], num_points), (-1.0, 20.0, 105))
+
+    def test_legacy_pyramid_matches_rebuild(self):
+        self.append_and_merge()
+
+    def test_columnar_pyramid_matches_rebuild(self):
+        migrate_hydrograph_storage(WellInventory.get_persistent_store_database('primary_db'), storage.COLUMNAR)
+        self.append_and_merge()
+
+        self.assertIsNotNone(get_session().query(Hydrograph).get(self.hydrograph_id).series)
+
+    def test_telemetry_keeps_wells_version(self):
+        session = get_session()
+        well = Well(latitude=40.0, longitude=-111.0, name='New', owner='USGS', river='Provo Aquifer', date_built='2000')
+        session.add(well)
+        session.commit()
+        new_well_id = well.id
+        version = get_cache_version(CacheVersion.WELLS)
+        series_version = session.query(Hydrograph).get(self.hydrograph_id).version or 0
+        remove_session()
+
+        # Readings of a well that has a hydrograph only change the version of its series
+        write_telemetry([self.well_id], [100], [1.5])
+        remove_session()
+        self.assertEqual(get_cache_version(CacheVersion.WELLS), version)
+        self.assertEqual(get_session().query(Hydrograph).get(self.hydrograph_id).version, series_version + 1)
+
+        write_telemetry([new_well_id], [0], [1.5])
+        self.assertEqual(get_cache_version(CacheVersion.WELLS), version + 1)
+
+    def test_telemetry_merges_legacy_hydrograph(self):
+        self.assertEqual(write_telemetry([self.well_id, self.well_id], [100, 101], [1.5, 2.5]), 2)
+
+        times, flows, num_points = self.series()
+        self.assertEqual(times, list(range(102)))
+        self.assertEqual(num_points, 102)
+
+
+class StorageTestCase(TethysTestCase):
+    """
+    Series read back the same from either storage backend and survive conversion between them, including
+    hydrographs saved as points before the summary columns existed.
+    """
+
+    def set_up(self):
+        self.create_test_persistent_stores_for_app(WellInventory)
+        self.engine = WellInventory.get_persistent_store_database('primary_db')
+        Session = WellInventory.get_persistent_store_database('primary_db', as_sessionmaker=True)
+        self.session = Session()
+
+    def tear_down(self):
+        self.session.close()
+        remove_session()
+        self.destroy_test_persistent_stores_for_app(WellInventory)
+
+    def add_hydrograph(self, times, flows, backend):
+        well = Well(latitude=40.0, longitude=-111.0, name='Stored', owner='USGS', river='Provo Aquifer',
+                    date_built='2000')
+        well.hydrograph = Hydrograph()
+        self.session.add(well)
+        well.hydrograph.set_series(times, flows, backend=backend)
+        self.session.commit()
+        return well.hydrograph.id
+
+    def get_hydrograph(self, hydrograph_id):
+        self.session.expire_all()
+        return self.session.query(Hydrograph).get(hydrograph_id)
+
+    def count_points(self, hydrograph_id):
+        return self.session.query(HydrographPoint).filter_by(hydrograph_id=hydrograph_id).count()
+
+    def test_pack_round_trip(self):
+        times, flows = storage.unpack_series(storage.pack_series([3, 1, 2], [30.0, 10.0, 20.0]), 3)
+
+        self.assertEqual((times.dtype, flows.dtype), (storage.TIME_DTYPE, storage.FLOW_DTYPE))
+        self.assertEqual((times.tolist(), flows.tolist()), ([1, 2, 3], [10.0, 20.0, 30.0]))
+        self.assertEqual(storage.unpack_series(None, 0)[0].size, 0)
+        self.assertRaises(ValueError, storage.as_series, [1, 2], [1.0])
+
+    def test_unique_series_keeps_last(self):
+        times, flows = storage.unique_series([2, 1, 2], [1.0, 5.0, 3.0])
+        self.assertEqual((times.tolist(), flows.tolist()), ([1, 2], [5.0, 3.0]))
+
+    def test_set_series_round_trip(self):
+        for backend in storage.BACKENDS:
+            hydrograph_id = self.add_hydrograph([5, 0, 3, 3], [50.0, 0.5, 1.0, 30.0], backend)
+            hydrograph = self.get_hydrograph(hydrograph_id)
+
+            self.assertEqual(hydrograph.series is None, backend == storage.POINTS)
+            self.assertEqual(self.count_points(hydrograph_id), 3 if backend == storage.POINTS else 0)
+            self.assertEqual((hydrograph.num_points, hydrograph.start_time, hydrograph.end_time, hydrograph.end_flow),
+                             (3, 0, 5, 50.0))
+
+            times, flows = hydrograph.get_series()
+            self.assertEqual((times.tolist(), flows.tolist()), ([0, 3, 5], [0.5, 30.0, 50.0]))
+
+            times, flows = hydrograph.get_series(1, 5)
+            self.assertEqual((times.tolist(), flows.tolist()), ([3, 5], [30.0, 50.0]))
+
+    def test_convert_legacy_points(self):
+        well_id, hydrograph_id = add_legacy_hydrograph(100)
+
+        self.assertEqual(migrate_hydrograph_storage(self.engine, storage.COLUMNAR), 1)
+        hydrograph = self.get_hydrograph(hydrograph_id)
+        self.assertIsNotNone(hydrograph.series)
+        self.assertEqual(self.count_points(hydrograph_id), 0)
+        self.assertEqual((hydrograph.num_points, hydrograph.end_flow), (100, 109.0))
+
+        times, flows = hydrograph.get_series()
+        self.assertEqual(times.tolist(), list(range(100)))
+        self.assertEqual(flows.tolist(), [10.0 + t for t in range(100)])
+
+        # Already columnar hydrographs are left alone, and converting back restores the rows
+        self.assertEqual(migrate_hydrograph_storage(self.engine, storage.COLUMNAR), 0)
+        self.assertEqual(migrate_hydrograph_storage(self.engine, storage.POINTS), 1)
+        hydrograph = self.get_hydrograph(hydrograph_id)
+        self.assertIsNone(hydrograph.series)
+        self.assertEqual(self.count_points(hydrograph_id), 100)
+        self.assertEqual(hydrograph.get_series()[1].tolist(), flows.tolist())
+
+
+class HydrographIngestTestCase(TethysTestCase):
+    """
+    Hydrograph files are parsed chunk by chunk, skipping lines the original parser rejected, and written the same
+    whichever way they are chunked.
+    """
+
+    def set_up(self):
+        self.create_test_persistent_stores_for_app(WellInventory)
+        session = get_session()
+        well = Well(latitude=40.0, longitude=-111.0, name='Ingest', owner='USGS', river='Provo Aquifer',
+                    date_built='2000')
+        well.hydrograph = Hydrograph()
+        session.add(well)
+        session.commit()
+        self.well_id, self.hydrograph_id = well.id, well.hydrograph.id
+        remove_session()
+
+    def tear_down(self):
+        remove_session()
+        self.destroy_test_persistent_stores_for_app(WellInventory)
+
+    def test_parse_chunks(self):
+        content = b'time,depth\n0,1.5\n1,2.5\r2,3.5\rbad\n3.5,4\n4,nan\n3000000000,7\n-2147483649,8\n5,6\n'
+        chunks = list(iter_hydrograph_chunks(BytesIO(content), chunk_size=2))
+
+        self.assertGreater(len(chunks), 1)
+        self.assertEqual(sum((c[0].tolist() for c in chunks), []), [0, 1, 2, 5])
+        self.assertEqual(sum((c[1].tolist() for c in chunks), []), [1.5, 2.5, 3.5, 6.0])
+
+    def test_overlapping_chunks(self):
+        for backend in storage.BACKENDS:
+            session = get_session()
+            hydrograph = session.query(Hydrograph).get(self.hydrograph_id)
+            num_points = hydrograph.load_series([([0, 1], [1.0, 2.0]), ([1, 2], [3.0, 4.0])], backend=backend)
+            session.commit()
+            remove_session()
+
+            hydrograph = get_session().query(Hydrograph).get(self.hydrograph_id)
+            times, flows = hydrograph.get_series()
+            self.assertEqual((num_points, hydrograph.num_points), (3, 3))
+            self.assertEqual((times.tolist(), flows.tolist()), ([0, 1, 2], [1.0, 3.0, 4.0]))
+            self.assertEqual([a.tolist() for a in hydrograph.get_aggregates(24)], [[0], [1.0], [8.0 / 3], [4.0]])
+
+    def test_upload_in_chunks(self):
+        content = ''.join('{0},{1}\n'.format(t, t * 0.5) for t in range(1000)).encode()
+        replace_hydrograph(self.well_id, BytesIO(content))
+
+        hydrograph = get_session().query(Hydrograph).get(self.hydrograph_id)
+        times, flows = hydrograph.get_series()
+        self.assertEqual(times.tolist(), list(range(1000)))
+        self.assertEqual((hydrograph.num_points, hydrograph.end_time, hydrograph.end_flow), (1000, 999, 499.5))
+
+
+class FolderIngestTestCase(TethysTestCase):
+    """
+    Per-site files of a directory or zip archive are written to the wells with matching site numbers, and files
+    without a matching well are reported instead of written.
+    """
+
+    def set_up(self):
+        self.create_test_persistent_stores_for_app(WellInventory)
+        session = get_session()
+        well = Well(latitude=40.0, longitude=-111.0, name='Folder', owner='USGS', river='Provo Aquifer',
+                    date_built='2000', site_number='375050109034801')
+        session.add(well)
+        session.commit()
+        self.well_id = well.id
+        remove_session()
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tear_down(self):
+        self.directory.cleanup()
+        remove_session()
+        self.destroy_test_persistent_stores_for_app(WellInventory)
+
+    def write_files(self):
+        files = {'375050109034801.csv': b'time,depth\n0,1.5\n1,2.5\n2,3.5\n', '999.csv': b'0,1\n'}
+
+        for name, content in files.items():
+            with open(os.path.join(self.directory.name, name), 'wb') as hydrograph_file:
+                hydrograph_file.write(content)
+
+    def assert_ingested(self, report):
+        by_site = {entry['site']: entry for entry in report['files']}
+        self.assertEqual((report['points'], by_site['375050109034801']['points']), (3, 3))
+        self.assertIsNone(by_site['375050109034801']['error'])
+        self.assertEqual(by_site['999']['error'], 'No well with site number 999.')
+
+        remove_session()
+        hydrograph = get_session().query(Well).get(self.well_id).hydrograph
+        times, flows = hydrograph.get_series()
+        self.assertEqual((times.tolist(), flows.tolist()), ([0, 1, 2], [1.5, 2.5, 3.5]))
+
+    def test_ingest_directory(self):
+        self.write_files()
+        self.assert_ingested(ingest_hydrograph_folder(self.directory.name, workers=1))
+
+        # Appending the same files again adds nothing
+        report = ingest_hydrograph_folder(self.directory.name, workers=1, mode=Hydrograph.APPEND)
+        self.assertEqual(report['points'], 0)
+
+    def test_ingest_zip(self):
+        self.write_files()
+        path = os.path.join(self.directory.name, 'hydrographs.zip')
+
+        with zipfile.ZipFile(path, 'w') as archive:
+            for name in ('375050109034801.csv', '999.csv'):
+                archive.write(os.path.join(self.directory.name, name), 'hydrographs/' + name)
+
+        self.assert_ingested(ingest_hydrograph_folder(path, workers=2, batch_size=1))
+
+
+class DownsampleTestCase(TethysTestCase):
+    """
+    Downsampled series keep their endpoints and extremes within the requested number of points.
+    """
+
+    def set_up(self):
+        self.x = np.arange(1000)
+        self.y = np.sin(self.x / 50.0)
+        self.y[500] = 10.0
+        self.y[700] = -10.0
+
+    def tear_down(self):
+        pass
+
+    def test_lttb(self):
+        indices = lttb(self.x, self.y, 50)
+
+        self.assertEqual(len(indices), 50)
+        self.assertEqual((indices[0], indices[-1]), (0, 999))
+        self.assertTrue(np.all(np.diff(indices) > 0))
+        self.assertTrue({500, 700} <= set(indices.tolist()))
+
+    def test_min_max(self):
+        indices = min_max(self.x, self.y, 50)
+
+        self.assertLessEqual(len(indices), 52)
+        self.assertEqual((indices[0], indices[-1]), (0, 999))
+        self.assertTrue({500, 700} <= set(indices.tolist()))
+
+    def test_decimate(self):
+        x, y = decimate(self.x, self.y, 2000)
+        self.assertIs(x, self.x)
+
+        x, y = decimate(self.x, self.y, 50, MIN_MAX)
+        self.assertEqual((y.max(), y.min()), (10.0, -10.0))
+        self.assertRaises(ValueError, decimate, self.x, self.y, 50, 'mean')
+
+
+def bucket_stats(times, flows, level):
+    """
+    Compute (times, counts, mins, means, maxs) of the level buckets of a series one bucket at a time.
+    """
+    starts = sorted(set(t // level * level for t in times))
+    columns = [[], [], [], [], []]
+
+    for start in starts:
+        bucket = [flow for t, flow in zip(times, flows) if start <= t < start + level]
+        for column, value in zip(columns, (start, len(bucket), min(bucket), sum(bucket) / len(bucket), max(bucket))):
+            column.append(value)
+
+    return columns
+
+
+class PyramidTestCase(TethysTestCase):
+    """
+    Aggregate pyramids match the buckets of the full series however the points arrive, and stored pyramids match a
+    rebuild from the stored points.
+    """
+
+    def set_up(self):
+        random = np.random.RandomState(0)
+        self.times = random.choice(20000, 3000, replace=False)
+        self.flows = random.normal(50.0, 10.0, 3000)
+
+    def tear_down(self):
+        remove_session()
+
+    def assert_levels_equal(self, levels, times, flows):
+        self.assertEqual(sorted(levels), sorted(LEVELS))
+
+        for level in LEVELS:
+            expected = bucket_stats(times.tolist(), flows.tolist(), level)
+            actual = [column.tolist() for column in levels[level]]
+            self.assertEqual(actual[:3] + actual[4:], expected[:3] + expected[4:])
+            self.assertTrue(np.allclose(actual[3], expected[3]))
+
+    def test_builder_matches_buckets(self):
+        builder = PyramidBuilder()
+
+        # Unsorted chunks sharing buckets fold into the same pyramid
+        for start in range(0, 3000, 700):
+            builder.add(self.times[start:start + 700], self.flows[start:start + 700])
+
+        self.assert_levels_equal(builder.build(), self.times, self.flows)
+        self.assertEqual((builder.start_time, builder.end_time), (self.times.min(), self.times.max()))
+        self.assertEqual(builder.end_flow, self.flows[np.argmax(self.times)])
+        self.assertEqual(PyramidBuilder().build(), {})
+
+    def test_select_level(self):
+        self.assertIsNone(select_level(100, 1000, 200))
+        self.assertIsNone(select_level(10000, 1000, 0))
+        self.assertEqual(select_level(10000, 24000, 500), 24)
+        self.assertEqual(select_level(10000, 24000, 30), 720)
+
+    def test_aligned_range(self):
+        self.assertEqual(aligned_range(30, 100), (0, 5040))
+        self.assertEqual(aligned_range(5040, 5041), (5040, 10080))
+
+    def test_stored_pyramid_matches_rebuild(self):
+        self.create_test_persistent_stores_for_app(WellInventory)
+        well_id, hydrograph_id = add_legacy_hydrograph(0)
+
+        for backend in storage.BACKENDS:
+            session = get_session()
+            hydrograph = session.query(Hydrograph).get(hydrograph_id)
+            hydrograph.load_series([(self.times[start:start + 1000], self.flows[start:start + 1000])
+                                    for start in range(0, 3000, 1000)], backend=backend)
+            session.commit()
+
+            stored = [hydrograph.get_aggregates(level) for level in LEVELS]
+            hydrograph.rebuild_pyramid()
+            session.commit()
+            rebuilt = [hydrograph.get_aggregates(level) for level in LEVELS]
+
+            for (times, mins, means, maxs), expected in zip(stored, rebuilt):
+                self.assertEqual([times.tolist(), mins.tolist(), maxs.tolist()],
+                                 [expected[0].tolist(), expected[1].tolist(), expected[3].tolist()])
+                self.assertTrue(np.allclose(means, expected[2]))
+
+            self.assertEqual(len(stored[0][0]), len(set((self.times // 24).tolist())))
+            remove_session()
+
+        self.destroy_test_persistent_stores_for_app(WellInventory)
+
+    def test_min_max_keeps_spike(self):
+        self.create_test_persistent_stores_for_app(WellInventory)
+        well_id, hydrograph_id = add_legacy_hydrograph(0)
+
+        session = get_session()
+        hydrograph = session.query(Hydrograph).get(hydrograph_id)
+        flows = np.ones(48000)
+        flows[30001] = 100.0
+        flows[40001] = -100.0
+        hydrograph.set_series(np.arange(48000), flows)
+        session.commit()
+
+        # A weekly bucket holds the spikes, its mean hides them but its range does not
+        time, flow, level = select_series(hydrograph, 200, MIN_MAX)
+        self.assertEqual(level, 168)
+        self.assertLessEqual(len(time), 202)
+        self.assertEqual((flow.max(), flow.min()), (100.0, -100.0))
+        self.assertIn(30001 // 168 * 168, time[flow == 100.0].tolist())
+
+        time, flow, level = select_series(hydrograph, 200)
+        self.assertLess(flow.max(), 2.0)
+
+        remove_session()
+        self.destroy_test_persistent_stores_for_app(WellInventory)
+
+
+class WellTileTestCase(TethysTestCase):
+    """
+    Wells are served in square-degree tiles, each well in exactly one tile, clustered by grid cell at low zoom.
+    """
+
+    def set_up(self):
+        self.create_test_persistent_stores_for_app(WellInventory)
+        session = get_session()
+
+        # Away from the wells the app starts with, two wells share a grid cell at zoom 2 and one is on a tile edge
+        for longitude, latitude in ((10.0, -20.0), (10.5, -20.5), (60.0, -60.0), (0.0, -30.0)):
+            session.add(Well(latitude=latitude, longitude=longitude, name='Tile', owner='USGS', river='Aquifer',
+                             date_built='2000'))
+
+        session.commit()
+        remove_session()
+
+    def tear_down(self):
+        remove_session()
+        self.destroy_test_persistent_stores_for_app(WellInventory)
+
+    def test_tile_bounds(self):
+        self.assertEqual(tile_size(1), 180.0)
+        self.assertEqual(tile_bounds(1, 1, 0), (0.0, -90.0, 180.0, 90.0))
+        self.assertEqual(tile_bounds(2, 0, 1), (-180.0, -90.0, -90.0, 0.0))
+        self.assertRaises(ValueError, tile_bounds, 19, 0, 0)
+
+    def test_clusters(self):
+        features = get_well_tile(2, 2, 1)
+        clusters = [f['properties']['count'] for f in features if f['properties'].get('cluster')]
+        singles = sorted(f['geometry']['coordinates'] for f in features if not f['properties'].get('cluster'))
+
+        self.assertEqual(clusters, [2])
+        self.assertEqual(singles, [[0.0, -30.0], [60.0, -60.0]])
+
+        # The well on the edge of the tile on the left is not repeated there
+        self.assertEqual(get_well_tile(2, 1, 1), [])
+
+    def test_world_edges(self):
+        session = get_session()
+        session.add_all([
+            Well(latitude=10.0, longitude=180.0, name='East', owner='USGS', river='Aquifer', date_built='2000'),
+            Well(latitude=-90.0, longitude=-100.0, name='South', owner='USGS', river='Aquifer', date_built='2000'),
+        ])
+        session.commit()
+        remove_session()
+
+        size = tile_size(CLUSTER_MAX_ZOOM)
+        last = 2 ** CLUSTER_MAX_ZOOM - 1
+        for z, x, y, coordinates in ((2, 3, 0, [180.0, 10.0]), (2, 0, 1, [-100.0, -90.0]),
+                                     (CLUSTER_MAX_ZOOM, last, int(80 // size), [180.0, 10.0]),
+                                     (CLUSTER_MAX_ZOOM, int(80 // size), int(180 // size) - 1, [-100.0, -90.0])):
+            self.assertIn(coordinates, [f['geometry']['coordinates'] for f in get_well_tile(z, x, y)])
+
+    def test_bbox_limit(self):
+        self.assertEqual(len(get_wells_in_bbox(0.0, -90.0, 90.0, 0.0)), 4)
+        self.assertEqual(len(get_wells_in_bbox(0.0, -90.0, 90.0, 0.0, limit=1)), 1)
+        self.assertEqual(get_wells_in_bbox(0.0, -90.0, 90.0, 0.0, limit=0), [])
+
+    def test_wells_unclustered(self):
+        size = tile_size(CLUSTER_MAX_ZOOM)
+        features = get_well_tile(CLUSTER_MAX_ZOOM, int(190 // size), int(110 // size))
+
+        self.assertEqual([f['geometry']['coordinates'] for f in features], [[10.0, -20.0]])
+        self.assertFalse(features[0]['properties'].get('cluster'))
+
+
+class WellsGeoJsonTestCase(TethysTestCase):
+    """
+    The wells GeoJSON and tiles carry an ETag of the wells version, answer 304 while it matches and change as soon as
+    a well is added.
+    """
+
+    def set_up(self):
+        self.create_test_persistent_stores_for_app(WellInventory)
+        self.c = self.get_test_client()
+        self.user = self.create_test_user(username="joe", password="secret", email="joe@some_site.com")
+        self.c.force_login(self.user)
+
+    def tear_down(self):
+        remove_session()
+        self.destroy_test_persistent_stores_for_app(WellInventory)
+
+    def add_well(self):
+        location = json.dumps({'type': 'GeometryCollection',
+                               'geometries': [{'type': 'Point', 'coordinates': [-111.0, 40.0]}]})
+        add_new_well(location, 'GeoJSON', 'USGS', 'Provo Aquifer', '2000')
+        remove_session()
+
+    def test_geojson_not_modified(self):
+        url = '/apps/well-inventory/wells/geojson/'
+        response = self.c.get(url, HTTP_ACCEPT_ENCODING='gzip')
+        etag = response['ETag']
+
+        self.assertEqual((response.status_code, response['Content-Encoding']), (200, 'gzip'))
+        self.assertEqual(json.loads(gzip.decompress(response.content))['type'], 'FeatureCollection')
+
+        response = self.c.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual((response.status_code, response['ETag'], response.content), (304, etag, b''))
+
+        # A new well changes the version, so the old copy is replaced
+        self.add_well()
+        response = self.c.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertIn('GeoJSON', [f['properties']['name'] for f in json.loads(response.content)['features']])
+
+    def test_tile_not_modified(self):
+        url = '/apps/well-inventory/wells/tiles/0/0/0/'
+        etag = self.c.get(url)['ETag']
+
+        self.assertEqual(self.c.get(url, HTTP_IF_NONE_MATCH='"other", ' + etag).status_code, 304)
+        self.add_well()
+        self.assertEqual(self.c.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+
+class ImportWellsTestCase(TethysTestCase):
+    """
+    Well files are read in any supported format, rows normalized and validated, and repeated site numbers update
+    the wells they name.
+    """
+
+    def set_up(self):
+        self.create_test_persistent_stores_for_app(WellInventory)
+
+    def tear_down(self):
+        remove_session()
+        self.destroy_test_persistent_stores_for_app(WellInventory)
+
+    def test_get_format(self):
+        self.assertEqual(get_format('Wells.XLSX'), 'xlsx')
+        self.assertEqual(get_format('wells.json'), 'geojson')
+        self.assertRaises(ValueError, get_format, 'wells.txt')
+
+    def test_parse_coordinate(self):
+        self.assertEqual(parse_coordinate(' -12.5 '), -12.5)
+        self.assertAlmostEqual(parse_coordinate('37°38\'30"N'), 37.641666, places=5)
+        self.assertEqual(parse_coordinate('111°30\' W'), -111.5)
+        self.assertRaises(ValueError, parse_coordinate, '')
+        self.assertRaises(ValueError, parse_coordinate, '37 degrees')
+
+    def test_normalize_well(self):
+        well = normalize_well({'Well_Name': 'A', 'Lat': '40', 'Long': 111, 'National Aquifer': 'Provo',
+                               'Site No': 123.0}, west_longitudes=True)
+
+        self.assertEqual(well, {'site_number': '123', 'name': 'A', 'owner': 'Other', 'river': 'Provo',
+                                'date_built': '', 'latitude': 40.0, 'longitude': -111.0})
+        self.assertRaises(ValueError, normalize_well, {'name': '', 'lat': 40, 'lon': -111})
+        self.assertRaises(ValueError, normalize_well, {'name': 'A', 'lat': 91, 'lon': -111})
+
+    def test_read_rows(self):
+        rows = list(iter_well_rows(BytesIO(b'\xef\xbb\xbfName,Lat,Lon\nA,1,2\n'), 'csv'))
+        self.assertEqual(rows, [{'Name': 'A', 'Lat': '1', 'Lon': '2'}])
+
+        content = b'{"type": "FeatureCollection", "features": [{"type": "Feature", "properties": {"name": "B"}, ' \
+                  b'"geometry": {"type": "Point", "coordinates": [2.0, 1.0]}}]}'
+        rows = list(iter_well_rows(BytesIO(content), 'geojson'))
+        self.assertEqual(rows, [{'name': 'B', 'longitude': 2.0, 'latitude': 1.0}])
+
+    def test_malformed_files(self):
+        self.assertRaises(ValueError, list, iter_well_rows(BytesIO(b'not a workbook'), 'xlsx'))
+        self.assertRaises(ValueError, list, iter_well_rows(BytesIO(b'[1, 2]'), 'geojson'))
+        self.assertRaises(ValueError, list, iter_well_rows(BytesIO(b'{"type": "FeatureCollection'), 'geojson'))
+        self.assertRaises(ValueError, list, iter_well_rows(BytesIO(b'Name,Lat\n\xff,1\n'), 'csv'))
+
+    def test_malformed_features_rejected(self):
+        content = b'{"type": "FeatureCollection", "features": [' \
+                  b'{"properties": {"name": "A"}, "geometry": {"type": "Point"}}, ' \
+                  b'{"properties": {"name": "B"}, "geometry": {"type": "Point", "coordinates": [1]}}, 7, ' \
+                  b'{"properties": {"name": "C"}, "geometry": {"type": "Point", "coordinates": [30.5, 30.5]}}]}'
+
+        report = import_wells(iter_well_rows(BytesIO(content), 'geojson'))
+        self.assertEqual(report['inserted'], 1)
+        self.assertEqual([row for row, reason in report['rejected']], [1, 2, 3])
+        self.assertTrue(all(reason.startswith('Location') for row, reason in report['rejected']))
+
+    def test_import_updates_by_site_number(self):
+        rows = [
+            {'Site Number': '1', 'name': 'A', 'lat': 30.1, 'lon': 30.1},
+            {'Site Number': '2', 'name': 'B', 'lat': 30.2, 'lon': 30.2},
+            {'Site Number': '3', 'name': '', 'lat': 30.3, 'lon': 30.3},
+            {'Site Number': '1', 'name': 'A2', 'lat': 30.4, 'lon': 30.4},
+        ]
+
+        report = import_wells(rows, batch_size=2)
+        self.assertEqual((report['inserted'], report['updated']), (2, 1))
+        self.assertEqual([row for row, reason in report['rejected']], [3])
+
+        # The summary the map reads from follows both inserts and updates
+        wells = sorted((well.name, well.latitude) for well in get_wells_in_bbox(30.0, 30.0, 31.0, 31.0))
+        self.assertEqual(wells, [('A2', 30.4), ('B', 30.2)])
+
+
+class FigureCacheTestCase(TethysTestCase):
+    """
+    Rendered plots are evicted least recently used first, counted as hits and misses, and never served for another
+    version of their hydrograph.
+    """
+
+    def set_up(self):
+        self.cache = FigureCache(max_size=2)
+
+    def tear_down(self):
+        remove_session()
+
+    def test_lru_eviction(self):
+        self.cache.set(FigureCache.make_key(1, 1), 'a')
+        self.cache.set(FigureCache.make_key(2, 1), 'b')
+        self.assertEqual(self.cache.get(FigureCache.make_key(1, 1)), 'a')
+
+        # Plot 2 is now the least recently used
+        self.cache.set(FigureCache.make_key(3, 1), 'c')
+        self.assertIsNone(self.cache.get(FigureCache.make_key(2, 1)))
+        self.assertEqual(self.cache.get(FigureCache.make_key(1, 1)), 'a')
+        self.assertEqual((self.cache.stats()['evictions'], self.cache.stats()['size']), (1, 2))
+
+    def test_counters(self):
+        created = []
+        key = FigureCache.make_key(1, 1, plot_width=500, method='lttb')
+
+        for i in range(3):
+            self.cache.get_or_create(key, lambda: created.append(i) or 'plot')
+
+        stats = self.cache.stats()
+        self.assertEqual(created, [0])
+        self.assertEqual((stats['hits'], stats['misses']), (2, 1))
+        self.assertAlmostEqual(stats['hit_ratio'], 2 / 3.0)
+
+    def test_version_and_invalidation(self):
+        self.cache.set(FigureCache.make_key(1, 1), 'old')
+        self.cache.set(FigureCache.make_key(2, 1), 'other')
+
+        self.assertIsNone(self.cache.get(FigureCache.make_key(1, 2)))
+        self.assertNotEqual(FigureCache.shared_key(FigureCache.make_key(1, 1)),
+                            FigureCache.shared_key(FigureCache.make_key(1, 2)))
+
+        self.cache.invalidate(1)
+        self.assertIsNone(self.cache.get(FigureCache.make_key(1, 1)))
+        self.assertEqual(self.cache.get(FigureCache.make_key(2, 1)), 'other')
+
+    def test_upload_changes_version(self):
+        self.create_test_persistent_stores_for_app(WellInventory)
+        well_id, hydrograph_id = add_legacy_hydrograph(10)
+        cache = get_figure_cache()
+        key = FigureCache.make_key(hydrograph_id, get_hydrograph_version(hydrograph_id))
+        cache.set(key, 'plot')
+
+        replace_hydrograph(well_id, BytesIO(b'0,1\n1,2\n'))
+        remove_session()
+
+        self.assertIsNone(cache.get(key))
+        self.assertNotEqual(get_hydrograph_version(hydrograph_id), key[1])
+        self.destroy_test_persistent_stores_for_app(WellInventory)
+
+
+class PopupSeriesTestCase(TethysTestCase):
+    """
+    The map popup gets the series of a hydrograph as base64 Int32 times and Float32 depths, decimated to the popup
+    width and rebuilt when the hydrograph version changes.
+    """
+
+    def set_up(self):
+        self.create_test_persistent_stores_for_app(WellInventory)
+        get_figure_cache().clear()
+        self.well_id, self.hydrograph_id = add_legacy_hydrograph(100)
+
+    def tear_down(self):
+        get_figure_cache().clear()
+        remove_session()
+        self.destroy_test_persistent_stores_for_app(WellInventory)
+
+    def popup(self, plot_width=POPUP_PLOT_WIDTH):
+        hydrograph_id, version = get_well_hydrograph_version(self.well_id)
+        series = json.loads(json.dumps(get_popup_series(hydrograph_id, version, plot_width)))
+        times = np.frombuffer(base64.b64decode(series['time']), dtype='<i4')
+        flows = np.frombuffer(base64.b64decode(series['flow']), dtype='<f4')
+        self.assertEqual((series['hydrograph_id'], series['well_id'], series['version']),
+                         (hydrograph_id, self.well_id, version))
+        self.assertEqual(series['count'], len(times))
+        return series, times.tolist(), flows.tolist()
+
+    def test_full_series(self):
+        series, times, flows = self.popup()
+
+        self.assertEqual((series['level'], series['name']), (None, 'Depth to GW'))
+        self.assertEqual(times, list(range(100)))
+        self.assertEqual(flows, [10.0 + t for t in range(100)])
+
+    def test_decimated_series(self):
+        series, times, flows = self.popup(plot_width=20)
+
+        self.assertEqual(len(times), 20)
+        self.assertEqual((times[0], times[-1], flows[-1]), (0, 99, 109.0))
+
+    def test_new_version(self):
+        self.popup()
+        replace_hydrograph(self.well_id, BytesIO(b'0,1.5\n1,2.5\n'))
+        remove_session()
+
+        series, times, flows = self.popup()
+        self.assertEqual((times, flows), ([0, 1], [1.5, 2.5]))
+
+
+class PrometheusMetricsTestCase(TethysTestCase):
+    """
+    Latency summaries, counters and gauges are rendered in the Prometheus text format.
+    """
+
+    def set_up(self):
+        pass
+
+    def tear_down(self):
+        pass
+
+    def test_format(self):
+        latency_stats.add('metrics_test', 0.25)
+        latency_stats.add('metrics_test', 0.75)
+        lines = prometheus_metrics({'well_inventory_test_total': 3}, {'well_inventory_test_pending': 2}).splitlines()
+
+        self.assertIn('# TYPE well_inventory_request_seconds summary', lines)
+        self.assertIn('well_inventory_request_seconds_count{url_map="metrics_test"} 2', lines)
+        self.assertIn('well_inventory_request_seconds_sum{url_map="metrics_test"} 1.000000', lines)
+        self.assertTrue(any(line.startswith('well_inventory_request_seconds{url_map="metrics_test",quantile="0.5"} ')
+                            for line in lines))
+
+        self.assertEqual(lines[-4:], [
+            '# TYPE well_inventory_test_total counter',
+            'well_inventory_test_total 3',
+            '# TYPE well_inventory_test_pending gauge',
+            'well_inventory_test_pending 2',
+        ])
+
+
+class StaleIngestJobTestCase(TethysTestCase):
+    """
+    Running ingest jobs that stopped reporting progress are queued again, those still reporting are left alone, and
+    queued jobs left behind by a restart run without waiting for another upload.
+    """
+
+    def set_up(self):
+        self.create_test_persistent_stores_for_app(WellInventory)
+
+    def tear_down(self):
+        remove_session()
+        self.destroy_test_persistent_stores_for_app(WellInventory)
+
+    def test_requeue_stale_jobs(self):
+        now = datetime.datetime.utcnow()
+        session = get_session()
+        stale = IngestJob(path='stale.csv', status=IngestJob.RUNNING, started=now - datetime.timedelta(hours=2))
+        active = IngestJob(path='active.csv', status=IngestJob.RUNNING, started=now - datetime.timedelta(hours=2),
+                           updated=now)
+        session.add_all([stale, active])
+        session.commit()
+
+        self.assertEqual(requeue_stale_ingest_jobs(900), 1)
+
+        session.expire_all()
+        self.assertEqual((stale.status, active.status), (IngestJob.QUEUED, IngestJob.RUNNING))
+
+    def test_queued_job_picked_up(self):
+        well_id, hydrograph_id = add_legacy_hydrograph(10)
+        handle, path = tempfile.mkstemp(suffix='.csv')
+
+        with os.fdopen(handle, 'wb') as staged_file:
+            staged_file.write(b'0,1.5\n1,2.5\n')
+
+        # Queued as a restart leaves it: recorded, but not submitted to any worker
+        job_id = create_ingest_job(well_id, path, os.path.getsize(path))
+        remove_session()
+        recover_ingest_jobs(force=True)
+
+        deadline = time.time() + 30
+        while get_ingest_job(job_id)['status'] in (IngestJob.QUEUED, IngestJob.RUNNING) and time.time() < deadline:
+            remove_session()
+            time.sleep(0.1)
+
+        job = get_ingest_job(job_id)
+        self.assertEqual((job['status'], job['points']), (IngestJob.DONE, 2))
+        self.assertFalse(os.path.exists(path))
+
+
+class WellsPageTestCase(TethysTestCase):
+    """
+    Keyset pages of the wells table follow the same order as offset pages, NULL sort values included, and search
+    matches the start of names, owners and aquifers.
+    """
+
+    def set_up(self):
+        self.create_test_persistent_stores_for_app(WellInventory)
+        Session = WellInventory.get_persistent_store_database('primary_db', as_sessionmaker=True)
+        session = Session()
+
+        for i in range(23):
+            session.add(Well(latitude=40.0, longitude=-111.0, name='Well {0}'.format(i % 5),
+                             owner=None if i % 4 == 0 else 'Owner {0}'.format(i % 3), river='Provo Aquifer',
+                             date_built='2000'))
+
+        session.commit()
+        session.close()
+
+    def tear_down(self):
+        remove_session()
+        self.destroy_test_persistent_stores_for_app(WellInventory)
+
+    def test_keyset_matches_offset(self):
+        for descending in (False, True):
+            total, filtered, first_page = get_wells_page(0, 10, 'owner', descending)
+            by_offset = [well.well_id for offset in range(0, filtered, 10)
+                         for well in get_wells_page(offset, 10, 'owner', descending)[2]]
+
+            by_keyset, page = [], first_page
+            while page:
+                by_keyset += [well.well_id for well in page]
+                page = get_wells_page(0, 10, 'owner', descending, after=(page[-1].owner, page[-1].well_id))[2]
+
+            self.assertEqual(by_keyset, by_offset)
+            self.assertEqual(len(by_keyset), filtered)
+
+            # Back from the second page to the first
+            second_page = get_wells_page(10, 10, 'owner', descending)[2]
+            previous = get_wells_page(0, 10, 'owner', descending, before=(second_page[0].owner,
+                                                                           second_page[0].well_id))[2]
+            self.assertEqual([well.well_id for well in previous], by_offset[:10])
+
+    def test_prefix_search(self):
+        self.assertGreater(get_wells_page(search='owner 1')[1], 0)
+        self.assertEqual(get_wells_page(search='provo')[1], get_wells_page()[0])
+        self.assertEqual(get_wells_page(search='aquifer')[1], 0)
+
+    def test_counts_and_center_cached(self):
+        cache.clear()
+        location = json.dumps({'type': 'GeometryCollection',
+                               'geometries': [{'type': 'Point', 'coordinates': [-87.0, 16.0]}]})
+        version = get_wells_version()
+        self.assertEqual(get_wells_counts(version), (23, 23))
+        self.assertEqual(get_map_center(version), [-111.0, 40.0])
+
+        # With the counts given, paging only reads the page
+        counts = get_wells_counts(version, 'owner 1')
+        self.statements = []
+        event.listen(Engine, 'before_cursor_execute', self.record_statement)
+        try:
+            total, filtered, rows = get_wells_page(search='owner 1', counts=counts)
+        finally:
+            event.remove(Engine, 'before_cursor_execute', self.record_statement)
+        self.assertEqual(((total, filtered), len(rows)), (counts, counts[1]))
+        self.assertFalse([s for s in self.statements if 'count(' in s.lower()])
+
+        add_new_well(location, 'Well 9', 'USGS', 'Provo Aquifer', '2000')
+        remove_session()
+        self.assertEqual(get_wells_counts(get_wells_version()), (24, 24))
+        self.assertEqual(get_map_center(get_wells_version()), [-110.0, 39.0])
+        self.assertEqual(get_wells_counts(version), (23, 23))
+
+    def record_statement(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement)
+
+
+class BenchmarkComparisonTestCase(TethysTestCase):
+    """
+    Benchmark results fail against the baseline when slower, larger or chattier beyond the tolerance.
+    """
+
+    def set_up(self):
+        self.baseline = {'results': {
+            'home[wells=1000]': {'median_ms': 100.0, 'p95_ms': 120.0, 'queries': 2, 'peak_kb': 500.0},
+        }}
+
+    def tear_down(self):
+        pass
+
+    def results(self, **changes):
+        result = dict(self.baseline['results']['home[wells=1000]'], **changes)
+        return {'results': {'home[wells=1000]': result}}
+
+    def test_within_tolerance(self):
+        self.assertEqual(compare_results(self.results(median_ms=120.0, peak_kb=600.0), self.baseline), [])
+
+    def test_slower(self):
+        self.assertEqual(len(compare_results(self.results(median_ms=130.0), self.baseline)), 1)
+
+    def test_more_memory(self):
+        self.assertEqual(len(compare_results(self.results(peak_kb=700.0), self.baseline)), 1)
+
+    def test_more_queries(self):
+        self.assertEqual(len(compare_results(self.results(queries=3), self.baseline)), 1)
+
+    def test_missing_benchmark_skipped(self):
+        self.assertEqual(compare_results({'results': {}}, self.baseline), [])
+
+
+class AlignSeriesTestCase(TethysTestCase):
+    """
+    Series are averaged into the same bins, empty bins left NaN, within the total point budget.
+    """
+
+    def set_up(self):
+        pass
+
+    def tear_down(self):
+        pass
+
+    def test_bin_means(self):
+        times, matrix = align_series([([0, 1, 2, 9], [1.0, 3.0, 5.0, 7.0]), ([5], [4.0])], 0, 10, 5)
+
+        self.assertEqual(times.tolist(), [1.0, 3.0, 5.0, 7.0, 9.0])
+        self.assertEqual(matrix[0, [0, 1, 4]].tolist(), [2.0, 5.0, 7.0])
+        self.assertTrue(isnan(matrix[0, 2]) and isnan(matrix[0, 3]))
+        self.assertEqual(matrix[1, 2], 4.0)
+
+    def test_points_capped(self):
+        self.assertLessEqual(50 * bins_per_series(50), TOTAL_POINTS)
+
+
+class ExportTestCase(TethysTestCase):
+    """
+    Hydrograph exports hold every point of the selected wells, labelled by well id, whatever the chunk size.
+    """
+
+    def set_up(self):
+        self.create_test_persistent_stores_for_app(WellInventory)
+        session = get_session()
+        wells = [Well(latitude=40.0, longitude=-111.0, name='Export 0'.format(i), owner='USGS',
+                      river='Provo Aquifer', date_built='2000') for i in range(3)]
+        session.add_all(wells)
+        session.commit()
+        self.well_ids = [well.id for well in wells]
+        remove_session()
+
+        # The last well has no hydrograph and is left out
+        replace_hydrograph(self.well_ids[0], BytesIO(b'0,1.5\n1,2.5\n2,3.25\n'))
+        replace_hydrograph(self.well_ids[1], BytesIO(b'5,-0.5\n'))
+        remove_session()
+        self.expected = [[self.well_ids[0], 0, 1.5], [self.well_ids[0], 1, 2.5], [self.well_ids[0], 2, 3.25],
+                         [self.well_ids[1], 5, -0.5]]
+
+    def tear_down(self):
+        remove_session()
+        self.destroy_test_persistent_stores_for_app(WellInventory)
+
+    def test_csv_gzip(self):
+        for chunk_size in (1, 2, 1000):
+            content = gzip.decompress(b''.join(export_hydrographs(get_comparison_wells(limit=None), CSV_GZIP,
+                                                                  chunk_size)))
+            lines = content.decode('ascii').splitlines()
+
+            self.assertEqual(lines[0], 'well_id,time,depth')
+            rows = [[int(well_id), int(time), float(depth)] for well_id, time, depth in
+                    (line.split(',') for line in lines[1:])]
+            self.assertEqual(sorted(rows), sorted(self.expected))
+
+    def test_no_wells(self):
+        self.assertEqual(gzip.decompress(b''.join(export_hydrographs([]))), b'well_id,time,depth\n')
+
+    def test_parquet(self):
+        try:
+            import pyarrow.parquet as pq
+        except ImportError:
+            self.assertRaises(ValueError, export_hydrographs, [], PARQUET)
+            return
+
+        content = b''.join(export_hydrographs(get_comparison_wells(limit=None), PARQUET, chunk_size=2))
+        table = pq.read_table(BytesIO(content))
+        rows = [list(row) for row in zip(*(table.column(name).to_pylist() for name in ('well_id', 'time', 'depth')))]
+        self.assertEqual(sorted(rows), sorted(self.expected))
+
+    def test_unknown_format(self):
+        self.assertRaises(ValueError, export_hydrographs, [], 'xlsx')
+
+
+class StatisticsTestCase(TethysTestCase):
+    """
+    Statistics of series with known values: exact for the readings, percentiles and trends of the daily means.
+    """
+
+    def set_up(self):
+        pass
+
+    def tear_down(self):
+        pass
+
+    def statistics(self, times, flows):
+        builder = PyramidBuilder()
+        builder.add(times, flows)
+        daily_times, counts, mins, means, maxs = builder.build()[LEVELS[0]]
+        return compute_statistics(np.zeros(len(daily_times), dtype=int), daily_times, counts, mins, means, maxs)[0]
+
+    def test_one_day(self):
+        statistics = self.statistics([0, 1, 2, 3], [1.0, 2.0, 3.0, 9.0])
+
+        self.assertEqual((statistics['count'], statistics['minimum'], statistics['maximum'], statistics['mean']),
+                         (4, 1.0, 9.0, 3.75))
+        self.assertEqual((statistics['daily_p10'], statistics['daily_median'], statistics['daily_p90']),
+                         (3.75, 3.75, 3.75))
+        self.assertIsNone(statistics['linear_trend'])
+
+    def test_daily_percentiles(self):
+        statistics = self.statistics([0, 24, 48, 72, 96, 97], [1.0, 2.0, 3.0, 4.0, 9.0, 11.0])
+
+        self.assertEqual((statistics['count'], statistics['mean']), (6, 5.0))
+        self.assertAlmostEqual(statistics['daily_p10'], 1.4)
+        self.assertAlmostEqual(statistics['daily_median'], 3.0)
+        self.assertAlmostEqual(statistics['daily_p90'], 7.6)
+
+    def test_trends(self):
+        times = np.arange(0, 3 * int(HOURS_PER_YEAR), 6)
+        statistics = self.statistics(times, 2.0 + 3.0 * times / HOURS_PER_YEAR)
+
+        self.assertAlmostEqual(statistics['linear_trend'], 3.0, places=4)
+        self.assertAlmostEqual(statistics['drawdown_rate'], 3.0, places=4)
+        self.assertAlmostEqual(statistics['sens_slope'], 3.0, delta=0.05)
+
+    def test_groups(self):
+        statistics = compute_statistics([1, 1, 2], [0, 24, 0], [1, 1, 2], [1.0, 3.0, 5.0], [1.0, 3.0, 6.0],
+                                        [1.0, 3.0, 7.0])
+
+        self.assertEqual((statistics[1]['count'], statistics[1]['mean']), (2, 2.0))
+        self.assertEqual((statistics[2]['count'], statistics[2]['minimum'], statistics[2]['maximum']), (2, 5.0, 7.0))
+
+
+class TelemetryTestCase(TethysTestCase):
+    """
+    Logger readings are parsed from JSON lines, refused once the buffer is full and dropped when they keep failing.
+    """
+
+    def set_up(self):
+        pass
+
+    def tear_down(self):
+        pass
+
+    def test_parse_json_lines(self):
+        well_ids, site_numbers, times, depths = parse_json_lines(
+            '{"well_id": 1, "time": [0, 1], "depth": [2.5, 3.0]}\n\n{"site": "A1", "time": 2, "depth": 4.0}')
+
+        self.assertEqual(well_ids, [1, 1, None])
+        self.assertEqual(site_numbers, [None, None, 'A1'])
+        self.assertEqual(times.tolist(), [0, 1, 2])
+        self.assertEqual(depths.tolist(), [2.5, 3.0, 4.0])
+        self.assertRaises(ValueError, parse_json_lines, '{"time": 1, "depth": 1.0}')
+
+    def test_backpressure(self):
+        written = []
+        buffer = TelemetryBuffer(capacity=3, flush_size=3, flush_seconds=60, write=lambda *args: written.append(args))
+        buffer.add([1, 1], [0, 1], [1.0, 2.0])
+
+        self.assertRaises(BufferFull, buffer.add, [1, 1], [2, 3], [3.0, 4.0])
+        self.assertTrue(buffer.flush())
+        self.assertEqual(buffer.stats()['pending'], 0)
+        self.assertEqual(buffer.add([1], [2], [3.0]), 1)
+
+    def test_failing_readings_dropped(self):
+        written = []
+
+        def write(well_ids, times, depths):
+            if 99 in list(well_ids):
+                raise ValueError('Cannot write well 99.')
+            written.extend(times)
+
+        buffer = TelemetryBuffer(capacity=10, flush_size=10, flush_seconds=60, write=write, max_attempts=2)
+        buffer.add([1], [0], [1.0])
+        buffer.add([99], [0], [1.0])
+
+        # The grouped write fails, then readings are retried one request at a time and the failing ones dropped
+        self.assertFalse(buffer.flush())
+        self.assertFalse(buffer.flush())
+        self.assertEqual(written, [0])
+        self.assertEqual((buffer.stats()['dropped'], buffer.stats()['pending']), (1, 0))
+        self.assertTrue(buffer.flush())
+
+    def test_time_out_of_range(self):
+        self.assertRaises(ValueError, parse_readings, b'{"well_id": 1, "time": 3e9, "depth": 1.0}', JSON_LINES)
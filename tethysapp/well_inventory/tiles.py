@@ -0,0 +1,43 @@
+"""
+Tiling of the wells layer. Tiles are square in degrees: at zoom z the world is split in tiles 360 / 2 ** z degrees
+wide, numbered from the top-left corner (-180, 90), matching ol.tilegrid.createXYZ over the EPSG:4326 extent.
+"""
+MAX_ZOOM = 18
+CLUSTER_MAX_ZOOM = 10  #: below this zoom, wells sharing a grid cell are returned as one cluster
+CLUSTER_GRID_SIZE = 8  #: cells per tile side, 32 px cells for 256 px tiles
+
+
+def tile_size(z):
+    """
+    Width and height of a tile at zoom z, in degrees.
+    """
+    return 360.0 / 2 ** z
+
+
+def tile_bounds(z, x, y):
+    """
+    Get (minx, miny, maxx, maxy) of tile z/x/y in degrees.
+    """
+    if not 0 <= z <= MAX_ZOOM:
+        raise ValueError('Zoom must be between 0 and {0}.'.format(MAX_ZOOM))
+
+    size = tile_size(z)
+    minx = -180.0 + x * size
+    maxy = 90.0 - y * size
+    return minx, maxy - size, minx + size, maxy
+
+
+def feature_collection(features):
+    """
+    Wrap GeoJSON features in an EPSG:4326 FeatureCollection.
+    """
+    return {
+        'type': 'FeatureCollection',
+        'crs': {
+            'type': 'name',
+            'properties': {
+                'name': 'EPSG:4326'
+            }
+        },
+        'features': features
+    }